@@ -1,5 +1,3 @@
-import collections
-
 import numpy as np
 
 from flyvr.control.experiment import Experiment
@@ -30,9 +28,8 @@ class _MyExperiment(Experiment):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._rand = np.random.RandomState()
-        # a rolling list of the last N speed measurements, filtered
-        # with np.mean to remove noise
-        self._speed_hist = collections.deque(maxlen=self.FILTER_LEN)
+        # the mean of the last N speed measurements, to remove noise
+        self._speed = self.statistics.window('speed', self.FILTER_LEN)
 
     @property
     def is_started_and_ready_audio_daq(self):
@@ -46,15 +43,15 @@ class _MyExperiment(Experiment):
 
     def process_state(self, state):
         if self.is_started_and_ready_audio_daq:
-            self._speed_hist.append(state.speed)
-            if np.mean(state.speed) > self.SPEED_THRESHOLD:
+            self.statistics.update(state)
+            if self._speed.mean > self.SPEED_THRESHOLD:
                 item_daq = self._rand.choice(self.configured_playlist_items[Experiment.BACKEND_DAQ])
                 self.play_playlist_item(Experiment.BACKEND_DAQ, item_daq)
                 item_audio = self._rand.choice(self.configured_playlist_items[Experiment.BACKEND_AUDIO])
                 self.play_playlist_item(Experiment.BACKEND_AUDIO, item_audio)
 
                 self.log.info('switched to daq:%s and audio:%s (speed=%s frame=%s)' % (
-                    item_daq, item_audio, np.mean(state.speed), state.frame_cnt))
+                    item_daq, item_audio, self._speed.mean, state.frame_cnt))
 
 
 experiment = _MyExperiment()
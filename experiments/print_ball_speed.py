@@ -1,7 +1,3 @@
-import collections
-
-import numpy as np
-
 from flyvr.control.experiment import Experiment
 
 # A small experiment for printing when the fly (ball) speed
@@ -22,12 +18,12 @@ class _MyExperiment(Experiment):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self._speed_hist = collections.deque(maxlen=self.FILTER_LEN)
+        self._speed = self.statistics.window('speed', self.FILTER_LEN)
 
     def process_state(self, state):
-        self._speed_hist.append(state.speed)
-        if np.mean(state.speed) > self.SPEED_THRESHOLD:
-            print("SPIN ", state.frame_cnt, "=", np.mean(state.speed))
+        self.statistics.update(state)
+        if self._speed.mean > self.SPEED_THRESHOLD:
+            print("SPIN ", state.frame_cnt, "=", self._speed.mean)
 
 
 experiment = _MyExperiment()
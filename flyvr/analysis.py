@@ -4,6 +4,8 @@ import h5py
 import numpy as np
 import pandas as pd
 
+from flyvr.audio.daq_preview import scale_raw
+
 
 STRUCTURE = {
     'fictrac': {'ext': '.h5', 'data': '/fictrac/output', 'sync_info': '', 'base': 'fictrac_frame_num'},
@@ -59,8 +61,14 @@ def load_sync_info_fictrac(path):
         return df.drop_duplicates(subset='time_ns', keep='last'), {'sample_rate': None, 'chunk_size': 1}
 
 
-def _df_from_h5group(g):
+def _df_from_h5group(g, scaled=True):
     cols = [g.attrs['column_%d' % i].decode('utf-8') for i in range(len([ci for ci in g.attrs.keys() if ci.startswith('column_')]))]
+
+    # raw DAQ input is stored as ADC counts, only converted to volts here
+    coeffs = g.attrs.get('scaling_coefficients')
+    if scaled and (coeffs is not None):
+        return pd.DataFrame(scale_raw(g[:], coeffs), columns=cols)
+
     return pd.DataFrame(g[:], columns=cols)
 
 
@@ -187,7 +195,15 @@ def build_timebase_converter(toc, common_base='time_ns'):
                       common_base=common_base)
 
 
-def data_to_df(toc, what):
+def data_to_df(toc, what, scaled=True):
+    """
+    Load the data of a backend (e.g. the DAQ input samples).
+
+    :param toc: The path to the YYYYMMDD_HHMM.toc.yml file of the experiment.
+    :param what: The backend ('daq', 'fictrac', 'sound').
+    :param scaled: If the DAQ input was recorded raw (as ADC counts), convert it to volts.
+    :return: A DataFrame, or None if the backend records no data.
+    """
     path = _get_path(toc, what)
     struct = STRUCTURE[what]
 
@@ -195,7 +211,7 @@ def data_to_df(toc, what):
         return None
 
     with h5py.File(path, mode='r') as f:
-        return _df_from_h5group(f[struct['data']])
+        return _df_from_h5group(f[struct['data']], scaled=scaled)
 
 
 if __name__ == "__main__":
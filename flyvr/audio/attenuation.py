@@ -1,14 +1,23 @@
 import numpy as np
-from scipy.interpolate import interp1d
-
-import flyvr.audio.stimuli
 
 
 class Attenuator(object):
+    """
+    Attenuates signals according to a table of frequency dependent attenuation factors. Factors for frequencies not in
+    the table are linearly interpolated from a sorted lookup table that is built once, and every factor is memoized so
+    building playlists with many stimuli at the same frequencies does not repeat the interpolation.
+    """
+
     def __init__(self, attenuation_factors):
-        self.frequencies = list(attenuation_factors.keys())
-        self.factors = list(attenuation_factors.values())
-        self.attenuation_factors = attenuation_factors
+        self.attenuation_factors = dict(attenuation_factors)
+
+        self.frequencies = sorted(self.attenuation_factors.keys())
+        self.factors = [self.attenuation_factors[f] for f in self.frequencies]
+
+        self._frequency_table = np.array(self.frequencies, dtype=np.float64)
+        self._factor_table = np.array(self.factors, dtype=np.float64)
+
+        self._factor_cache = dict(self.attenuation_factors)
 
     @classmethod
     def load_from_file(cls, filename):
@@ -21,27 +30,78 @@ class Attenuator(object):
 
         return cls(attenuation_factors)
 
-    def attenuate(self, data, frequency):
+    def _check_range(self, frequencies):
+        lo, hi = self._frequency_table[0], self._frequency_table[-1]
+        if np.any((frequencies < lo) | (frequencies > hi)):
+            raise ValueError("frequencies %r outside of the attenuation table range (%s - %s Hz)" % (
+                frequencies[(frequencies < lo) | (frequencies > hi)].tolist(), lo, hi))
+
+    def get_factor(self, frequency):
+        """
+        Get the attenuation factor for a frequency, interpolating linearly between table entries if necessary.
+
+        :param float frequency: The frequency in Hz.
+        :return: The attenuation factor.
+        :rtype: float
+        """
+        try:
+            return self._factor_cache[frequency]
+        except KeyError:
+            self._check_range(np.array([frequency], dtype=np.float64))
+            factor = float(np.interp(frequency, self._frequency_table, self._factor_table))
+            self._factor_cache[frequency] = factor
+            return factor
+
+    def get_factors(self, frequencies):
+        """
+        Get the attenuation factors for many frequencies at once. All uncached frequencies are interpolated in a
+        single vectorized pass and memoized, so this is also used to warm the cache when building a playlist.
+
+        :param frequencies: A sequence of frequencies in Hz. None entries (no attenuation) get a factor of 1.0.
+        :return: The attenuation factor for each frequency.
+        :rtype: numpy.ndarray
+        """
+        frequencies = list(frequencies)
+
+        missing = sorted(set(f for f in frequencies if (f is not None) and (f not in self._factor_cache)))
+        if missing:
+            _missing = np.array(missing, dtype=np.float64)
+            self._check_range(_missing)
+            for f, factor in zip(missing, np.interp(_missing, self._frequency_table, self._factor_table).tolist()):
+                self._factor_cache[f] = factor
+
+        return np.array([1.0 if f is None else self._factor_cache[f] for f in frequencies], dtype=np.float64)
+
+    def attenuate(self, data, frequency, out=None):
+        """
+        Attenuate the data by the factor for the given frequency.
+
+        :param numpy.ndarray data: The signal to attenuate.
+        :param float frequency: The frequency of the signal in Hz. If None, the data is returned unchanged.
+        :param numpy.ndarray out: If given, write the attenuated signal here (may be data itself, for in-place
+        scaling) instead of allocating a new array.
+        :return: The attenuated signal.
+        :rtype: numpy.ndarray
+        """
 
         # Frequency determines the attenuation, if it is None, then just pass
         # back the original data unchanged. Some stimulation data does not
         # need attenuation and this handles those cases.
         if frequency is None:
+            if (out is not None) and (out is not data):
+                out[...] = data
+                return out
             return data
 
-        # Otherwise, we need attenuate the data based on the frequency and the pre-loaded
-        # attenuation factors.
-        else:
-
-            # Lookup the attenuation factor, if we find it, scale the data.
-            try:
-                attenuation_factor = self.attenuation_factors[frequency]
-            except:
-                # If we don't find it, then we need to linearly interpolate between the
-                # values to get the right factor.
+        return np.multiply(data, self.get_factor(frequency), out=out)
 
-                interpolator = interp1d(list(self.attenuation_factors.keys()), list(self.attenuation_factors.values()),
-                                        kind='linear')
-                attenuation_factor = interpolator(frequency)
+    def attenuate_inplace(self, data, frequency):
+        """
+        Attenuate the data in place by the factor for the given frequency.
 
-        return data * attenuation_factor
+        :param numpy.ndarray data: The (floating point) signal to attenuate.
+        :param float frequency: The frequency of the signal in Hz. If None, the data is left unchanged.
+        :return: The (same) attenuated signal.
+        :rtype: numpy.ndarray
+        """
+        return self.attenuate(data, frequency, out=data)
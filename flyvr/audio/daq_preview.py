@@ -0,0 +1,184 @@
+import time
+import ctypes
+
+import numpy as np
+
+from flyvr.fictrac.shmem_transfer_data import new_named_mmap
+
+
+def scale_raw(data, scaling_coefficients):
+    """
+    Convert raw DAQ input (ADC counts) to volts.
+
+    :param numpy.ndarray data: The (samples x channels) raw input.
+    :param numpy.ndarray scaling_coefficients: The (channels x order) polynomial coefficients, zeroth order first.
+    :return: The (samples x channels) input in volts, as float64.
+    :rtype: numpy.ndarray
+    """
+    data = data.reshape((data.shape[0], -1))
+    out = np.empty(data.shape, dtype=np.float64)
+    for cn, coeffs in enumerate(scaling_coefficients):
+        out[:, cn] = np.polynomial.polynomial.polyval(data[:, cn].astype(np.float64), coeffs)
+    return out
+
+
+class SHMEMDAQPreviewHeader(ctypes.Structure):
+    _fields_ = [
+        ('seq', ctypes.c_int64),
+        ('bin_count', ctypes.c_int64),
+        ('num_channels', ctypes.c_int32),
+        ('num_bins', ctypes.c_int32),
+        ('samples_per_bin', ctypes.c_int32),
+        ('closed', ctypes.c_int32),
+        ('sample_rate', ctypes.c_double),
+    ]
+
+
+class DAQPreview(object):
+    """
+    A min/max decimated preview of the DAQ input for live plotting, published through shared memory. The input is
+    reduced to num_bins bins (the min and max of every channel) covering the last history_seconds, kept in a ring in
+    shared memory, so the plotting process can redraw at its own (fixed) rate and never receives the full rate data.
+
+    The DAQ process publishes (writer=True), the plotting process reads with an identically constructed object
+    (writer=False). Reads are consistent with writes via a sequence counter (a seqlock).
+    """
+
+    SHMEM_NAME = 'FlyVRDAQPreviewSHMEM'
+
+    def __init__(self, num_channels, sample_rate, history_seconds=5.0, num_bins=1000, writer=True,
+                 name=SHMEM_NAME, scaling_coefficients=None):
+        """
+        :param int num_channels: The number of input channels.
+        :param float sample_rate: The input sample rate in Hz.
+        :param float history_seconds: The length of input covered by the preview.
+        :param int num_bins: The number of min/max bins covering the history.
+        :param bool writer: True for the publishing side, which initializes the shared memory.
+        :param str name: The name of the shared memory block.
+        :param numpy.ndarray scaling_coefficients: For raw (ADC count) input, the (channels x order) polynomial
+        coefficients (zeroth order first) which convert counts to volts. The bins (not the input) are converted.
+        """
+        self.num_channels = int(num_channels)
+        self.num_bins = int(num_bins)
+        self.sample_rate = float(sample_rate)
+        self.samples_per_bin = max(1, int(round(history_seconds * self.sample_rate / self.num_bins)))
+        self.scaling_coefficients = scaling_coefficients
+
+        header_size = ctypes.sizeof(SHMEMDAQPreviewHeader)
+        ring_size = self.num_bins * self.num_channels
+
+        self._buf = new_named_mmap(header_size + 2 * ring_size * 8, name)
+        # noinspection PyTypeChecker
+        self._header = SHMEMDAQPreviewHeader.from_buffer(self._buf)
+        self._min = np.frombuffer(self._buf, dtype=np.float64, count=ring_size,
+                                  offset=header_size).reshape((self.num_bins, self.num_channels))
+        self._max = np.frombuffer(self._buf, dtype=np.float64, count=ring_size,
+                                  offset=header_size + ring_size * 8).reshape((self.num_bins, self.num_channels))
+
+        # the running min/max of the bin being filled
+        self._partial_n = 0
+        self._partial_min = np.full(self.num_channels, np.inf)
+        self._partial_max = np.full(self.num_channels, -np.inf)
+
+        if writer:
+            h = self._header
+            h.seq += 1
+            self._min[:] = 0.
+            self._max[:] = 0.
+            h.bin_count = 0
+            h.num_channels = self.num_channels
+            h.num_bins = self.num_bins
+            h.samples_per_bin = self.samples_per_bin
+            h.sample_rate = self.sample_rate
+            h.closed = 0
+            h.seq += 1
+
+    @property
+    def closed(self):
+        return bool(self._header.closed)
+
+    def close(self):
+        self._header.closed = 1
+
+    def publish(self, data):
+        """
+        Add a block of input to the preview.
+
+        :param numpy.ndarray data: The (samples x channels) block of input.
+        """
+        data = data.reshape((data.shape[0], -1))
+        spb = self.samples_per_bin
+
+        mins, maxs = [], []
+
+        # finish the bin left partially filled by the last block
+        i = 0
+        if self._partial_n:
+            i = min(spb - self._partial_n, len(data))
+            np.minimum(self._partial_min, data[:i].min(axis=0), out=self._partial_min)
+            np.maximum(self._partial_max, data[:i].max(axis=0), out=self._partial_max)
+            self._partial_n += i
+            if self._partial_n == spb:
+                mins.append(self._partial_min[np.newaxis].copy())
+                maxs.append(self._partial_max[np.newaxis].copy())
+                self._partial_n = 0
+
+        # all whole bins at once
+        nb = (len(data) - i) // spb
+        if nb:
+            bins = data[i:i + nb * spb].reshape((nb, spb, self.num_channels))
+            mins.append(bins.min(axis=1))
+            maxs.append(bins.max(axis=1))
+            i += nb * spb
+
+        # and start the next partial bin
+        if i < len(data):
+            self._partial_n = len(data) - i
+            self._partial_min[:] = data[i:].min(axis=0)
+            self._partial_max[:] = data[i:].max(axis=0)
+
+        if mins:
+            mins, maxs = np.concatenate(mins), np.concatenate(maxs)
+            if self.scaling_coefficients is not None:
+                mins, maxs = scale_raw(mins, self.scaling_coefficients), scale_raw(maxs, self.scaling_coefficients)
+            self._write_bins(mins, maxs)
+
+    def _write_bins(self, mins, maxs):
+        h = self._header
+        n = len(mins)
+        if n > self.num_bins:
+            mins, maxs = mins[-self.num_bins:], maxs[-self.num_bins:]
+
+        idx = (h.bin_count + np.arange(n - len(mins), n)) % self.num_bins
+
+        h.seq += 1
+        self._min[idx] = mins
+        self._max[idx] = maxs
+        h.bin_count += n
+        h.seq += 1
+
+    def read(self):
+        """
+        :return: The number of bins published so far, and copies of the min and max of every bin (oldest first) as
+        (num_bins x channels) arrays.
+        """
+        h = self._header
+        while True:
+            seq = h.seq
+            if seq % 2:
+                time.sleep(0)
+                continue
+
+            count = h.bin_count
+            mins, maxs = self._min.copy(), self._max.copy()
+            if h.seq == seq:
+                break
+
+        shift = -(count % self.num_bins)
+        return count, np.roll(mins, shift, axis=0), np.roll(maxs, shift, axis=0)
+
+    def bin_times(self):
+        """
+        :return: The time of every bin relative to the newest, in seconds.
+        """
+        return (np.arange(self.num_bins) - (self.num_bins - 1)) * (self.samples_per_bin / self.sample_rate)
@@ -7,28 +7,46 @@ import threading
 from typing import Optional
 
 
-import PyDAQmx as daq
-# noinspection PyUnresolvedReferences
-from PyDAQmx.DAQmxFunctions import (DAQmxCreateTask, DAQmxCreateAOVoltageChan,
-                                    DAQmxCfgSampClkTiming, DAQmxStartTask,
-                                    DAQmxWriteAnalogScalarF64, DAQmxWaitForNextSampleClock, DAQmxStopTask,
-                                    DAQmxClearTask)
-# noinspection PyUnresolvedReferences
-from PyDAQmx.DAQmxConstants import (DAQmx_Val_RSE, DAQmx_Val_Volts, DAQmx_Val_Rising, DAQmx_Val_HWTimedSinglePoint,
-                                    DAQmx_Val_Acquired_Into_Buffer, DAQmx_Val_ContSamps,
-                                    DAQmx_Val_Transferred_From_Buffer,
-                                    DAQmx_Val_DoNotAllowRegen, DAQmx_Val_AllowRegen, DAQmx_Val_GroupByChannel,
-                                    DAQmx_Val_Auto, DAQmx_Val_WaitInfinitely, DAQmx_Val_GroupByScanNumber,
-                                    DAQmx_Val_Diff,
-                                    DAQmx_Val_ChanPerLine)
+try:
+    import PyDAQmx as daq
+    # noinspection PyUnresolvedReferences
+    from PyDAQmx.DAQmxFunctions import (DAQmxCreateTask, DAQmxCreateAOVoltageChan,
+                                        DAQmxCfgSampClkTiming, DAQmxStartTask,
+                                        DAQmxWriteAnalogScalarF64, DAQmxWaitForNextSampleClock, DAQmxStopTask,
+                                        DAQmxClearTask)
+    # noinspection PyUnresolvedReferences
+    from PyDAQmx.DAQmxConstants import (DAQmx_Val_RSE, DAQmx_Val_Volts, DAQmx_Val_Rising,
+                                        DAQmx_Val_HWTimedSinglePoint,
+                                        DAQmx_Val_Acquired_Into_Buffer, DAQmx_Val_ContSamps,
+                                        DAQmx_Val_Transferred_From_Buffer,
+                                        DAQmx_Val_DoNotAllowRegen, DAQmx_Val_AllowRegen, DAQmx_Val_GroupByChannel,
+                                        DAQmx_Val_Auto, DAQmx_Val_WaitInfinitely, DAQmx_Val_GroupByScanNumber,
+                                        DAQmx_Val_Diff,
+                                        DAQmx_Val_ChanPerLine)
+except (ImportError, NotImplementedError):
+    # no NI-DAQmx library (PyDAQmx raises NotImplementedError on unsupported platforms), so only the
+    # simulated DAQ is available
+    from flyvr.audio import simulated_daq as daq
+    # noinspection PyUnresolvedReferences
+    from flyvr.audio.simulated_daq import (DAQmx_Val_RSE, DAQmx_Val_Volts, DAQmx_Val_Rising,
+                                           DAQmx_Val_HWTimedSinglePoint,
+                                           DAQmx_Val_Acquired_Into_Buffer, DAQmx_Val_ContSamps,
+                                           DAQmx_Val_Transferred_From_Buffer,
+                                           DAQmx_Val_DoNotAllowRegen, DAQmx_Val_AllowRegen, DAQmx_Val_GroupByChannel,
+                                           DAQmx_Val_Auto, DAQmx_Val_WaitInfinitely, DAQmx_Val_GroupByScanNumber,
+                                           DAQmx_Val_Diff,
+                                           DAQmx_Val_ChanPerLine)
 
 import numpy as np
 from ctypes import byref, c_ulong
 
-from flyvr.audio.signal_producer import chunker, SampleChunk, chunk_producers_differ, SignalProducer
+from flyvr.audio.signal_producer import chunker, SampleChunk, chunk_producers_differ, SignalProducer, splice_chunks, \
+    pad_channels, MixedSignal
 from flyvr.audio.stimuli import AudioStim, AudioStimPlaylist, stimulus_factory
 from flyvr.audio.util import get_paylist_object
-from flyvr.common import BACKEND_DAQ, SharedState
+from flyvr.audio.daq_preview import DAQPreview
+from flyvr.audio.simulated_daq import SimulatedTask
+from flyvr.common import BACKEND_DAQ, SharedState, ScheduledPlay
 from flyvr.common.concurrent_task import ConcurrentTask
 from flyvr.common.plot_task import plot_task_daq
 from flyvr.common.build_arg_parser import setup_logging
@@ -36,6 +54,9 @@ from flyvr.common.ipc import PlaylistReciever
 
 DAQ_SAMPLE_RATE_DEFAULT = 10000
 
+# analog output is written with WriteAnalogF64, so stimuli are rendered in this dtype
+DAQ_OUTPUT_DTYPE = np.float64
+
 DAQ_NUM_OUTPUT_SAMPLES = 5000
 DAQ_NUM_OUTPUT_SAMPLES_PER_EVENT = 250
 DAQ_NUM_INPUT_SAMPLES = 10000
@@ -63,18 +84,19 @@ class IOTask(daq.Task):
     def __init__(self, dev_name="Dev1", cha_ids=("ai0",), cha_type="input", cha_names=(),
                  limits=10.0, rate=DAQ_SAMPLE_RATE_DEFAULT,
                  num_samples_per_chan=None, num_samples_per_event=None, digital=False, has_callback=True,
-                 shared_state=None, done_callback=None, use_RSE=True):
+                 shared_state=None, done_callback=None, use_RSE=True, raw=False):
         # check inputs
-        daq.Task.__init__(self)
+        self._init_task()
 
         self._log = logging.getLogger('flyvr.daq.IOTask')
 
         _digital = 'digital' if digital else 'analog'
         self._log.info(f'DAQ:{dev_name}: {_digital}{cha_type}/{cha_ids} (limits: {limits}, '
                        f'SR: {rate}, nSamp/ch: {num_samples_per_chan}, '
-                       f'nSamp/event: {num_samples_per_event}, RSE: {use_RSE})')
+                       f'nSamp/event: {num_samples_per_event}, RSE: {use_RSE}, raw: {raw})')
 
         self.dev_name = dev_name
+        self.rate = rate
 
         if not isinstance(cha_ids, (list, tuple)):
             cha_ids = [cha_ids]
@@ -90,6 +112,11 @@ class IOTask(daq.Task):
         # Is this a digital task
         self.digital = digital
 
+        # analog input can be read and stored as unscaled ADC counts (int16), along with the per-channel polynomial
+        # coefficients (zeroth order first) which convert them to volts
+        self.raw = raw and (cha_type == "input") and not digital
+        self.scaling_coefficients = None
+
         # A function to call on task completion
         self.done_callback = done_callback
 
@@ -116,8 +143,15 @@ class IOTask(daq.Task):
         self._data_generator = None
         self._data_recorders = None
 
+        # a decimated preview of the (analog) input for live plotting
+        self.preview = None  # type: Optional[DAQPreview]
+
         self._silence_chunk = None  # type: Optional[SampleChunk]
         self._last_chunk = None  # type: Optional[SampleChunk]
+        self._output_latency_ns = None
+
+        # a playlist item (and its data generator) to switch to at an exact sample
+        self._scheduled = None
 
         if self.cha_type is "input":
             if not self.digital:
@@ -134,6 +168,11 @@ class IOTask(daq.Task):
             self.GetTaskNumChans(nChans)
             self.num_channels = nChans.value
 
+            if self.raw:
+                self.scaling_coefficients = np.zeros((self.num_channels, 4), dtype=np.float64)
+                for cn, ch in enumerate(_full_cha_ids):
+                    self.GetAIDevScalingCoeff(ch, self.scaling_coefficients[cn], self.scaling_coefficients.shape[1])
+
             if has_callback:
                 self.AutoRegisterEveryNSamplesEvent(DAQmx_Val_Acquired_Into_Buffer, self.num_samples_per_event, 0)
                 self.CfgInputBuffer(self.num_samples_per_chan * self.num_channels * 4)
@@ -171,15 +210,33 @@ class IOTask(daq.Task):
                                                    str(cname),
                                                    attribute_name='column_%d' % cn)
 
+            # every row describes one block written to all output channels
+            for cn, cname in enumerate(cha_names or cha_ids):
+                self.flyvr_shared_state.logger.log("/daq/chunk_synchronization_info",
+                                                   str(cname),
+                                                   attribute_name='output_channel_%d' % cn)
+
+            ScheduledPlay.create_h5_log(self.flyvr_shared_state.logger, "/daq/scheduled_play_info")
+
         elif cha_type == "input" and not digital:
             self.samples_dset_name = "/daq/input/samples"
             self.samples_sync_dset_name = "/daq/input/synchronization_info"
 
-            self.flyvr_shared_state.logger.create(self.samples_dset_name,
-                                                  shape=[512, self.num_channels],
-                                                  maxshape=[None, self.num_channels],
-                                                  chunks=(512, self.num_channels),
-                                                  dtype=np.float64, scaleoffset=8)
+            if self.raw:
+                self.flyvr_shared_state.logger.create(self.samples_dset_name,
+                                                      shape=[512, self.num_channels],
+                                                      maxshape=[None, self.num_channels],
+                                                      chunks=(512, self.num_channels),
+                                                      dtype=np.int16)
+                self.flyvr_shared_state.logger.log(self.samples_dset_name,
+                                                   self.scaling_coefficients,
+                                                   attribute_name='scaling_coefficients')
+            else:
+                self.flyvr_shared_state.logger.create(self.samples_dset_name,
+                                                      shape=[512, self.num_channels],
+                                                      maxshape=[None, self.num_channels],
+                                                      chunks=(512, self.num_channels),
+                                                      dtype=np.float64, scaleoffset=8)
             self.flyvr_shared_state.logger.log(self.samples_dset_name,
                                                int(rate),
                                                attribute_name='sample_rate')
@@ -245,7 +302,9 @@ class IOTask(daq.Task):
                                                H5_SYNC_VERSION,
                                                attribute_name='__version')
 
-        if not digital:
+        if self.raw:
+            self._data = np.zeros((self.num_samples_per_chan, self.num_channels), dtype=np.int16)
+        elif not digital:
             self._data = np.zeros((self.num_samples_per_chan, self.num_channels),
                                   dtype=np.float64)  # init empty data array
         else:
@@ -273,11 +332,19 @@ class IOTask(daq.Task):
                 self.SetWriteRegenMode(DAQmx_Val_DoNotAllowRegen)
                 self.CfgOutputBuffer(self.num_samples_per_chan * self.num_channels * 2)
 
+                # a chunk is written when there is room for it, so is generated after the rest of the output buffer
+                # (this does not include the on-board FIFO of the device), for the playlist item TOC
+                self._output_latency_ns = int(1e9 * (self.num_samples_per_chan * self.num_channels * 2 -
+                                                     self.num_samples_per_event) / rate)
+
                 self.EveryNCallback()  # fill buffer on init
         else:
             self.SetWriteRegenMode(DAQmx_Val_AllowRegen)
             self.CfgOutputBuffer(self.num_samples_per_chan * self.num_channels * 2)
 
+    def _init_task(self):
+        daq.Task.__init__(self)
+
     def stop(self):
         if self._data_generator is not None:
             self._data = self._data_generator.close()
@@ -287,6 +354,10 @@ class IOTask(daq.Task):
                 data_rec.finish()
                 data_rec.close()
 
+        if self.preview is not None:
+            # the plotting process exits when the preview is closed
+            self.preview.close()
+
     def play_signal_producer_item(self, item):
         if isinstance(self._signal_producer, AudioStimPlaylist):
             try:
@@ -294,12 +365,44 @@ class IOTask(daq.Task):
                 self._log.info('playing playlist item identifier: %s' % item)
 
                 with self._data_lock:
-                    chunked_gen = chunker(data_generator, chunk_size=self.num_samples_per_event)
+                    chunked_gen = self._chunk_output(data_generator)
                     self._data_generator = chunked_gen
 
             except ValueError as _exc:
                 self._log.warning('error playing playlist item: %s' % _exc)
 
+    def schedule_signal_producer_item(self, sched: ScheduledPlay):
+        if isinstance(self._signal_producer, AudioStimPlaylist):
+            try:
+                data_generator = pad_channels(self._signal_producer.play_item(sched.identifier), self.num_channels)
+                self._log.info('scheduling playlist item: %r' % sched)
+
+                # the switch to the new generator happens in the callback
+                with self._data_lock:
+                    self._scheduled = sched, data_generator
+
+            except ValueError as _exc:
+                self._log.warning('error scheduling playlist item: %s' % _exc)
+
+    def _start_scheduled(self):
+        sched, gen = self._scheduled
+
+        # the counter is the number of the first sample of the chunk about to be written
+        counter = self.flyvr_shared_state.DAQ_OUTPUT_NUM_SAMPLES_WRITTEN
+        tns = self.flyvr_shared_state.TIME_NS
+
+        # (so the item leaves the DAQ, rather than is written, at the scheduled time)
+        latency = self._output_latency_ns or 0
+
+        n = sched.counts_until(counter, tns, self.rate, latency)
+        if n < self.num_samples_per_event:
+            offset = max(0, n)
+            self._data_generator = splice_chunks(self._data_generator, gen, offset, self.num_samples_per_event)
+            self._scheduled = None
+
+            sched.log_achieved(self.flyvr_shared_state.logger, "/daq/scheduled_play_info",
+                               counter + offset, counter, tns, self.rate, latency)
+
     def play_pause(self, pause):
         if isinstance(self._signal_producer, AudioStimPlaylist):
             self._log.info('changing status to paused=%s' % pause)
@@ -312,9 +415,14 @@ class IOTask(daq.Task):
 
         data_generator = stim.data_generator()
         with self._data_lock:
-            chunked_gen = chunker(data_generator, chunk_size=self.num_samples_per_event)
+            chunked_gen = self._chunk_output(data_generator)
             self._data_generator = chunked_gen
 
+    def _chunk_output(self, data_generator):
+        # every block is written to all output channels at once (interleaved, GroupByScanNumber), so signals with
+        # fewer channels than the task are padded with silent channels
+        return chunker(pad_channels(data_generator, self.num_channels), chunk_size=self.num_samples_per_event)
+
     @property
     def data_recorders(self):
         return self._data_recorders
@@ -349,7 +457,11 @@ class IOTask(daq.Task):
 
             if self.cha_type is "input":
                 tns = self.flyvr_shared_state.TIME_NS
-                if not self.digital:
+                if self.raw:
+                    self.ReadBinaryI16(DAQmx_Val_Auto, 1.0, DAQmx_Val_GroupByScanNumber,
+                                       self._data, self.num_samples_per_chan * self.num_channels, daq.byref(self.read),
+                                       None)
+                elif not self.digital:
                     self.ReadAnalogF64(DAQmx_Val_Auto, 1.0, DAQmx_Val_GroupByScanNumber,
                                        self._data, self.num_samples_per_chan * self.num_channels, daq.byref(self.read),
                                        None)
@@ -375,8 +487,15 @@ class IOTask(daq.Task):
                 self.flyvr_shared_state.logger.log(self.samples_sync_dset_name,
                                                    np.array(row, dtype=np.int64))
 
+                if self.preview is not None:
+                    self.preview.publish(self._data)
+
             elif self.cha_type is "output":
 
+                # switch to a scheduled item exactly at its scheduled sample, part way through this chunk if necessary
+                if self._scheduled is not None:
+                    self._start_scheduled()
+
                 if self._data_generator is None:
                     chunk = self._silence_chunk
                 else:
@@ -424,7 +543,8 @@ class IOTask(daq.Task):
                                                                          sound_output_num_samples_written=row[3],
                                                                          video_output_num_frames=row[4],
                                                                          # and a time for replay experiments
-                                                                         time_ns=row[5])
+                                                                         time_ns=row[5],
+                                                                         output_latency_ns=self._output_latency_ns)
 
                     self.flyvr_shared_state.DAQ_OUTPUT_NUM_SAMPLES_WRITTEN += self._data.shape[0]
                     self._last_chunk = chunk
@@ -453,6 +573,28 @@ class IOTask(daq.Task):
         return 0  # The function should return an integer
 
 
+if issubclass(IOTask, SimulatedTask):
+    SimulatedIOTask = IOTask
+else:
+    # noinspection PyPep8Naming
+    class SimulatedIOTask(SimulatedTask, IOTask):
+        """
+        An IOTask running against the simulated DAQ (see flyvr.audio.simulated_daq) rather than NI hardware.
+        """
+
+        def __init__(self, *args, **kwargs):
+            IOTask.__init__(self, *args, **kwargs)
+
+        def _init_task(self):
+            SimulatedTask.__init__(self)
+
+        def EveryNCallback(self):
+            return IOTask.EveryNCallback(self)
+
+        def DoneCallback(self, status):
+            return IOTask.DoneCallback(self, status)
+
+
 # noinspection PyPep8Naming
 def io_task_loop(msg_queue: queue.Queue, flyvr_shared_state, options):
 
@@ -469,23 +611,21 @@ def io_task_loop(msg_queue: queue.Queue, flyvr_shared_state, options):
 
     analog_out_channels = tuple(sorted(options.analog_out_channels))
 
-    if len(analog_out_channels) > 1:
-        raise NotImplementedError('only a single DAQ output channel is supported')
-
     daq_stim, _ = get_paylist_object(options, playlist_type='daq',
                                      paused_fallback=False,
                                      default_repeat=1,  # repeat=1 is more sensible for DAQ?
-                                     attenuator=None)
+                                     attenuator=None,
+                                     dtype=DAQ_OUTPUT_DTYPE)
 
     if daq_stim is not None:
         try:
-            if daq_stim.num_channels != 1:
-                raise NotImplementedError('only a single DAQ output channel is supported '
-                                          '(yet the playlist has 2 channels of data)')
+            if daq_stim.num_channels > max(1, len(analog_out_channels)):
+                raise ValueError('the DAQ playlist has %d channels of data but only %d analog output channels are '
+                                 'configured' % (daq_stim.num_channels, len(analog_out_channels)))
         except AttributeError:
             log.warning('assuming num_channels=1 from paused playlist')
 
-    is_analog_out = (daq_stim is not None) and len(analog_out_channels) == 1
+    is_analog_out = (daq_stim is not None) and len(analog_out_channels) > 0
 
     sr = int(options.samplerate_daq)
     if daq_stim is not None:
@@ -497,6 +637,11 @@ def io_task_loop(msg_queue: queue.Queue, flyvr_shared_state, options):
     if sr != DAQ_SAMPLE_RATE_DEFAULT:
         log.warning('changing DAQ sample rate from default %s to %s' % (DAQ_SAMPLE_RATE_DEFAULT, sr))
 
+    task_class = IOTask
+    if getattr(options, 'simulate_daq', False) or (task_class is SimulatedIOTask):
+        log.warning('using the simulated DAQ (analog outputs are looped back to analog inputs)')
+        task_class = SimulatedIOTask
+
     # noinspection PyBroadException
     try:
 
@@ -511,23 +656,25 @@ def io_task_loop(msg_queue: queue.Queue, flyvr_shared_state, options):
             if is_analog_out:
                 # Get the input and output channels from the options
                 output_chans = ["ao" + str(s) for s in analog_out_channels]
-                taskAO = IOTask(cha_ids=output_chans, cha_type="output",
+                output_chan_names = [options.analog_out_channels[s] for s in analog_out_channels]
+                taskAO = task_class(cha_ids=output_chans, cha_type="output", cha_names=output_chan_names,
+                                    rate=sr,
+                                    num_samples_per_chan=DAQ_NUM_OUTPUT_SAMPLES,
+                                    num_samples_per_event=DAQ_NUM_OUTPUT_SAMPLES_PER_EVENT,
+                                    shared_state=flyvr_shared_state)
+
+            taskAI = task_class(cha_ids=input_chans, cha_type="input", cha_names=input_chan_names,
                                 rate=sr,
-                                num_samples_per_chan=DAQ_NUM_OUTPUT_SAMPLES,
-                                num_samples_per_event=DAQ_NUM_OUTPUT_SAMPLES_PER_EVENT,
-                                shared_state=flyvr_shared_state)
-
-            taskAI = IOTask(cha_ids=input_chans, cha_type="input", cha_names=input_chan_names,
-                            rate=sr,
-                            num_samples_per_chan=DAQ_NUM_INPUT_SAMPLES,
-                            num_samples_per_event=DAQ_NUM_INPUT_SAMPLES_PER_EVENT,
-                            shared_state=flyvr_shared_state, use_RSE=options.use_RSE)
+                                num_samples_per_chan=DAQ_NUM_INPUT_SAMPLES,
+                                num_samples_per_event=DAQ_NUM_INPUT_SAMPLES_PER_EVENT,
+                                shared_state=flyvr_shared_state, use_RSE=options.use_RSE,
+                                raw=options.daq_input_raw)
 
-            disp_task = ConcurrentTask(task=plot_task_daq, comms="pipe",
-                                       taskinitargs=[input_chan_names, taskAI.num_samples_per_chan, 5])
+            # the display task plots a decimated preview of the input, published through shared memory
+            taskAI.preview = DAQPreview(taskAI.num_channels, sr, scaling_coefficients=taskAI.scaling_coefficients)
+            disp_task = ConcurrentTask(task=plot_task_daq, comms=None,
+                                       taskinitargs=[input_chan_names, sr, 5])
 
-            # Setup the display task to receive messages from recording task.
-            taskAI.data_recorders = [disp_task]
             # start disp early so the user sees something
             disp_task.start()
 
@@ -559,8 +706,10 @@ def io_task_loop(msg_queue: queue.Queue, flyvr_shared_state, options):
                 try:
                     msg = msg_queue.get(timeout=0.1)
                     if taskAO is not None:
-                        if isinstance(msg, AudioStim):
+                        if isinstance(msg, (AudioStim, MixedSignal)):
                             taskAO.set_signal_producer(msg)
+                        elif isinstance(msg, ScheduledPlay):
+                            taskAO.schedule_signal_producer_item(msg)
                         elif isinstance(msg, str):
                             if msg in {'play', 'pause'}:
                                 taskAO.play_pause(pause=msg == 'pause')
@@ -604,10 +753,10 @@ def _ipc_main(q, basedirs):
             # noinspection PyBroadException
             try:
                 if 'daq' in elem:
-                    stim = stimulus_factory(**elem['daq'], basedirs=basedirs)
+                    stim = stimulus_factory(**elem['daq'], basedirs=basedirs, dtype=DAQ_OUTPUT_DTYPE)
                     q.put(stim)
                 elif 'daq_item' in elem:
-                    q.put(elem['daq_item']['identifier'])
+                    q.put(ScheduledPlay.from_message(elem['daq_item']) or elem['daq_item']['identifier'])
                 elif 'daq_action' in elem:
                     q.put(elem['daq_action'])
                 else:
@@ -1,5 +1,8 @@
 import abc
 import copy
+import logging
+import itertools
+import threading
 
 from typing import Optional, Callable, Iterator
 
@@ -81,27 +84,51 @@ class SignalProducer(object, metaclass=abc.ABCMeta):
     and others inherit from this class to standardize their interface.
     """
 
-    # keep track of every instance of a signal producer class.
+    # keep track of every instance of a signal producer class (they may be created concurrently, see build_stimuli)
     instances_created = 0
+    _instances_lock = threading.Lock()
 
-    SUPPORTED_DTYPES = np.float64,
+    # the classes which were warned about finding their layout by running their generator
+    _warned_generator_layout = set()
+
+    # the first is the default. signals should be rendered in the native dtype of the backend that plays them (float32
+    # for the sound card, float64 for the NI-DAQ) so that no conversion happens during playback
+    SUPPORTED_DTYPES = np.float64, np.float32
 
     def __init__(self, type_, instance_identifier,
-                 next_event_callback: Optional[CallbackFunction] = None):
+                 next_event_callback: Optional[CallbackFunction] = None, dtype=None):
 
         self.backend = None
 
-        self.producer_instance_n = SignalProducer.instances_created
-        SignalProducer.instances_created += 1
+        with SignalProducer._instances_lock:
+            self.producer_instance_n = SignalProducer.instances_created
+            SignalProducer.instances_created += 1
 
         self.type = type_
         self.identifier = instance_identifier
-        self.dtype = np.float64
+        self.dtype = SignalProducer.check_dtype(dtype)
 
         self._next_event_callbacks = []
         if next_event_callback is not None:
             self._next_event_callbacks.append(next_event_callback)
 
+    @staticmethod
+    def check_dtype(dtype):
+        """
+        Normalize and check a sample dtype.
+
+        :param dtype: A numpy dtype, scalar type, or name (e.g. 'float32'). None selects the default (float64).
+        :return: The numpy scalar type.
+        """
+        if dtype is None:
+            return SignalProducer.SUPPORTED_DTYPES[0]
+
+        _dtype = np.dtype(dtype).type
+        if _dtype not in SignalProducer.SUPPORTED_DTYPES:
+            raise ValueError("unsupported signal dtype: %s (supported: %s)" % (
+                dtype, ', '.join(np.dtype(d).name for d in SignalProducer.SUPPORTED_DTYPES)))
+        return _dtype
+
     def initialize(self, backend):
         self.backend = backend
 
@@ -126,7 +153,7 @@ class SignalProducer(object, metaclass=abc.ABCMeta):
 
         :return: The number of channels (or columns) in the data chunk.
         """
-        data = next(self.data_generator()).data
+        data = self._first_chunk_for_layout('num_channels').data
 
         if data.ndim == 1:
             return 1
@@ -140,9 +167,29 @@ class SignalProducer(object, metaclass=abc.ABCMeta):
 
         :return: Number of samples for each data chunk.
         """
-        data = next(self.data_generator()).data
+        data = self._first_chunk_for_layout('num_samples').data
         return data.shape[0]
 
+    def _first_chunk_for_layout(self, what):
+        # running a generator to find the layout may be slow or have side effects (e.g. drawing from a playlist's
+        # randomizer), so producers should override num_channels and num_samples from their metadata
+        cls = self.__class__
+        if cls not in SignalProducer._warned_generator_layout:
+            SignalProducer._warned_generator_layout.add(cls)
+            logging.getLogger('flyvr.audio.SignalProducer').warning(
+                '%s does not define %s, running its generator to find it' % (cls.__name__, what))
+        return next(self.data_generator())
+
+    @property
+    def chunks_per_play(self):
+        """
+        Get the number of chunks yielded by this signal producer's generator for one complete playback of the
+        signal. Most producers yield their whole signal in a single chunk, but streaming producers yield it in blocks.
+
+        :return: Number of data chunks per playback.
+        """
+        return 1
+
 
 def chunker(gen, chunk_size=100) -> Iterator[Optional[SampleChunk]]:
     """
@@ -221,16 +268,100 @@ def chunker(gen, chunk_size=100) -> Iterator[Optional[SampleChunk]]:
             chunk_mixed = True
 
 
+def splice_chunks(chunked_gen, gen, offset, chunk_size) -> Iterator[Optional[SampleChunk]]:
+    """
+    Switch a stream of fixed size chunks to a new signal part way through the next chunk, for sample accurate
+    scheduled starts. The next chunk contains the first offset samples of chunked_gen (or silence if that is None)
+    followed by the start of the new signal, and like any chunk spanning two producers it is marked as mixed with
+    mixed_start_offset = offset. All following chunks come only from the new signal.
+
+    :param chunked_gen: The current chunked generator (as returned by chunker), or None if playing silence.
+    :param gen: A generator function that returns SampleChunk objects of the new signal.
+    :param offset: The sample within the next chunk at which the new signal starts, 0 <= offset < chunk_size.
+    :param chunk_size: The number of elements along the first dimension to include in each chunk.
+    :return: A generator function that returns chunks.
+    """
+    assert 0 <= offset < chunk_size
+
+    if offset == 0:
+        return chunker(gen, chunk_size)
+
+    head = next(chunked_gen) if chunked_gen is not None else None
+
+    def _spliced():
+        first = next(gen)
+        if head is not None:
+            _head = copy.copy(head)  # type: SampleChunk
+            _head.data = head.data[:offset]
+        else:
+            shape = (offset, ) if (first is None) else ((offset, ) + first.data.shape[1:])
+            _head = SampleChunk.new_silence(np.zeros(shape, dtype=np.float64 if first is None else first.data.dtype))
+
+        yield _head
+        yield first
+        yield from gen
+
+    return chunker(_spliced(), chunk_size)
+
+
+def pad_channels(gen, num_channels) -> Iterator[Optional[SampleChunk]]:
+    """
+    Widen the chunks of a signal to num_channels channels. Signals with fewer channels are written to the first
+    channels, and the remaining channels are silent. Chunks that already have num_channels channels are passed through
+    unchanged (not copied).
+
+    :param gen: A generator function that returns SampleChunk objects.
+    :param num_channels: The number of channels (columns) of the returned chunks.
+    :return: A generator function that returns chunks.
+    """
+    for chunk in gen:
+        if chunk is not None:
+            data = chunk.data
+            width = 1 if data.ndim == 1 else data.shape[1]
+            if width > num_channels:
+                raise ValueError('signal %s has %d channels, more than %d' % (chunk.producer_identifier,
+                                                                                width, num_channels))
+            elif (width < num_channels) or (data.ndim == 1 and num_channels > 1):
+                padded = np.zeros((data.shape[0], num_channels), dtype=data.dtype)
+                padded[:, :width] = data.reshape((data.shape[0], width))
+
+                chunk = copy.copy(chunk)  # type: SampleChunk
+                chunk.data = padded
+
+        yield chunk
+
+
+def max_chunk_samples(signal):
+    """
+    :return: The largest chunk (number of samples) the signal's generator yields, from its metadata.
+    """
+    if isinstance(signal, MixedSignal):
+        # (its num_samples is its chunk size)
+        return signal.num_samples
+    return int(np.ceil(signal.num_samples / float(signal.chunks_per_play)))
+
+
 class MixedSignal(SignalProducer):
     """
     The MixedSignal class is a simple class that takes a list of signal producer objects as it's input and combines them
     into one signal producer that generates a channel for each. Basically it combines data stored in different numpy
     arrays into a one array.
+
+    The channel layout is declared from the metadata of the signals (num_channels, num_samples) so no generator is run
+    to probe it. Mixed blocks are (samples x channels) channel-interleaved arrays written into a ring of preallocated
+    buffers, so a yielded block is not modified until ring_size - 1 further blocks have been generated, which makes it
+    safe to hold on to a few blocks (as buffering / prefetching consumers do) without copying.
     """
 
-    def __init__(self, stims, identifier=None, next_event_callback=None):
+    DEFAULT_RING_SIZE = 4
+
+    def __init__(self, stims, identifier=None, next_event_callback=None, chunk_size=None, ring_size=DEFAULT_RING_SIZE):
         """
         Create the MixedSignal object that will combine these stims into one signal
+
+        :param stims: The signal producers, one or more channels each.
+        :param chunk_size: The number of samples in each mixed block. Default is the largest chunk of any signal.
+        :param ring_size: The number of preallocated output blocks to cycle through.
         """
 
         dtypes = set(s.dtype for s in stims)
@@ -238,63 +369,85 @@ class MixedSignal(SignalProducer):
             raise ValueError("Cannot created mixed signal from signals with different dtypes: %s" % (
                 ', '.join('%s:%s' % (s.identifier, s.dtype) for s in stims)))
         _dtype = dtypes.pop()
-        assert _dtype == SignalProducer.SUPPORTED_DTYPES[0]
+        assert _dtype in SignalProducer.SUPPORTED_DTYPES
+
+        if ring_size < 2:
+            raise ValueError('ring_size must be >= 2')
 
         self._stims = stims
 
         super(MixedSignal, self).__init__(type_='_mixed',
                                           instance_identifier=identifier or '|'.join(s.identifier for s in stims),
-                                          next_event_callback=next_event_callback)
-
-        # Grab a chunk from each generator to see how big their chunks are, we will need to make sure they are all the
-        # same size later when we output a single chunk with multiple channels.
-        data_gens = [s.data_generator() for s in self._stims]
-        chunk_sizes = [next(gen).data.shape[0] for gen in data_gens]
-
-        # Get the number of channels for each signal
-        self.chunk_widths = []
-        for gen in data_gens:
-            chunk = next(gen).data
-            if chunk.data.ndim == 1:
-                self.chunk_widths.append(1)
-            else:
-                self.chunk_widths.append(chunk.data.shape[1])
-
-        self.chunk_size = max(chunk_sizes)
+                                          next_event_callback=next_event_callback,
+                                          dtype=_dtype)
+
+        # the number of channels of each signal, and the largest chunk any of them yield, are known without running
+        # their generators. every signal is re-chunked to the same size so it can be copied into one block
+        self.chunk_widths = [s.num_channels for s in self._stims]
+        self.chunk_size = int(chunk_size or max(max_chunk_samples(s) for s in self._stims))
         self.chunk_width = sum(self.chunk_widths)
 
-        self._data = np.zeros((self.chunk_size, self.chunk_width), dtype=self.dtype)
+        # the output column range of each signal
+        offsets = np.cumsum([0] + self.chunk_widths)
+        self._channel_slices = [slice(lo, hi) for lo, hi in zip(offsets[:-1], offsets[1:])]
+
+        self._ring = np.zeros((ring_size, self.chunk_size, self.chunk_width), dtype=self.dtype)
+
+        # one play is as long as the longest signal (shorter signals repeat)
+        def _play_samples(_s):
+            return (_s.num_samples * _s.chunks_per_play) if isinstance(_s, MixedSignal) else _s.num_samples
+
+        self._chunks_per_play = max(int(np.ceil(_play_samples(s) / float(self.chunk_size))) for s in self._stims)
+
+    @property
+    def num_channels(self):
+        return self.chunk_width
+
+    @property
+    def sample_rate(self):
+        rates = set(getattr(s, 'sample_rate', None) for s in self._stims)
+        if len(rates) > 1:
+            raise ValueError('mixed signal %s has signals with different sample rates: %s' % (
+                self.identifier, ', '.join('%s:%s' % (s.identifier, getattr(s, 'sample_rate', None))
+                                           for s in self._stims)))
+        return rates.pop()
+
+    @property
+    def chunks_per_play(self):
+        return self._chunks_per_play
+
+    @property
+    def num_samples(self):
+        return self.chunk_size
+
+    @property
+    def ring_size(self):
+        return self._ring.shape[0]
 
     def data_generator(self) -> Iterator[Optional[SampleChunk]]:
         """
         Create a data generator for this signal. Each signal passed to the constructor will be yielded as a separate
-        column of the data chunk returned by this generator.
+        column (or columns) of the data chunk returned by this generator. Signals that yield None (e.g. a paused
+        playlist) are silent for that chunk.
         """
 
         # Initialize data generators for these signals in the play list.
         # Wrap each generator in a chunker with the same size.
         data_gens = [chunker(s.data_generator(), self.chunk_size) for s in self._stims]
+        columns = [(gen, sl, self.chunk_size) for gen, sl in zip(data_gens, self._channel_slices)]
 
-        while True:
-
-            # Get the next set of chunks, one for each channel.
-            chunks = [next(gen) for gen in data_gens]
+        for n in itertools.count():
+            block = self._ring[n % self._ring.shape[0]]
 
-            # Copy each chunk
-            channel_idx = 0
-            for i in range(len(chunks)):
-
-                # This should not happen.
-                assert chunks[i].data.shape[0] == self._data.shape[0]
-
-                if chunks[i].data.ndim == 1:
-                    self._data[:, channel_idx] = chunks[i].data
+            # Copy the next chunk of each signal into its columns
+            for gen, sl, chunk_size in columns:
+                chunk = next(gen)
+                if chunk is None:
+                    block[:, sl] = 0
                 else:
-                    self._data[:, channel_idx:channel_idx + self.chunk_widths[i]] = chunks[i].data
-
-                channel_idx = channel_idx + self.chunk_widths[i]
+                    block[:, sl] = chunk.data.reshape((chunk_size, -1))
 
-            chunk = SampleChunk(data=self._data, producer_identifier=self.identifier,
+            chunk = SampleChunk(data=block, producer_identifier=self.identifier,
                                 producer_instance_n=self.producer_instance_n)
             self.trigger_next_callback(chunk)
             yield chunk
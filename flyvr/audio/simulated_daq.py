@@ -0,0 +1,466 @@
+# -*- coding: utf-8 -*-
+"""
+A pure python simulation of the subset of the NI-DAQmx (PyDAQmx) Task API used by
+:class:`flyvr.audio.io_task.IOTask`, so the DAQ output path, input logging and chunker integration can be
+run, tested and profiled without NI hardware (or on platforms PyDAQmx does not support).
+
+Each task runs a real-time clock thread that calls ``EveryNCallback`` every N samples at the configured
+sample rate. Analog outputs are looped back to the analog inputs with the same index on the same device
+(``Dev1/ao0`` is read back on ``Dev1/ai0``), sample accurately, so output timing can be checked against the
+recorded input. Digital inputs read zeros. Late callbacks can be injected with
+:meth:`SimulatedTask.inject_late_callbacks`, which (if late enough) underflow the simulated output buffer.
+"""
+
+import time
+import ctypes
+import logging
+import threading
+import collections
+
+import numpy as np
+
+# the values of the NI-DAQmx constants used by flyvr (from NIDAQmx.h)
+DAQmx_Val_RSE = 10083
+DAQmx_Val_Diff = 10106
+DAQmx_Val_Volts = 10348
+DAQmx_Val_Rising = 10280
+DAQmx_Val_HWTimedSinglePoint = 12522
+DAQmx_Val_Acquired_Into_Buffer = 1
+DAQmx_Val_Transferred_From_Buffer = 2
+DAQmx_Val_ContSamps = 10123
+DAQmx_Val_DoNotAllowRegen = 10158
+DAQmx_Val_AllowRegen = 10097
+DAQmx_Val_GroupByChannel = 0
+DAQmx_Val_GroupByScanNumber = 1
+DAQmx_Val_Auto = -1
+DAQmx_Val_WaitInfinitely = -1.0
+DAQmx_Val_ChanPerLine = 0
+DAQmx_Val_OnBrdMemEmpty = 10235
+
+# the pass-by-reference types
+int32 = ctypes.c_int32
+float64 = ctypes.c_double
+byref = ctypes.byref
+
+# samples per channel of analog output kept for reading back on the analog inputs
+LOOPBACK_HISTORY = 2 ** 20
+
+
+class DAQError(RuntimeError):
+    pass
+
+
+def _ref_value(ref, value):
+    # set the value of a ctypes object passed directly or by byref()
+    if ref is not None:
+        getattr(ref, '_obj', ref).value = value
+
+
+def _expand_channels(cha_string):
+    """
+    Parse a DAQmx physical channel string (e.g. 'Dev1/ai0, Dev1/ai2:3') into (device, channel) tuples.
+    """
+    chans = []
+    for c in cha_string.split(','):
+        c = c.strip()
+        if not c:
+            continue
+        dev, _, chan = c.strip('/').partition('/')
+        prefix = chan.rstrip('0123456789:')
+        idxs = chan[len(prefix):]
+        if ':' in idxs:
+            a, b = map(int, idxs.split(':'))
+            step = 1 if b >= a else -1
+            chans.extend((dev, '%s%d' % (prefix, i)) for i in range(a, b + step, step))
+        else:
+            chans.append((dev, chan))
+    return chans
+
+
+class _LoopbackRing(object):
+
+    def __init__(self, size=LOOPBACK_HISTORY):
+        self._buf = np.zeros(size, dtype=np.float64)
+        self.written = 0
+
+    def write(self, data, start):
+        size = len(self._buf)
+        if len(data) > size:
+            data, start = data[-size:], start + len(data) - size
+        idx = np.arange(start, start + len(data)) % size
+        self._buf[idx] = data
+        self.written = max(self.written, start + len(data))
+
+    def read(self, start, n):
+        out = np.zeros(n, dtype=np.float64)
+        lo = max(start, self.written - len(self._buf), 0)
+        hi = min(start + n, self.written)
+        if hi > lo:
+            out[lo - start:hi - start] = self._buf[np.arange(lo, hi) % len(self._buf)]
+        return out
+
+
+class SimulatedDevice(object):
+    """
+    A simulated multifunction DAQ device, shared by all tasks with channels on it. It holds the analog output
+    loopback history and starts tasks armed on its analog input start trigger.
+    """
+
+    _devices = {}
+    _devices_lock = threading.Lock()
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._ao = {}
+        self._armed = []
+
+    @classmethod
+    def get(cls, name):
+        with cls._devices_lock:
+            try:
+                return cls._devices[name]
+            except KeyError:
+                dev = cls._devices[name] = cls(name)
+                return dev
+
+    def create_ao(self, chan):
+        with self._lock:
+            self._ao[chan] = _LoopbackRing()
+
+    def write_ao(self, chan, data, start):
+        with self._lock:
+            self._ao.setdefault(chan, _LoopbackRing()).write(data, start)
+
+    def read_ai(self, chan, start, n):
+        ao = 'ao' + chan[2:] if chan.startswith('ai') else None
+        with self._lock:
+            try:
+                return self._ao[ao].read(start, n)
+            except KeyError:
+                return np.zeros(n, dtype=np.float64)
+
+    def arm(self, task):
+        with self._lock:
+            self._armed.append(task)
+
+    def disarm(self, task):
+        with self._lock:
+            if task in self._armed:
+                self._armed.remove(task)
+
+    def trigger_ai_start(self, t0):
+        with self._lock:
+            armed, self._armed = self._armed, []
+        for task in armed:
+            # noinspection PyProtectedMember
+            task._sim_start_clock(t0)
+
+
+# noinspection PyPep8Naming,PyUnusedLocal
+class SimulatedTask(object):
+    """
+    A stand in for PyDAQmx.Task. Subclasses override ``EveryNCallback`` and ``DoneCallback`` exactly as they
+    would with the real class.
+    """
+
+    # the depth of the simulated on-board analog output FIFO. Output transfer events fire this many samples before
+    # the samples are generated, which is the slack a late callback has before the output underflows
+    ONBOARD_FIFO_SAMPLES = 8191
+
+    def __init__(self):
+        self._sim_log = logging.getLogger('flyvr.daq.SimulatedTask')
+
+        self._sim_chans = []
+        self._sim_kind = None
+        self._sim_ai_range = 10.0
+        self._sim_rate = None
+        self._sim_every_n = None
+        self._sim_every_n_type = None
+        self._sim_output_buffer_size = None
+        self._sim_start_trigger = None
+
+        self._sim_clock = None
+        self._sim_stop = threading.Event()
+        self._sim_t0 = None
+
+        self._sim_samples_clocked = 0
+        self._sim_read_pos = 0
+        self._sim_write_pos = 0
+
+        self._sim_fault_delay = 0.
+        self._sim_fault_every = 0
+        self._sim_fault_probability = None
+        self._sim_fault_rng = None
+
+        self._sim_lateness = collections.deque(maxlen=100000)
+        self._sim_duration = collections.deque(maxlen=100000)
+        self._sim_underflows = 0
+        self._sim_samples_lost = 0
+
+    def _sim_create_chans(self, kind, cha_string):
+        if self._sim_kind not in (None, kind):
+            raise DAQError('cannot mix %s and %s channels in one task' % (self._sim_kind, kind))
+        self._sim_kind = kind
+        self._sim_chans.extend(_expand_channels(cha_string))
+
+    @property
+    def _sim_device(self):
+        return SimulatedDevice.get(self._sim_chans[0][0])
+
+    # channels
+
+    def CreateAIVoltageChan(self, physicalChannel, nameToAssignToChannel, terminalConfig, minVal, maxVal, units,
+                            customScaleName):
+        self._sim_create_chans('ai', physicalChannel)
+        self._sim_ai_range = max(abs(minVal), abs(maxVal))
+
+    def CreateAOVoltageChan(self, physicalChannel, nameToAssignToChannel, minVal, maxVal, units, customScaleName):
+        self._sim_create_chans('ao', physicalChannel)
+        for dev, chan in _expand_channels(physicalChannel):
+            SimulatedDevice.get(dev).create_ao(chan)
+
+    def CreateDIChan(self, lines, nameToAssignToLines, lineGrouping):
+        self._sim_create_chans('di', lines)
+
+    def CreateDOChan(self, lines, nameToAssignToLines, lineGrouping):
+        self._sim_create_chans('do', lines)
+
+    def GetTaskNumChans(self, data):
+        _ref_value(data, len(self._sim_chans))
+
+    # timing, buffers and events
+
+    def CfgSampClkTiming(self, source, rate, activeEdge, sampleMode, sampsPerChan):
+        self._sim_rate = float(rate)
+
+    def CfgInputBuffer(self, bufferSize):
+        pass
+
+    def CfgOutputBuffer(self, bufferSize):
+        self._sim_output_buffer_size = int(bufferSize)
+
+    def SetWriteRegenMode(self, data):
+        pass
+
+    def SetAODataXferReqCond(self, channel, data):
+        pass
+
+    def AutoRegisterEveryNSamplesEvent(self, everyNsamplesEventType, nSamples, options):
+        self._sim_every_n_type = everyNsamplesEventType
+        self._sim_every_n = int(nSamples)
+
+    def AutoRegisterDoneEvent(self, options):
+        pass
+
+    def CfgDigEdgeStartTrig(self, triggerSource, triggerEdge):
+        if not triggerSource.endswith('ai/StartTrigger'):
+            raise DAQError('only the ai/StartTrigger start trigger is simulated')
+        self._sim_start_trigger = triggerSource
+
+    def EveryNCallback(self):
+        return 0
+
+    def DoneCallback(self, status):
+        return 0
+
+    # task control
+
+    def StartTask(self):
+        if self._sim_clock is not None:
+            raise DAQError('task already running')
+        if self._sim_start_trigger is not None:
+            self._sim_device.arm(self)
+            return
+
+        t0 = time.perf_counter()
+        if self._sim_kind == 'ai':
+            self._sim_device.trigger_ai_start(t0)
+        self._sim_start_clock(t0)
+
+    def StopTask(self):
+        self._sim_device.disarm(self)
+        self._sim_stop.set()
+        if (self._sim_clock is not None) and (self._sim_clock is not threading.current_thread()):
+            self._sim_clock.join()
+        self._sim_clock = None
+        self._sim_stop = threading.Event()
+
+    def ClearTask(self):
+        if self._sim_chans:
+            self.StopTask()
+
+    def _sim_start_clock(self, t0):
+        if self._sim_rate is None:
+            raise DAQError('sample clock timing not configured')
+
+        self._sim_t0 = t0
+        if self._sim_every_n:
+            self._sim_clock = threading.Thread(target=self._sim_clock_main, daemon=True,
+                                               name='SimulatedDAQ:%s' % ','.join('/'.join(c) for c in self._sim_chans))
+            self._sim_clock.start()
+
+    def _sim_generated(self):
+        # the number of samples the device has generated (or acquired) so far
+        return int((time.perf_counter() - self._sim_t0) * self._sim_rate)
+
+    def _sim_clock_main(self):
+        # output transfer events fire ahead of generation by the on-board FIFO depth
+        lead = self.ONBOARD_FIFO_SAMPLES if self._sim_kind in ('ao', 'do') else 0
+
+        n = 0
+        while not self._sim_stop.is_set():
+            n += 1
+            # (output resumes late after an underflow, so the transfer events do too)
+            due = self._sim_t0 + max(0, max(n * self._sim_every_n, self._sim_write_pos) - lead) / self._sim_rate
+            if self._sim_stop.wait(max(0., due - time.perf_counter())):
+                break
+
+            delay = self._sim_fault(n)
+            if delay > 0:
+                time.sleep(delay)
+
+            self._sim_samples_clocked = n * self._sim_every_n
+
+            t = time.perf_counter()
+            self._sim_lateness.append(t - due)
+            try:
+                self.EveryNCallback()
+            except Exception:
+                self._sim_log.error('error in EveryNCallback', exc_info=True)
+            self._sim_duration.append(time.perf_counter() - t)
+
+    def _sim_fault(self, n):
+        if self._sim_fault_probability is not None:
+            return self._sim_fault_delay if self._sim_fault_rng.random_sample() < self._sim_fault_probability else 0.
+        if self._sim_fault_every and ((n % self._sim_fault_every) == 0):
+            return self._sim_fault_delay
+        return 0.
+
+    # fault injection and statistics
+
+    def inject_late_callbacks(self, delay, every=1, probability=None, seed=None):
+        """
+        Delay EveryNCallback calls, to simulate a busy host.
+
+        :param float delay: How late (in seconds) to make affected callbacks. 0 disables fault injection.
+        :param int every: Delay every n-th callback.
+        :param float probability: If given, delay callbacks at random with this probability instead.
+        :param int seed: The seed for random delays.
+        """
+        self._sim_fault_delay = float(delay)
+        self._sim_fault_every = int(every)
+        self._sim_fault_probability = probability
+        self._sim_fault_rng = np.random.RandomState(seed)
+
+    def callback_stats(self):
+        """
+        :return: A dict of the number of callbacks, their lateness and duration (in seconds) and the number of
+        output underflows (and samples lost to them).
+        """
+        late = np.array(self._sim_lateness, dtype=np.float64)
+        dur = np.array(self._sim_duration, dtype=np.float64)
+        stats = {'n': len(late), 'underflows': self._sim_underflows, 'samples_lost': self._sim_samples_lost}
+        for name, a in (('lateness', late), ('duration', dur)):
+            stats['%s_mean' % name] = float(a.mean()) if len(a) else 0.
+            stats['%s_p99' % name] = float(np.percentile(a, 99)) if len(a) else 0.
+            stats['%s_max' % name] = float(a.max()) if len(a) else 0.
+        return stats
+
+    # reading and writing
+
+    def _sim_read_count(self, numSampsPerChan, arraySizeInSamps):
+        nch = len(self._sim_chans)
+        if self._sim_t0 is None:
+            raise DAQError('task not started')
+
+        available = (self._sim_samples_clocked if self._sim_every_n else self._sim_generated()) - self._sim_read_pos
+        n = available if numSampsPerChan == DAQmx_Val_Auto else int(numSampsPerChan)
+        return max(0, min(n, available, arraySizeInSamps // nch))
+
+    def _sim_read_ai(self, n):
+        dev = self._sim_device
+        return np.stack([dev.read_ai(chan, self._sim_read_pos, n) for _, chan in self._sim_chans], axis=1)
+
+    @staticmethod
+    def _sim_store(readArray, data, fillMode):
+        out = readArray.reshape(-1)
+        if fillMode == DAQmx_Val_GroupByScanNumber:
+            out[:data.size] = data.reshape(-1)
+        else:
+            out[:data.size] = data.T.reshape(-1)
+
+    def ReadAnalogF64(self, numSampsPerChan, timeout, fillMode, readArray, arraySizeInSamps, sampsPerChanRead,
+                      reserved):
+        n = self._sim_read_count(numSampsPerChan, arraySizeInSamps)
+        self._sim_store(readArray, self._sim_read_ai(n), fillMode)
+        self._sim_read_pos += n
+        _ref_value(sampsPerChanRead, n)
+
+    def GetAIDevScalingCoeff(self, channel, data, arraySizeInElements):
+        # an ideal 16-bit ADC spanning the input range
+        coeffs = np.zeros(arraySizeInElements, dtype=np.float64)
+        coeffs[1] = self._sim_ai_range / 32768.
+        data[:arraySizeInElements] = coeffs
+
+    def ReadBinaryI16(self, numSampsPerChan, timeout, fillMode, readArray, arraySizeInSamps, sampsPerChanRead,
+                      reserved):
+        n = self._sim_read_count(numSampsPerChan, arraySizeInSamps)
+        counts = np.clip(np.round(self._sim_read_ai(n) * (32768. / self._sim_ai_range)), -32768, 32767)
+        counts = counts.astype(np.int16)
+        self._sim_store(readArray, counts, fillMode)
+        self._sim_read_pos += n
+        _ref_value(sampsPerChanRead, n)
+
+    def ReadDigitalLines(self, numSampsPerChan, timeout, fillMode, readArray, arraySizeInBytes, sampsPerChanRead,
+                         numBytesPerSamp, reserved):
+        n = self._sim_read_count(numSampsPerChan, arraySizeInBytes)
+        self._sim_store(readArray, np.zeros((n, len(self._sim_chans)), dtype=readArray.dtype), fillMode)
+        self._sim_read_pos += n
+        _ref_value(sampsPerChanRead, n)
+        _ref_value(numBytesPerSamp, 1)
+
+    def _sim_write(self, numSampsPerChan, dataLayout, writeArray):
+        nch = len(self._sim_chans)
+        n = int(numSampsPerChan)
+
+        data = np.asarray(writeArray, dtype=np.float64).reshape(-1)[:n * nch]
+        if dataLayout == DAQmx_Val_GroupByScanNumber:
+            data = data.reshape(n, nch)
+        else:
+            data = data.reshape(nch, n).T
+
+        if self._sim_t0 is not None:
+            # samples the device needed before they were written are lost (output as zeros) and the output
+            # resumes at the current sample
+            generated = self._sim_generated()
+            if generated > self._sim_write_pos:
+                self._sim_underflows += 1
+                self._sim_samples_lost += generated - self._sim_write_pos
+                self._sim_log.warning('output underflow: %d samples lost' % (generated - self._sim_write_pos))
+                self._sim_write_pos = generated
+        return data
+
+    def WriteAnalogF64(self, numSampsPerChan, autoStart, timeout, dataLayout, writeArray, sampsPerChanWritten,
+                       reserved):
+        data = self._sim_write(numSampsPerChan, dataLayout, writeArray)
+        dev = self._sim_device
+        for i, (_, chan) in enumerate(self._sim_chans):
+            dev.write_ao(chan, data[:, i], self._sim_write_pos)
+        self._sim_write_pos += len(data)
+        _ref_value(sampsPerChanWritten, len(data))
+
+    def WriteDigitalLines(self, numSampsPerChan, autoStart, timeout, dataLayout, writeArray, sampsPerChanWritten,
+                          reserved):
+        data = self._sim_write(numSampsPerChan, dataLayout, writeArray)
+        self._sim_write_pos += len(data)
+        _ref_value(sampsPerChanWritten, len(data))
+
+    def WriteAnalogScalarF64(self, autoStart, timeout, value, reserved):
+        dev = self._sim_device
+        for _, chan in self._sim_chans:
+            dev.write_ao(chan, np.array([value], dtype=np.float64), self._sim_write_pos)
+        self._sim_write_pos += 1
+
+
+Task = SimulatedTask
@@ -11,8 +11,8 @@ import numpy as np
 import sounddevice as sd
 
 from flyvr.audio.stimuli import AudioStim, MixedSignal, AudioStimPlaylist
-from flyvr.audio.signal_producer import SampleChunk, chunker, chunk_producers_differ
-from flyvr.common import Randomizer, BACKEND_AUDIO
+from flyvr.audio.signal_producer import SampleChunk, chunker, chunk_producers_differ, splice_chunks
+from flyvr.common import Randomizer, ScheduledPlay, BACKEND_AUDIO
 from flyvr.common.build_arg_parser import setup_logging
 
 
@@ -72,8 +72,12 @@ class SoundServer(threading.Thread):
         self._silence_chunk = None  # type: Optional[SampleChunk]
         self._last_chunk = None  # type: Optional[SampleChunk]
 
+        # a playlist item (and its data generator) to switch to at an exact sample
+        self._scheduled = None
+
         self._stream = self._device = self._num_channels = \
             self._dtype = self._sample_rate = self._frames_per_buffer = None
+        self._output_latency_ns = None
 
         self._running = False
         self._q = queue.Queue()
@@ -175,6 +179,12 @@ class SoundServer(threading.Thread):
         """
         # fixme: need to make sure that all these other types emit signal_new_playlist_item
 
+        # stimuli should be rendered in the device dtype so blocks are not converted in the realtime callback
+        if isinstance(stim, (AudioStim, MixedSignal, AudioStimPlaylist)) and \
+                (np.dtype(stim.dtype) != np.dtype(self._dtype)):
+            self._log.warning('%r has dtype %s, not the output device dtype %s: every block will be converted '
+                              'during playback' % (stim, np.dtype(stim.dtype).name, np.dtype(self._dtype).name))
+
         # Make sure the user passed and AudioStim instance
         if isinstance(stim, AudioStim):
             if stim.sample_rate != self._sample_rate:
@@ -194,6 +204,10 @@ class SoundServer(threading.Thread):
         elif stim is None:
             self._log.info('playing nothing')
             self.data_generator = None
+        elif isinstance(stim, ScheduledPlay) and (self._stim_playlist is not None):
+            self._log.info('scheduling playlist item: %r' % stim)
+            # the generator is created here, the switch to it happens in the callback
+            self._scheduled = stim, self._stim_playlist.play_item(stim.identifier)
         elif isinstance(stim, str) and (self._stim_playlist is not None):
             if stim in {'play', 'pause'}:
                 self._log.info('changing status to %s' % stim)
@@ -275,6 +289,8 @@ class SoundServer(threading.Thread):
                                            H5_SYNC_VERSION,
                                            attribute_name='__version')
 
+        ScheduledPlay.create_h5_log(self.flyvr_shared_state.logger, "/audio/scheduled_play_info")
+
         # open stream using control
         self._stream = sd.OutputStream(device=self._device,
                                        samplerate=self._sample_rate, blocksize=self._frames_per_buffer,
@@ -284,6 +300,10 @@ class SoundServer(threading.Thread):
 
         self._log.info('opened %s @ %fHz' % (self._device, self._sample_rate))
 
+        # how long after a block is written it is heard (as reported by the device), for the playlist item TOC
+        self._output_latency_ns = int(self._stream.latency * 1e9)
+        self._log.info('output latency: %.1fms' % (self._stream.latency * 1e3))
+
         cbf = self._sample_rate / float(self._stream.blocksize)
         self._log.info('buffer size: %d (buffer callback called every %.3fs, at %.1fHz)' % (self._stream.blocksize,
                                                                                             1. / cbf, cbf))
@@ -325,6 +345,25 @@ class SoundServer(threading.Thread):
 
         self._log.info('stopped')
 
+    def _start_scheduled(self, frames):
+        sched, gen = self._scheduled
+
+        # the counter is the number of the first sample of this block
+        counter = self.flyvr_shared_state.SOUND_OUTPUT_NUM_SAMPLES_WRITTEN
+        tns = self.flyvr_shared_state.TIME_NS
+
+        # (so the item is heard, rather than is written, at the scheduled time)
+        latency = self._output_latency_ns or 0
+
+        n = sched.counts_until(counter, tns, self._sample_rate, latency)
+        if n < frames:
+            offset = max(0, n)
+            self._data_generator = splice_chunks(self._data_generator, gen, offset, frames)
+            self._scheduled = None
+
+            sched.log_achieved(self.flyvr_shared_state.logger, "/audio/scheduled_play_info",
+                               counter + offset, counter, tns, self._sample_rate, latency)
+
     def _make_callback(self):
         """
         Make control for the stream playback. Reference self.data_generator to get samples.
@@ -347,6 +386,10 @@ class SoundServer(threading.Thread):
                 raise sd.CallbackStop()
 
             try:
+                # Switch to a scheduled item exactly at its scheduled sample, part way through this block if necessary
+                if self._scheduled is not None:
+                    self._start_scheduled(frames)
+
                 # If we have no data generator set, then play silence. If not, call its next method
                 if self._data_generator is None:
                     chunk = self._silence_chunk
@@ -410,7 +453,8 @@ class SoundServer(threading.Thread):
                                                                  sound_output_num_samples_written=row[3],
                                                                  video_output_num_frames=row[4],
                                                                  # and a time for replay experiments
-                                                                 time_ns=row[5])
+                                                                 time_ns=row[5],
+                                                                 output_latency_ns=self._output_latency_ns)
 
             self.flyvr_shared_state.SOUND_OUTPUT_NUM_SAMPLES_WRITTEN += frames
             self._last_chunk = chunk
@@ -431,11 +475,12 @@ def _ipc_main(q, basedirs):
         elem = pr.get_next_element()
         if elem:
             if 'audio_legacy' in elem:
-                stim, = legacy_factory([elem['audio_legacy']], basedirs=basedirs)
+                stim, = legacy_factory([elem['audio_legacy']], basedirs=basedirs,
+                                       dtype=SoundServer.DEVICE_OUTPUT_DTYPE)
             elif 'audio' in elem:
-                stim = stimulus_factory(**elem['audio'], basedirs=basedirs)
+                stim = stimulus_factory(**elem['audio'], basedirs=basedirs, dtype=SoundServer.DEVICE_OUTPUT_DTYPE)
             elif 'audio_item' in elem:
-                stim = elem['audio_item']['identifier']
+                stim = ScheduledPlay.from_message(elem['audio_item']) or elem['audio_item']['identifier']
             elif 'audio_action' in elem:
                 stim = elem['audio_action']
             else:
@@ -460,7 +505,9 @@ def run_sound_server(options, quit_evt=None):
                                                  paused_fallback=getattr(options, 'paused', False),
                                                  # dudi requested to preserve the last default
                                                  default_repeat=Randomizer.REPEAT_FOREVER,
-                                                 attenuator=None)  # fixme: attenuator from config
+                                                 attenuator=None,  # fixme: attenuator from config
+                                                 # render and cache stimuli in the format played by the device
+                                                 dtype=SoundServer.DEVICE_OUTPUT_DTYPE)
     if playlist_stim is not None:
         log.info('initialized audio playlist: %r' % playlist_stim)
 
@@ -477,7 +524,8 @@ def run_sound_server(options, quit_evt=None):
         ipc.start()
 
         # starts the thread
-        sound_server.start_stream(frames_per_buffer=SoundServer.DEFAULT_CHUNK_SIZE)
+        sound_server.start_stream(device=getattr(options, 'audio_device', None) or SoundServer.DEVICE_DEFAULT,
+                                  frames_per_buffer=SoundServer.DEFAULT_CHUNK_SIZE)
 
         if quit_evt is not None:
             # the single process launcher
@@ -1,9 +1,12 @@
 import re
 import abc
+import time
 import uuid
 import os.path
 import logging
+import fractions
 import itertools
+import concurrent.futures
 
 from typing import Optional, Iterator
 
@@ -13,7 +16,7 @@ import scipy
 from scipy import io
 from scipy import signal
 
-from flyvr.audio.signal_producer import SignalProducer, SampleChunk, MixedSignal
+from flyvr.audio.signal_producer import SignalProducer, SampleChunk, MixedSignal, max_chunk_samples
 from flyvr.common import Randomizer
 
 
@@ -29,7 +32,8 @@ class AudioStim(SignalProducer, metaclass=abc.ABCMeta):
     NAME = None
 
     def __init__(self, sample_rate, duration, intensity=1.0, pre_silence=0, post_silence=0, attenuator=None,
-                 frequency=None, max_value=10.0, min_value=-10.0, next_event_callback=None, identifier=None):
+                 frequency=None, max_value=10.0, min_value=-10.0, next_event_callback=None, identifier=None,
+                 dtype=None):
         """
         Create an audio stimulus object that encapsulates the generation of the underlying audio
         data.
@@ -39,13 +43,16 @@ class AudioStim(SignalProducer, metaclass=abc.ABCMeta):
         :param int post_silence: The duration (in milliseconds) of silence to add to the end of the signal.
         :param next_event_callback: A list of control functions to call whenever the generator produced by this
         class yields a value.
+        :param dtype: The sample dtype the signal is rendered and cached in, should be the native output dtype of the
+        backend that plays it. Default (None) is float64.
         """
 
         # Attach event next callbacks to this object, since it is a signal producer
         super(AudioStim, self).__init__(type_=self.NAME,
                                         instance_identifier=identifier or ('%s-%s' % (self.__class__.__name__,
                                                                                       uuid.uuid4().hex)),
-                                        next_event_callback=next_event_callback)
+                                        next_event_callback=next_event_callback,
+                                        dtype=dtype)
 
         self.__sample_rate = sample_rate
         self.__duration = duration
@@ -73,17 +80,27 @@ class AudioStim(SignalProducer, metaclass=abc.ABCMeta):
         :return: The silence signal.
         :rtype: numpy.ndarray
         """
-        return np.zeros(int(np.ceil((silence_duration / 1000.0) * self.sample_rate)))
+        return np.zeros(self._num_silence_samples(silence_duration), dtype=self.dtype)
+
+    def _num_silence_samples(self, silence_duration):
+        return int(np.ceil((silence_duration / 1000.0) * self.sample_rate))
 
     def _add_silence(self, data):
         """
-        A helper function to add pre and post silence to a generated signal.
+        A helper function to add pre and post silence to a generated signal. The result is always a new array of this
+        stimulus' dtype, so the (float64) generated signal is converted exactly once.
 
         :param numpy.ndarray data: The data to add silence to.
         :return: The data with silence added to its start and end.
         :rtype: numpy.ndarray
         """
-        return np.concatenate([self._gen_silence(self.pre_silence), data, self._gen_silence(self.post_silence)])
+        pre = self._num_silence_samples(self.pre_silence)
+        post = self._num_silence_samples(self.post_silence)
+        n = len(data)
+
+        out = np.zeros(pre + n + post, dtype=self.dtype)
+        out[pre:pre + n] = data
+        return out
 
     @abc.abstractmethod
     def _generate_data(self):
@@ -116,18 +133,35 @@ class AudioStim(SignalProducer, metaclass=abc.ABCMeta):
         :param numpy.ndarray data: The raw audio signal data representing this stimulus.
         """
 
-        # If the user provided an attenuator, attenuate the signal
+        # Adding silence copies the signal into a new array (of our dtype), which is then scaled in place
+        data = self._scale(self._add_silence(data))
+
+        self.__data = data
+
+        # Perform limit check on data, make sure we are not exceeding
+        self._check_limits(data)
+
+    def _scale(self, data):
+        """
+        Attenuate (if the user provided an attenuator) and multiply by the intensity factor, in place.
+
+        :param numpy.ndarray data: The signal (or a block of it) to scale.
+        :return: The (same) scaled signal.
+        :rtype: numpy.ndarray
+        """
         if self.__attenuator is not None:
-            data = self.__attenuator.attenuate(data, self.__frequency)
+            self.__attenuator.attenuate_inplace(data, self.__frequency)
 
-        data = self._add_silence(data)
+        data *= self.__intensity
 
-        # Multiply the signal by the intensity factor
-        data = data * self.__intensity
+        return data
 
-        self.__data = data
+    def _check_limits(self, data):
+        """
+        Raise a ValueError if the (scaled) signal, or a block of it, exceeds the max or min value.
 
-        # Perform limit check on data, make sure we are not exceeding
+        :param numpy.ndarray data: The signal to check.
+        """
         if data.max() > self.__max_value:
             raise ValueError("Audio stimulus value exceeded max level (%r, %s vs %s)" % (self,
                                                                                          data.max(),
@@ -162,6 +196,15 @@ class AudioStim(SignalProducer, metaclass=abc.ABCMeta):
             self.trigger_next_callback(chunk)
             yield chunk
 
+    @property
+    def num_channels(self):
+        data = self.data
+        return 1 if data.ndim == 1 else data.shape[1]
+
+    @property
+    def num_samples(self):
+        return self.data.shape[0]
+
     @property
     def sample_rate(self):
         """
@@ -301,8 +344,201 @@ class AudioStim(SignalProducer, metaclass=abc.ABCMeta):
         self.__frequency = frequency
         self.data = self._generate_data()
 
+    @property
+    def max_value(self):
+        """
+        Get the maximum value the signal may reach before it is rejected by the limit check.
+
+        :return: The maximum allowed signal value.
+        :rtype: float
+        """
+        return self.__max_value
+
+    @property
+    def min_value(self):
+        """
+        Get the minimum value the signal may reach before it is rejected by the limit check.
+
+        :return: The minimum allowed signal value.
+        :rtype: float
+        """
+        return self.__min_value
 
-class SinStim(AudioStim):
+
+class PeriodicAudioStim(AudioStim, metaclass=abc.ABCMeta):
+    """
+    A base class for procedurally generated periodic stimuli (tones). Rather than rendering the whole duration up
+    front (which for stimuli minutes long at DAQ sample rates allocates hundreds of MB), the signal is rendered on
+    demand, BLOCK_SIZE samples at a time, as it is played. If the sampled signal repeats exactly within
+    MAX_PERIOD_SAMPLES samples, one scaled period is rendered once and tiled, otherwise each block is evaluated at its
+    sample times. Either way the phase is continuous across blocks. Stimuli no longer than one block are rendered
+    once and cached, exactly like any other AudioStim.
+    """
+
+    BLOCK_SIZE = 44100
+    MAX_PERIOD_SAMPLES = 44100
+
+    @abc.abstractmethod
+    def _waveform(self, t):
+        """
+        Evaluate the (unscaled) signal.
+
+        :param numpy.ndarray t: The sample times in seconds.
+        :return: The signal at those times.
+        :rtype: numpy.ndarray
+        """
+
+    @abc.abstractmethod
+    def _waveform_limits(self):
+        """
+        Get bounds on the (unscaled) signal, used to check limits without rendering long signals.
+
+        :return: The (min, max) of the signal.
+        """
+
+    def _signal_num_samples(self):
+        return int((float(self.sample_rate) / 1000.0) * self.duration)
+
+    def _sample_times(self, start, stop):
+        """
+        Get the times of signal samples start to stop, identical to np.linspace(0, duration, n)[start:stop].
+        """
+        n = self._signal_num_samples()
+        t_end = float(self.duration) / 1000.0
+
+        # noinspection PyPep8Naming
+        T = np.arange(start, stop, dtype=np.float64)
+        if n > 1:
+            T *= t_end / (n - 1)
+            if stop == n:
+                T[-1] = t_end
+        else:
+            T[:] = 0.0
+        return T
+
+    def _find_period(self, n):
+        """
+        Find the number of samples after which the sampled signal repeats, to within float precision over its whole
+        duration.
+
+        :param int n: The number of samples in the signal.
+        :return: The period in samples, or None if the signal does not repeat within MAX_PERIOD_SAMPLES samples.
+        """
+        if (n < 2) or (not self.frequency):
+            return None
+
+        cycles_per_sample = abs(self.frequency) * (float(self.duration) / 1000.0) / (n - 1)
+        period = fractions.Fraction(cycles_per_sample).limit_denominator(self.MAX_PERIOD_SAMPLES)
+
+        # the phase error (in cycles) accumulated by tiling the period over the whole signal
+        if abs(cycles_per_sample - float(period)) * n > 1e-9:
+            return None
+
+        return period.denominator
+
+    def _generate_data(self):
+        """
+        Render one period of the signal, if it is long enough and exactly periodic.
+
+        :return: One (unscaled) period of the signal, or None if the signal should be rendered block by block.
+        :rtype: numpy.ndarray
+        """
+        n = self._signal_num_samples()
+        if self.num_samples <= self.BLOCK_SIZE:
+            return None
+
+        period = self._find_period(n)
+        if (period is None) or (period >= n):
+            return None
+
+        return self._waveform(self._sample_times(0, period))
+
+    def _render(self, start, stop):
+        # scaled signal samples start to stop
+        if self.__period is not None:
+            return np.take(self.__period, np.arange(start, stop), mode='wrap')
+        return self._scale(self._waveform(self._sample_times(start, stop)).astype(self.dtype))
+
+    def _iter_blocks(self):
+        """
+        Yield one complete playback of the stimulus (including pre and post silence) in blocks of at most BLOCK_SIZE
+        samples.
+        """
+        n = self._signal_num_samples()
+        pre = self._num_silence_samples(self.pre_silence)
+        total = self.num_samples
+
+        for start in range(0, total, self.BLOCK_SIZE):
+            stop = min(start + self.BLOCK_SIZE, total)
+            block = np.zeros(stop - start, dtype=self.dtype)
+
+            lo, hi = max(start, pre), min(stop, pre + n)
+            if lo < hi:
+                block[lo - start:hi - start] = self._render(lo - pre, hi - pre)
+
+            yield block
+
+    @property
+    def data(self):
+        """
+        Get the complete voltage signal data associated with this stimulus. For stimuli longer than one block this
+        renders the whole stimulus so should only be used for plotting or testing; playback uses data_generator().
+
+        :return: A 1D numpy.ndarray of data that can be passed directly to the DAQ.
+        :rtype: numpy.ndarray
+        """
+        if self.__block is not None:
+            return self.__block
+        return np.concatenate(list(self._iter_blocks()))
+
+    @data.setter
+    def data(self, period):
+        """
+        Set the (unscaled) period of the signal, as returned by _generate_data(), and check the signal limits.
+
+        :param numpy.ndarray period: One period of the signal, or None to render the signal block by block.
+        """
+        self.__period = None if period is None else self._scale(period.astype(self.dtype))
+        self.__block = None
+
+        if self.num_samples <= self.BLOCK_SIZE:
+            blocks = list(self._iter_blocks())
+            self.__block = blocks[0] if blocks else np.zeros(0, dtype=self.dtype)
+            self._check_limits(self.__block)
+        elif self.__period is not None:
+            self._check_limits(self.__period)
+        else:
+            self._check_limits(self._scale(np.array(self._waveform_limits(), dtype=np.float64)))
+
+    @property
+    def num_samples(self):
+        return (self._num_silence_samples(self.pre_silence) + self._signal_num_samples() +
+                self._num_silence_samples(self.post_silence))
+
+    @property
+    def num_channels(self):
+        return 1
+
+    @property
+    def chunks_per_play(self):
+        if self.__block is not None:
+            return 1
+        return int(np.ceil(self.num_samples / float(self.BLOCK_SIZE)))
+
+    def data_generator(self) -> Iterator[Optional[SampleChunk]]:
+        """
+        Return a generator that yields the stimulus in blocks, looping back to the start after each complete playback.
+        """
+        while True:
+            for block in ((self.__block, ) if self.__block is not None else self._iter_blocks()):
+                self.num_samples_generated = self.num_samples_generated + block.shape[0]
+                chunk = SampleChunk(data=block, producer_identifier=self.identifier,
+                                    producer_instance_n=self.producer_instance_n)
+                self.trigger_next_callback(chunk)
+                yield chunk
+
+
+class SinStim(PeriodicAudioStim):
     """
        The SinStim class provides a simple interface for generating sinusoidal audio stimulus data
        appropriate for feeding directly as voltage signals to a DAQ for playback. It allows parameterization
@@ -312,11 +548,11 @@ class SinStim(AudioStim):
     NAME = 'sin'
 
     def __init__(self, frequency, amplitude, phase, sample_rate, duration, intensity=1.0, pre_silence=0,
-                 post_silence=0, attenuator=None, next_event_callback=None, identifier=None):
+                 post_silence=0, attenuator=None, next_event_callback=None, identifier=None, dtype=None):
         super(SinStim, self).__init__(sample_rate=sample_rate, duration=duration, intensity=intensity,
                                       pre_silence=pre_silence, post_silence=post_silence, attenuator=attenuator,
                                       frequency=frequency, next_event_callback=next_event_callback,
-                                      identifier=identifier)
+                                      identifier=identifier, dtype=dtype)
 
         self.__amplitude = amplitude
         self.__phase = phase
@@ -369,24 +605,21 @@ class SinStim(AudioStim):
         self.__phase = phase
         self.data = self._generate_data()
 
-    def _generate_data(self):
+    def _waveform(self, t):
         """
-        Generate the sin sample data according to the parameters. Also attenuatte the signal if an attenuator
-        is provided.
+        Generate the sin sample data according to the parameters.
 
-        :return: The sin signal data, ready to be passed to the DAQ as voltage signals.
+        :return: The sin signal data at times t.
         :rtype: numpy.ndarray
         """
-        # noinspection PyPep8Naming
-        T = np.linspace(0.0, float(self.duration) / 1000.0, int((float(self.sample_rate) / 1000.0) * self.duration))
-
         # Generate the samples of the sin wave with specified amplitude, frequency, and phase.
-        data = self.amplitude * np.sin(2 * np.pi * self.frequency * T + self.phase)
+        return self.amplitude * np.sin(2 * np.pi * self.frequency * t + self.phase)
 
-        return data
+    def _waveform_limits(self):
+        return -abs(self.amplitude), abs(self.amplitude)
 
 
-class SquareWaveStim(AudioStim):
+class SquareWaveStim(PeriodicAudioStim):
     """
        The SquareWaveStim class provides a simple interface for generating square wave audio stimulus data
        appropriate for feeding directly as samples for sound card playback. It allows parameterization
@@ -396,11 +629,11 @@ class SquareWaveStim(AudioStim):
     NAME = 'square'
 
     def __init__(self, frequency, duty_cycle, amplitude, sample_rate, duration, intensity=1.0, pre_silence=0,
-                 post_silence=0, attenuator=None, next_event_callback=None, identifier=None):
+                 post_silence=0, attenuator=None, next_event_callback=None, identifier=None, dtype=None):
         super(SquareWaveStim, self).__init__(sample_rate=sample_rate, duration=duration, intensity=intensity,
                                              pre_silence=pre_silence, post_silence=post_silence, attenuator=attenuator,
                                              frequency=frequency, next_event_callback=next_event_callback,
-                                             identifier=identifier)
+                                             identifier=identifier, dtype=dtype)
 
         self.__duty_cycle = duty_cycle
         self.__amplitude = amplitude
@@ -453,18 +686,17 @@ class SquareWaveStim(AudioStim):
         self.__duty_cycle = duty_cycle
         self.data = self._generate_data()
 
-    def _generate_data(self):
+    def _waveform(self, t):
         """
-        Generate the sin sample data according to the parameters. Also attenuatte the signal if an attenuator
-        is provided.
+        Generate the square wave sample data according to the parameters.
 
-        :return: The sin signal data, ready to be passed to the DAQ as voltage signals.
+        :return: The square wave signal data at times t.
         :rtype: numpy.ndarray
         """
-        # noinspection PyPep8Naming
-        T = np.linspace(0.0, float(self.duration) / 1000.0, int((float(self.sample_rate) / 1000.0) * self.duration))
-        # Generate the samples of the sin wave with specified amplitude, frequency, and phase.
-        return self.amplitude * signal.square(T * 2 * np.pi * self.frequency, duty=self.duty_cycle)
+        return self.amplitude * signal.square(t * 2 * np.pi * self.frequency, duty=self.duty_cycle)
+
+    def _waveform_limits(self):
+        return -abs(self.amplitude), abs(self.amplitude)
 
 
 class ConstantStim(AudioStim):
@@ -473,11 +705,11 @@ class ConstantStim(AudioStim):
     NAME = 'constant'
 
     def __init__(self, sample_rate, duration, amplitude=1.0, pre_silence=0, post_silence=0, attenuator=None,
-                 intensity=1.0, next_event_callback=None, identifier=None):
+                 intensity=1.0, next_event_callback=None, identifier=None, dtype=None):
         super(ConstantStim, self).__init__(sample_rate=sample_rate, duration=duration, intensity=intensity,
                                            pre_silence=pre_silence, post_silence=post_silence, attenuator=attenuator,
                                            frequency=None, next_event_callback=next_event_callback,
-                                           identifier=identifier)
+                                           identifier=identifier, dtype=dtype)
         self._amplitude = amplitude
         self.data = self._generate_data()
 
@@ -497,11 +729,11 @@ class PulseStim(AudioStim):
 
     def __init__(self, sample_rate, duration_a, amplitude_a, duration_b, amplitude_b,
                  pre_silence=0, post_silence=0, intensity=1.0, attenuator=None,
-                 next_event_callback=None, identifier=None):
+                 next_event_callback=None, identifier=None, dtype=None):
         super(PulseStim, self).__init__(sample_rate=sample_rate, duration=duration_a + duration_b, intensity=intensity,
                                         pre_silence=pre_silence, post_silence=post_silence, attenuator=attenuator,
                                         frequency=None, next_event_callback=next_event_callback,
-                                        identifier=identifier)
+                                        identifier=identifier, dtype=dtype)
 
         self._amplitudes = amplitude_a, amplitude_b
         self._durations = duration_a, duration_b
@@ -533,11 +765,11 @@ class MATFileStim(AudioStim):
     MATFILE_EXTENSION = '.mat'
 
     def __init__(self, filename, frequency, sample_rate, intensity=1.0, pre_silence=0, post_silence=0, attenuator=None,
-                 next_event_callback=None, identifier=None):
+                 next_event_callback=None, identifier=None, dtype=None):
         super(MATFileStim, self).__init__(sample_rate=sample_rate, duration=None, intensity=intensity,
                                           pre_silence=pre_silence, post_silence=post_silence, attenuator=attenuator,
                                           frequency=frequency, next_event_callback=next_event_callback,
-                                          identifier=identifier)
+                                          identifier=identifier, dtype=dtype)
 
         # strip .mat for internal use
         if filename.endswith('.mat'):
@@ -593,7 +825,221 @@ class MATFileStim(AudioStim):
             return data
 
 
-def _legacy_factory(chan_name, rate, silencePre, silencePost, intensity, freq, basedirs=None, attenuator=None):
+class MATFileStreamStim(AudioStim):
+    """A streaming variant of MATFileStim for very long stimuli stored in v7.3 (HDF5) MAT files. The stim variable
+    is never loaded in full; it is read in blocks (via a memory map when the dataset is stored contiguously, otherwise
+    through h5py) and attenuation, intensity and the limit checks are applied to each block as it is generated. Memory
+    use is therefore constant regardless of the stimulus length."""
+
+    NAME = 'matfile_stream'
+
+    DEFAULT_BLOCK_SIZE = 44100
+
+    def __init__(self, filename, frequency, sample_rate, intensity=1.0, pre_silence=0, post_silence=0, attenuator=None,
+                 block_size=DEFAULT_BLOCK_SIZE, next_event_callback=None, identifier=None, dtype=None):
+        # strip .mat for internal use
+        if filename.endswith('.mat'):
+            self.__filename = filename[:-4]
+        else:
+            self.__filename = filename
+
+        self.__block_size = int(block_size)
+        if self.__block_size < 1:
+            raise ValueError('block_size must be >= 1')
+
+        self.__h5_file = None
+        self.__source = None
+        self.__source_axis = 0
+        self.__source_num_samples = 0
+        self.__source_limits = None
+
+        super(MATFileStreamStim, self).__init__(sample_rate=sample_rate, duration=None, intensity=intensity,
+                                                pre_silence=pre_silence, post_silence=post_silence,
+                                                attenuator=attenuator, frequency=frequency,
+                                                next_event_callback=next_event_callback, identifier=identifier,
+                                                dtype=dtype)
+
+        self.data = self._generate_data()
+
+    def describe(self):
+        desc = super(MATFileStreamStim, self).describe()
+        desc.pop('duration')
+        desc['filename'] = self.__filename
+        desc['block_size'] = self.__block_size
+        return desc
+
+    @property
+    def filename(self):
+        """
+        Get the filename that stored the audio data.
+
+        :return: The filename that stored the audio data.
+        :rtype: str
+        """
+        return self.__filename
+
+    @filename.setter
+    def filename(self, filename):
+        """
+        Set the filename and open the data.
+
+        :param str filename: The name of the file that stores the audio stimulus data.
+        """
+        self.__filename = filename
+        self.__source_limits = None
+        self.data = self._generate_data()
+
+    @property
+    def block_size(self):
+        """
+        Get the number of samples read from the file and yielded by the generator at a time.
+
+        :return: The block size in samples.
+        :rtype: int
+        """
+        return self.__block_size
+
+    def _generate_data(self):
+        """
+        Open the stim variable in the file with path stored in __filename, without reading it.
+
+        :return: An array-like (a read-only memory map or an h5py dataset) of the raw audio stimulus data.
+        """
+        path = self.__filename + MATFileStim.MATFILE_EXTENSION
+        if not h5py.is_hdf5(path):
+            raise ValueError("'%s' is not a v7.3 (HDF5) MAT file and cannot be streamed (use '%s')" % (
+                path, MATFileStim.NAME))
+
+        if self.__h5_file is None or self.__h5_file.filename != path:
+            if self.__h5_file is not None:
+                self.__h5_file.close()
+            self.__h5_file = h5py.File(path, 'r')
+
+        ds = self.__h5_file['stim']
+
+        # matlab saves vectors as 2D (1xN or Nx1), so find the single axis along which the samples lie
+        long_axes = [i for i, n in enumerate(ds.shape) if n > 1]
+        if len(long_axes) > 1:
+            raise ValueError("'%s' stim variable has shape %r; only single channel stimuli can be "
+                             "streamed" % (path, ds.shape))
+        self.__source_axis = long_axes[0] if long_axes else 0
+        self.__source_num_samples = ds.shape[self.__source_axis] if ds.shape else 1
+
+        # contiguous, uncompressed datasets can be read directly from the page cache
+        offset = ds.id.get_offset()
+        if (offset is not None) and (ds.chunks is None) and (ds.compression is None):
+            return np.memmap(path, dtype=ds.dtype, mode='r', offset=offset, shape=ds.shape)
+
+        return ds
+
+    def _read_block(self, start, stop):
+        sl = [0] * self.__source.ndim
+        sl[self.__source_axis] = slice(start, stop)
+        return np.array(self.__source[tuple(sl)], dtype=self.dtype)
+
+    def _iter_silence(self, num_samples):
+        silence = np.zeros(min(num_samples, self.__block_size), dtype=self.dtype)
+        silence.flags.writeable = False
+        for i in range(0, num_samples, self.__block_size):
+            yield silence[:min(self.__block_size, num_samples - i)]
+
+    def _iter_blocks(self):
+        """
+        Yield one complete playback of the stimulus (including pre and post silence) in blocks of at most block_size
+        samples, with attenuation and intensity applied and limits checked.
+        """
+        for block in self._iter_silence(self._num_silence_samples(self.pre_silence)):
+            yield block
+
+        for i in range(0, self.__source_num_samples, self.__block_size):
+            block = self._scale(self._read_block(i, i + self.__block_size))
+            self._check_limits(block)
+            yield block
+
+        for block in self._iter_silence(self._num_silence_samples(self.post_silence)):
+            yield block
+
+    @property
+    def data(self):
+        """
+        Get the complete voltage signal data associated with this stimulus. This reads the whole stimulus into
+        memory so should only be used for plotting or testing; playback uses data_generator().
+
+        :return: A 1D numpy.ndarray of data that can be passed directly to the DAQ.
+        :rtype: numpy.ndarray
+        """
+        return np.concatenate(list(self._iter_blocks()))
+
+    @data.setter
+    def data(self, source):
+        """
+        Set the (unscaled) source of the stimulus data. The raw signal extremes are found once with a streaming pass
+        so that stimuli exceeding the limits are rejected here rather than during playback.
+
+        :param source: An array-like of raw audio stimulus data, as returned by _generate_data().
+        """
+        self.__source = source
+
+        if self.__source_limits is None:
+            mn, mx = np.inf, -np.inf
+            for i in range(0, self.__source_num_samples, self.__block_size):
+                block = self._read_block(i, i + self.__block_size)
+                mn, mx = min(mn, block.min()), max(mx, block.max())
+            self.__source_limits = np.array([mn, mx], dtype=np.float64)
+
+        self._check_limits(self._scale(self.__source_limits.copy()))
+
+    @property
+    def num_samples(self):
+        return (self._num_silence_samples(self.pre_silence) + self.__source_num_samples +
+                self._num_silence_samples(self.post_silence))
+
+    @property
+    def num_channels(self):
+        return 1
+
+    @property
+    def chunks_per_play(self):
+        def _nblocks(n):
+            return int(np.ceil(n / float(self.__block_size)))
+
+        return (_nblocks(self._num_silence_samples(self.pre_silence)) + _nblocks(self.__source_num_samples) +
+                _nblocks(self._num_silence_samples(self.post_silence)))
+
+    def data_generator(self) -> Iterator[Optional[SampleChunk]]:
+        """
+        Return a generator that yields the stimulus in blocks, looping back to the start after each complete playback.
+        """
+        while True:
+            for block in self._iter_blocks():
+                self.num_samples_generated = self.num_samples_generated + block.shape[0]
+                chunk = SampleChunk(data=block, producer_identifier=self.identifier,
+                                    producer_instance_n=self.producer_instance_n)
+                self.trigger_next_callback(chunk)
+                yield chunk
+
+
+def _find_matfile(filename, basedirs):
+    if os.path.isabs(filename):
+        return filename
+
+    # take the first file that exists
+    # but be lenient with or without .mat extension
+    for bd in basedirs:
+        _filename = os.path.join(bd, filename + MATFileStim.MATFILE_EXTENSION)
+        if os.path.exists(_filename):
+            # convention is we dont include the mat file extension
+            return _filename[:-4]
+
+        _filename = os.path.join(bd, filename)
+        if os.path.exists(_filename):
+            return _filename
+
+    raise IOError("could not find '%s' in any directory: %r" % (filename, basedirs))
+
+
+def _legacy_factory(chan_name, rate, silencePre, silencePost, intensity, freq, basedirs=None, attenuator=None,
+                    dtype=None):
     basedirs = basedirs or [os.getcwd()]
 
     # note: I think the legacy playlist never really supported sin or square waves because there was
@@ -602,17 +1048,20 @@ def _legacy_factory(chan_name, rate, silencePre, silencePost, intensity, freq, b
     if chan_name == "optooff" or chan_name.strip() == "":
         chan = ConstantStim(amplitude=0.0,
                             duration=30000,
-                            sample_rate=int(1e4))
+                            sample_rate=int(1e4),
+                            dtype=dtype)
     elif chan_name == "optoon":
         chan = ConstantStim(amplitude=5.0,
                             duration=30000,
-                            sample_rate=int(1e4))
+                            sample_rate=int(1e4),
+                            dtype=dtype)
     elif chan_name == "square":
         chan = SquareWaveStim(frequency=freq, duty_cycle=0.75,
                               amplitude=intensity, sample_rate=int(1e4),
                               duration=int(rate * 1000.0), intensity=1.0,
                               pre_silence=silencePre,
-                              post_silence=silencePost)
+                              post_silence=silencePost,
+                              dtype=dtype)
     elif chan_name == "sin":
         chan = SinStim(frequency=freq,
                        amplitude=intensity,
@@ -620,7 +1069,8 @@ def _legacy_factory(chan_name, rate, silencePre, silencePost, intensity, freq, b
                        sample_rate=44100,
                        duration=int(rate * 1000.0),  # can't be specified
                        pre_silence=silencePre,
-                       post_silence=silencePost)
+                       post_silence=silencePost,
+                       dtype=dtype)
     else:
         if freq == -1:
             atten = None
@@ -644,7 +1094,8 @@ def _legacy_factory(chan_name, rate, silencePre, silencePost, intensity, freq, b
                            intensity=intensity,
                            pre_silence=int(silencePre),
                            post_silence=int(silencePost),
-                           attenuator=atten)
+                           attenuator=atten,
+                           dtype=dtype)
 
     return chan
 
@@ -658,7 +1109,7 @@ def stimulus_factory(**conf):
         # but trial was always 1 and delayPost always 0
         return _legacy_factory(conf['stimFileName'], conf['rate'], conf['silencePre'],
                                conf['silencePost'], conf['intensity'], conf['freq'],
-                               basedirs=basedirs)
+                               basedirs=basedirs, dtype=conf.get('dtype'))
     except KeyError:
         name = conf.pop('name')
         if name == 'sin':
@@ -670,38 +1121,29 @@ def stimulus_factory(**conf):
                            pre_silence=conf.get('pre_silence', 0),
                            post_silence=conf.get('post_silence', 0),
                            attenuator=conf.get('attenuator'),
-                           identifier=conf.get('identifier'))
+                           identifier=conf.get('identifier'),
+                           dtype=conf.get('dtype'))
         elif name == 'matfile':
-            filename = None
-            if os.path.isabs(conf['filename']):
-                filename = conf['filename']
-            else:
-                # take the first file that exists
-                # but be lenient with or without .mat extension
-                for bd in basedirs:
-                    _filename = os.path.join(bd, conf['filename'] + MATFileStim.MATFILE_EXTENSION)
-                    if os.path.exists(_filename):
-                        # convention is we dont include the mat file extension
-                        filename = _filename[:-4]
-                        break
-
-                    _filename = os.path.join(bd, conf['filename'])
-                    if os.path.exists(_filename):
-                        filename = _filename
-                        break
-
-            if filename is None:
-                raise IOError("could not find '%s' in any directory: %r" % (conf['filename'],
-                                                                            basedirs))
-
-            return MATFileStim(filename=filename,
+            return MATFileStim(filename=_find_matfile(conf['filename'], basedirs),
                                frequency=conf['frequency'],
                                sample_rate=conf.get('sample_rate', 44100),
                                intensity=conf['intensity'],
                                pre_silence=conf.get('pre_silence', 0),
                                post_silence=conf.get('post_silence', 0),
                                attenuator=conf.get('attenuator'),
-                               identifier=conf.get('identifier'))
+                               identifier=conf.get('identifier'),
+                               dtype=conf.get('dtype'))
+        elif name == 'matfile_stream':
+            return MATFileStreamStim(filename=_find_matfile(conf['filename'], basedirs),
+                                     frequency=conf['frequency'],
+                                     sample_rate=conf.get('sample_rate', 44100),
+                                     intensity=conf['intensity'],
+                                     pre_silence=conf.get('pre_silence', 0),
+                                     post_silence=conf.get('post_silence', 0),
+                                     attenuator=conf.get('attenuator'),
+                                     block_size=conf.get('block_size', MATFileStreamStim.DEFAULT_BLOCK_SIZE),
+                                     identifier=conf.get('identifier'),
+                                     dtype=conf.get('dtype'))
 
         elif name == 'constant':
             return ConstantStim(sample_rate=conf.get('sample_rate', 44100),
@@ -710,7 +1152,8 @@ def stimulus_factory(**conf):
                                 pre_silence=conf.get('pre_silence', 0),
                                 post_silence=conf.get('post_silence', 0),
                                 attenuator=conf.get('attenuator'),
-                                identifier=conf.get('identifier'))
+                                identifier=conf.get('identifier'),
+                                dtype=conf.get('dtype'))
         elif name == "square":
             return SquareWaveStim(frequency=conf['frequency'],
                                   amplitude=conf['amplitude'],
@@ -720,7 +1163,8 @@ def stimulus_factory(**conf):
                                   pre_silence=conf.get('pre_silence', 0),
                                   post_silence=conf.get('post_silence', 0),
                                   attenuator=conf.get('attenuator'),
-                                  identifier=conf.get('identifier'))
+                                  identifier=conf.get('identifier'),
+                                  dtype=conf.get('dtype'))
         elif name == "pulse":
             return PulseStim(amplitude_a=conf['amplitude_a'],
                              amplitude_b=conf['amplitude_b'],
@@ -730,12 +1174,45 @@ def stimulus_factory(**conf):
                              pre_silence=conf.get('pre_silence', 0),
                              post_silence=conf.get('post_silence', 0),
                              attenuator=conf.get('attenuator'),
-                             identifier=conf.get('identifier'))
+                             identifier=conf.get('identifier'),
+                             dtype=conf.get('dtype'))
+        elif name == "mixed":
+            # one channel (or more) for each stimulus, in order
+            return MixedSignal([stimulus_factory(**dict(c, basedirs=basedirs, dtype=conf.get('dtype')))
+                                for c in conf['stimuli']],
+                               identifier=conf.get('identifier'))
 
         return NotImplementedError
 
 
-def legacy_factory(lines, basedirs, attenuator=None):
+def _timed_stimulus_factory(conf):
+    t0 = time.perf_counter()
+    stim = stimulus_factory(**conf)
+    return stim, time.perf_counter() - t0
+
+
+def build_stimuli(confs, workers=1):
+    """
+    Build (load and render) many stimuli from their stimulus_factory configurations, optionally concurrently in a
+    thread pool. The stimuli are shared directly with the caller (mat file loading and rendering release the GIL, and
+    most stimuli render lazily, so a process pool would only add the cost of pickling them back). Every producer
+    (including the children of mixed stimuli) gets a unique producer_instance_n, but when built concurrently these
+    are not necessarily in playlist order.
+
+    :param confs: A list of stimulus_factory keyword argument dictionaries.
+    :param int workers: The number of worker threads, 1 builds the stimuli serially in this thread.
+    :return: A list, in the same order as confs, of (stimulus, seconds taken to build it) tuples.
+    """
+    if (workers <= 1) or (len(confs) <= 1):
+        results = [_timed_stimulus_factory(dict(c)) for c in confs]
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_timed_stimulus_factory, [dict(c) for c in confs]))
+
+    return results
+
+
+def legacy_factory(lines, basedirs, attenuator=None, dtype=None):
     def _parse_list(_s):
         _list = re.match(r"""\[([\d\s.+-]+)\]""", _s)
         if _list:
@@ -770,7 +1247,8 @@ def legacy_factory(lines, basedirs, attenuator=None):
                                    intensity=intensities[chan_idx],  # float
                                    freq=frequencies[chan_idx],  # float
                                    basedirs=basedirs,
-                                   attenuator=attenuator)
+                                   attenuator=attenuator,
+                                   dtype=dtype)
             chans.append(chan)
 
         # Combine these stimuli into one analog signal with a channel for each.
@@ -789,9 +1267,15 @@ class AudioStimPlaylist(SignalProducer):
     """A simple class that provides a generator for a sequence of AudioStim objects."""
 
     def __init__(self, stims, random=None, paused=False, identifier=None, next_event_callback=None):
+        dtypes = set(s.dtype for s in stims)
+        if len(dtypes) > 1:
+            raise ValueError("Cannot create playlist from signals with different dtypes: %s" % (
+                ', '.join('%s:%s' % (s.identifier, s.dtype) for s in stims)))
+
         super(AudioStimPlaylist, self).__init__(type_='_playlist',
                                                 instance_identifier=identifier or ','.join(s.identifier for s in stims),
-                                                next_event_callback=next_event_callback)
+                                                next_event_callback=next_event_callback,
+                                                dtype=dtypes.pop() if dtypes else None)
         self._log = logging.getLogger('flyvr.audio.AudioStimPlaylist')
 
         self._stims = stims
@@ -806,6 +1290,9 @@ class AudioStimPlaylist(SignalProducer):
 
         self.paused = paused
 
+        # seconds taken to load each stimulus, by identifier (if built from playlist definitions)
+        self.load_times = {}
+
     def __iter__(self):
         """ yield stims in the defined order, not accounting for randomisation/loop options """
         for s in self._stims:
@@ -818,24 +1305,59 @@ class AudioStimPlaylist(SignalProducer):
     def describe(self):
         return [{s.identifier: s.describe()} for s in self._stims]
 
+    @property
+    def num_channels(self):
+        # the widest item, narrower items are padded with silent channels when played (see pad_channels)
+        return max((s.num_channels for s in self._stims), default=1)
+
     @classmethod
-    def from_legacy_filename(cls, filename, random=None, attenuator=None, paused=False):
+    def from_legacy_filename(cls, filename, random=None, attenuator=None, paused=False, dtype=None):
         with open(filename, 'rt') as f:
-            return cls(legacy_factory(f.readlines()[1:], basedirs=[os.path.dirname(filename)], attenuator=attenuator),
+            return cls(legacy_factory(f.readlines()[1:], basedirs=[os.path.dirname(filename)], attenuator=attenuator,
+                                      dtype=dtype),
                        random=random, paused=paused)
 
     @classmethod
-    def fromitems(cls, items, random=None, paused=False, attenuator=None, basedirs=None):
-        stims = []
+    def fromitems(cls, items, random=None, paused=False, attenuator=None, basedirs=None,
+                  workers=1, dtype=None):
+        defns = []
         for item_def in items:
             id_, defn = item_def.popitem()
             defn['identifier'] = id_
-            stims.append(stimulus_factory(**defn,
-                                          basedirs=basedirs or []))
-        return cls(stims, random=random, paused=paused)
+            # as in the legacy playlist format, a frequency of -1 (or none) means do not attenuate
+            if (attenuator is not None) and (defn.get('attenuator') is None) and \
+                    (defn.get('frequency') not in (None, -1)):
+                defn['attenuator'] = attenuator
+            defns.append(defn)
+
+        if attenuator is not None:
+            # look up the attenuation factors of every item in one pass
+            attenuator.get_factors(set(d['frequency'] for d in defns if d.get('attenuator') is attenuator))
+
+        for defn in defns:
+            defn['basedirs'] = basedirs or []
+            if dtype is not None:
+                defn['dtype'] = dtype
+
+        t0 = time.perf_counter()
+        built = build_stimuli(defns, workers=workers)
+        total = time.perf_counter() - t0
+
+        obj = cls([stim for stim, _ in built], random=random, paused=paused)
+        obj.load_times = {stim.identifier: dt for stim, dt in built}
+
+        # noinspection PyProtectedMember
+        obj._log.info('loaded %d playlist items in %.1fms (%s)' % (
+            len(built), total * 1000., 'serially' if workers <= 1 else '%d worker threads' % workers))
+        for stim, dt in built:
+            # noinspection PyProtectedMember
+            obj._log.info('    %s: %.1fms' % (stim.identifier, dt * 1000.))
+
+        return obj
 
     @classmethod
-    def from_playlist_definition(cls, stim_playlist, basedirs, paused_fallback, default_repeat, attenuator=None):
+    def from_playlist_definition(cls, stim_playlist, basedirs, paused_fallback, default_repeat, attenuator=None,
+                                 workers=1, dtype=None):
         stims = []
         stim_ids = []
         option_item_defn = {}
@@ -857,7 +1379,14 @@ class AudioStimPlaylist(SignalProducer):
                              random=random,
                              paused=paused if paused is not None else paused_fallback,
                              basedirs=basedirs,
-                             attenuator=attenuator)
+                             attenuator=attenuator,
+                             workers=workers,
+                             dtype=dtype)
+
+    @property
+    def num_samples(self):
+        # the items are played one at a time, so this is the largest chunk of any of them (and chunks_per_play 1)
+        return max((max_chunk_samples(s) for s in self._stims), default=0)
 
     def play_item(self, identifier):
         # it's actually debatable if it's best do it this way or explicitly reset a global+sticky next_id
@@ -876,6 +1405,7 @@ class AudioStimPlaylist(SignalProducer):
         repeated.
         :return: A generator that yields an array containing the sample data.
         """
+        stim_map = {s.identifier: s for s in self._stims}
         data_gens = {s.identifier: s.data_generator() for s in self._stims}
         playlist_iter = self._random.iter_items()
 
@@ -895,10 +1425,13 @@ class AudioStimPlaylist(SignalProducer):
                 else:
                     self._log.info('playing item: %s' % next_id)
 
-                    sample_chunk_obj = next(data_gens[next_id])  # type: SampleChunk
-                    sample_chunk_obj.producer_playlist_n = n
+                    # streaming stimuli yield a single playback over several chunks, all of which belong
+                    # to the same playlist item
+                    for _ in range(stim_map[next_id].chunks_per_play):
+                        sample_chunk_obj = next(data_gens[next_id])  # type: SampleChunk
+                        sample_chunk_obj.producer_playlist_n = n
 
-                    yield sample_chunk_obj
+                        yield sample_chunk_obj
 
     def _to_array(self, fix_repeat_forver=False):
         if self._random.repeat_forever:
@@ -6,7 +6,8 @@ from flyvr.common import Randomizer
 from flyvr.audio.stimuli import AudioStimPlaylist
 
 
-def get_paylist_object(options, playlist_type, paused_fallback, default_repeat, attenuator, _extra_playlist_path=None):
+def get_paylist_object(options, playlist_type, paused_fallback, default_repeat, attenuator, _extra_playlist_path=None,
+                       dtype=None):
     stim_playlist = options.playlist.get(playlist_type)
 
     basedirs = [os.getcwd()]
@@ -16,13 +17,18 @@ def get_paylist_object(options, playlist_type, paused_fallback, default_repeat,
     if _extra_playlist_path is not None:
         basedirs.insert(0, os.path.abspath(_extra_playlist_path))
 
+    # optional because the options may come from a saved config of an older version
+    load_workers = getattr(options, 'playlist_load_workers', 1)
+
     playlist_object = None
     if stim_playlist:
         playlist_object = AudioStimPlaylist.from_playlist_definition(stim_playlist,
                                                                      basedirs=basedirs,
                                                                      paused_fallback=paused_fallback,
                                                                      default_repeat=default_repeat,
-                                                                     attenuator=attenuator)
+                                                                     attenuator=attenuator,
+                                                                     workers=load_workers,
+                                                                     dtype=dtype)
 
     return playlist_object, basedirs
 
@@ -1,6 +1,5 @@
 import re
 import sys
-import mmap
 import time
 import ctypes
 import logging
@@ -9,7 +8,7 @@ import threading
 
 import numpy as np
 
-from flyvr.fictrac.shmem_transfer_data import new_mmap_shmem_buffer
+from flyvr.fictrac.shmem_transfer_data import new_mmap_shmem_buffer, new_named_mmap
 from flyvr.common.ipc import Sender, Reciever, RELAY_SEND_PORT, RELAY_RECIEVE_PORT, RELAY_HOST, CommonMessages
 
 
@@ -48,6 +47,7 @@ class SHMEMFlyVRState(ctypes.Structure):
         ('daq_input_num_samples_read', ctypes.c_int),
         ('sound_output_num_samples_written', ctypes.c_int),
         ('video_output_num_frames', ctypes.c_int),
+        ('experiment_fictrac_frame_num', ctypes.c_int),
     ]
 
 
@@ -65,14 +65,12 @@ class SharedState(object):
         self._log = logging.getLogger('flyvr.common.SharedState%s' % (("(in='" + where + "')") if where else ''), )
 
         # noinspection PyTypeChecker
-        buf = mmap.mmap(-1,
-                        ctypes.sizeof(SHMEMFlyVRState),
-                        "FlyVRStateSHMEM",
-                        access=mmap.ACCESS_WRITE)
+        buf = new_named_mmap(ctypes.sizeof(SHMEMFlyVRState), "FlyVRStateSHMEM")
         # print('Shared State: 0x%x' % ctypes.addressof(ctypes.c_void_p.from_buffer(buf)))
         self._shmem_state = SHMEMFlyVRState.from_buffer(buf)
         self._fictrac_shmem_state = new_mmap_shmem_buffer()
-        # on unix (mmap) and windows (CreateFileMapping) initialize the memory block to zero upon creation
+        # on unix (mmap) and windows (CreateFileMapping) initialize the memory block to zero upon creation, but
+        # on unix it outlives the processes, so the launcher resets it (see reset)
 
         self._backends_ready = set()
         self._evt_start = threading.Event()
@@ -88,6 +86,15 @@ class SharedState(object):
 
         self._tx = Sender.new_for_relay(host=RELAY_HOST, port=RELAY_SEND_PORT, channel=b'')
 
+    def reset(self):
+        """
+        Zero the shared memory state (counters and the fictrac state), as it is when first created. Outside Windows
+        the shared memory persists after the processes exit, so it would otherwise start with the values of the
+        previous run. Only call this before any other process is using it.
+        """
+        for s in (self._shmem_state, self._fictrac_shmem_state):
+            ctypes.memset(ctypes.addressof(s), 0, ctypes.sizeof(s))
+
     def _ipc_rx(self):
         while True:
             msg = self._rx.get_next_element()
@@ -245,6 +252,15 @@ class SharedState(object):
         """ FicTrac frame number """
         return self._fictrac_shmem_state.frame_cnt
 
+    @property
+    def EXPERIMENT_FICTRAC_FRAME_NUM(self):
+        """ the last FicTrac frame number processed by the experiment """
+        return self._shmem_state.experiment_fictrac_frame_num
+
+    @EXPERIMENT_FICTRAC_FRAME_NUM.setter
+    def EXPERIMENT_FICTRAC_FRAME_NUM(self, v):
+        self._shmem_state.experiment_fictrac_frame_num = int(v)
+
     @property
     def TIME_NS(self):
         # I tested if using a higher resolution windows timer made a difference - it did not
@@ -275,6 +291,98 @@ class SharedState(object):
         pass
 
 
+class ScheduledPlay(object):
+    """
+    A request for a backend to start a playlist item at an exact time (a SharedState.TIME_NS value) or at an exact
+    value of that backend's own output counter (samples written for audio and DAQ, frames shown for video) rather
+    than at its next callback. The target time is converted to a counter value once, when the backend first sees the
+    request, and the backend then switches at exactly that sample (or frame). The target is the time the item leaves
+    the hardware, so the conversion accounts for the backend's output latency (the samples or frames generated now
+    are only output that much later), and every backend starts the item at the same instant.
+    """
+
+    INFO_FIELDS = ('target_time_ns', 'target_counter', 'achieved_counter', 'achieved_time_ns', 'error_counts',
+                   'output_latency_ns')
+    INFO_NUM_FIELDS = len(INFO_FIELDS)
+
+    def __init__(self, identifier, time_ns=None, counter=None):
+        if (time_ns is None) == (counter is None):
+            raise ValueError('a scheduled play must have exactly one of time_ns or counter')
+
+        self.identifier = identifier
+        self.time_ns = None if time_ns is None else int(time_ns)
+        self.counter = None if counter is None else int(counter)
+
+    def __repr__(self):
+        return "<ScheduledPlay(%s, %s)>" % (self.identifier,
+                                            'time_ns=%d' % self.time_ns if self.counter is None else
+                                            'counter=%d' % self.counter)
+
+    @classmethod
+    def from_message(cls, msg):
+        """
+        Build a scheduled play from a '<backend>_item' IPC message, if it carries a time_ns or counter.
+
+        :return: A ScheduledPlay, or None if the item is to be played immediately.
+        """
+        if ('time_ns' in msg) or ('counter' in msg):
+            return cls(msg['identifier'], time_ns=msg.get('time_ns'), counter=msg.get('counter'))
+        return None
+
+    def counts_until(self, counter, time_ns, rate, output_latency_ns=0):
+        """
+        Get the number of samples (or frames) from now until the scheduled start.
+
+        :param int counter: The backend output counter of the next sample (or frame) to be generated.
+        :param int time_ns: The time now.
+        :param float rate: The backend sample (or frame) rate.
+        :param int output_latency_ns: How long after being generated the sample (or frame) leaves the hardware.
+        :return: The number of samples (or frames), which is negative if the scheduled start has already passed.
+        """
+        if self.counter is None:
+            # (counter is output at time_ns + output_latency_ns)
+            self.counter = counter + int(round((self.time_ns - time_ns - output_latency_ns) * rate / 1e9))
+        return self.counter - counter
+
+    @staticmethod
+    def create_h5_log(logger, dataset_name):
+        logger.create(dataset_name,
+                      shape=[256, ScheduledPlay.INFO_NUM_FIELDS],
+                      maxshape=[None, ScheduledPlay.INFO_NUM_FIELDS],
+                      dtype=np.int64,
+                      chunks=(256, ScheduledPlay.INFO_NUM_FIELDS))
+        for cn, cname in enumerate(ScheduledPlay.INFO_FIELDS):
+            logger.log(dataset_name, str(cname), attribute_name='column_%d' % cn)
+
+    def log_achieved(self, logger, dataset_name, achieved_counter, counter, time_ns, rate, output_latency_ns=0):
+        """
+        Log the sample (or frame) at which the item actually started, when that left the hardware, and so the
+        synchronization error.
+
+        :param achieved_counter: The backend output counter at which the item started.
+        :param counter: The backend output counter being generated at time_ns.
+        :param time_ns: The time now.
+        :param float rate: The backend sample (or frame) rate.
+        :param int output_latency_ns: See counts_until.
+        :return: The logged row, in the order of INFO_FIELDS.
+        """
+        achieved_time_ns = time_ns + output_latency_ns + int(round((achieved_counter - counter) * 1e9 / rate))
+        row = [self.time_ns if self.time_ns is not None else -1,
+               self.counter,
+               achieved_counter,
+               achieved_time_ns,
+               achieved_counter - self.counter,
+               output_latency_ns]
+
+        logging.getLogger('flyvr.common.ScheduledPlay').info(
+            'started %s at %d (%+d from scheduled, %.3fms, output latency %.3fms)' % (
+                self.identifier, achieved_counter, row[4], row[4] * 1000. / rate, output_latency_ns * 1e-6))
+        if logger is not None:
+            logger.log(dataset_name, np.array(row, dtype=np.int64))
+
+        return row
+
+
 class Every(object):
     def __init__(self, n):
         self._i = 0
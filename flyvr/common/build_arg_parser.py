@@ -72,6 +72,10 @@ def build_argparser(savefilename=None):
     parser.add_argument("--use_RSE", action='store_true',
                         help="Use RSE (as opposed to differential) denoising on AI DAQ inputs.",
                         default=True)
+    parser.add_argument("--daq_input_raw", action='store_true',
+                        help="Record DAQ analog inputs as unscaled 16-bit ADC counts (with the scaling coefficients "
+                             "to volts stored alongside), a quarter of the size of the default float64 volts.",
+                        default=False)
     parser.add_argument("--remote_2P_disable", action="store_true",
                         help="Disable remote start, stop, and next file signaling the 2-Photon imaging "
                              "(if the phidget is not detected, signalling is disabled with a warning).",
@@ -125,6 +129,18 @@ def build_argparser(savefilename=None):
                         default=False)
     parser.add_argument("--fictrac_version", type=int, default=1, choices=(1, 2),
                         help="Fictrac version (1 or 2).")
+    parser.add_argument("--fictrac_replay_mode", default='realtime', choices=('realtime', 'fast', 'lockstep'),
+                        help="When fictrac_config is a previous experiment's h5 file, replay it at the recorded rate "
+                             "(realtime), as fast as possible (fast), or advancing to the next frame only after the "
+                             "experiment has processed the current one (lockstep).")
+    parser.add_argument("--experiment_process", action="store_true", default=False,
+                        help="Run the experiment in its own process, woken on every FicTrac frame, rather than in the "
+                             "FicTrac driver process (so a slow experiment does not delay tracking and logging).")
+    parser.add_argument("--fictrac_wait", default='adaptive', choices=('spin', 'sleep', 'adaptive', 'event'),
+                        help="How to wait for FicTrac updates in shared memory: spin (poll continuously, lowest "
+                             "latency but uses a whole core), sleep (poll every 1ms), adaptive (sleep until shortly "
+                             "before the next predicted frame) or event (block on a named event set by FicTrac, "
+                             "adaptive if not available).")
     parser.add_argument("--wait", action="store_true",
                         help="Wait for start signal before proceeding (default false in single process backends,  "
                              "and always true in the main launcher).",
@@ -135,8 +151,23 @@ def build_argparser(savefilename=None):
                         help="Serial number of additional camera to remove.")
     parser.add_argument('--camera_show', type=int, help='Show additional camera view every this frame', default=0)
     parser.add_argument('--projector_disable', action='store_true', help='Do not setup projector in video backend.')
+    parser.add_argument('--save_frames', metavar='PATH', action=FixNoneParser,
+                        help='Save every rendered video frame, to a video file (.mp4, .mkv, .avi or .mov) or else a '
+                             'directory of jpegs. Frames are read back and written in the background.')
+    parser.add_argument('--save_frames_policy', default='drop', choices=('drop', 'block'),
+                        help='When saving video frames falls behind rendering, drop frames (and count them) or slow '
+                             'rendering down until it catches up.')
+    parser.add_argument('--audio_device', default='ASIO4ALL v2',
+                        help="The audio output device (e.g. 'null', a silent ALSA device, to run without audio "
+                             "hardware).")
     parser.add_argument('--samplerate_daq', default=10000, type=int,
                         help='DAQ sample rate (advanced option, do not change)')
+    parser.add_argument('--simulate_daq', action='store_true',
+                        help='Use a simulated DAQ (with analog outputs looped back to analog inputs) instead of NI '
+                             'hardware. This is always the case if the NI-DAQmx library is not available.')
+    parser.add_argument('--playlist_load_workers', default=1, type=int,
+                        help='Load and render audio/daq playlist items concurrently using this many threads '
+                             '(1 loads them serially).')
     parser.add_argument('--print-defaults', help='Print default config values', action='store_true')
 
     return parser
@@ -249,9 +280,6 @@ def parse_options(options, parser):
     options.analog_in_channels = dict(_all_conf.get('configuration', {}).get('analog_in_channels') or {})
     options.analog_out_channels = dict(_all_conf.get('configuration', {}).get('analog_out_channels') or {})
 
-    if len(options.analog_out_channels) > 1:
-        raise NotImplementedError('only a single DAQ output channel is supported')
-
     try:
         _playlist = _all_conf['playlist']
     except KeyError:
@@ -377,7 +377,7 @@ class AttributeWriteEvent(DatasetLogEvent):
 
         # Write the attribute
         if isinstance(self.obj, str):
-            dset.attrs[self.attribute_name] = np.string_(self.obj)
+            dset.attrs[self.attribute_name] = np.bytes_(self.obj)
         else:
             dset.attrs[self.attribute_name] = self.obj
 
@@ -0,0 +1,107 @@
+import os
+import sys
+import time
+import ctypes
+import struct
+import threading
+
+
+class _timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long),
+                ('tv_nsec', ctypes.c_long)]
+
+
+class _itimerspec(ctypes.Structure):
+    _fields_ = [('it_interval', _timespec),
+                ('it_value', _timespec)]
+
+
+_CLOCK_MONOTONIC = 1
+_TFD_CLOEXEC = 0o2000000
+
+
+class PeriodicTimer(object):
+    """
+    Waits for the ticks of a fixed rate clock. The backends are
+      * timerfd: (linux) a kernel timer file descriptor on the monotonic clock, which reports how many ticks elapsed
+      * mmtimer: (windows) the multimedia timer (MMTimer), whose interval is whole milliseconds
+      * sleep: sleeping until the absolute time of the next tick
+    all of which keep to the clock (they do not accumulate the delay of the caller).
+    """
+
+    BACKENDS = ('timerfd', 'mmtimer', 'sleep')
+
+    def __init__(self, interval, backend=None):
+        """
+        :param float interval: The tick interval, in seconds.
+        :param str backend: One of BACKENDS, or None for the best available on this platform.
+        """
+        if backend is None:
+            backend = 'timerfd' if sys.platform.startswith('linux') else ('mmtimer' if os.name == 'nt' else 'sleep')
+        if backend not in PeriodicTimer.BACKENDS:
+            raise ValueError('unknown timer backend: %r' % backend)
+
+        self.interval = float(interval)
+        self.backend = backend
+
+        self._fd = None
+        self._mmtimer = None
+
+        if backend == 'timerfd':
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.timerfd_create(_CLOCK_MONOTONIC, _TFD_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), 'timerfd_create failed')
+
+            sec, nsec = divmod(int(round(self.interval * 1e9)), 1000000000)
+            ts = _timespec(sec, nsec)
+            spec = _itimerspec(ts, ts)
+            if libc.timerfd_settime(fd, 0, ctypes.byref(spec), None) < 0:
+                os.close(fd)
+                raise OSError(ctypes.get_errno(), 'timerfd_settime failed')
+            self._fd = fd
+
+        elif backend == 'mmtimer':
+            from flyvr.common.mmtimer import MMTimer
+
+            self._ticks = threading.Semaphore(0)
+            self._mmtimer = MMTimer(max(1, int(self.interval * 1000)), self._ticks.release)
+            self._mmtimer.start()
+
+        else:
+            self._t0 = time.perf_counter()
+            self._n = 0
+
+    def wait(self):
+        """
+        Block until the next tick.
+
+        :return: The number of ticks since the last call, more than one if the caller has fallen behind the clock.
+        """
+        if self._fd is not None:
+            return struct.unpack('=Q', os.read(self._fd, 8))[0]
+
+        elif self._mmtimer is not None:
+            self._ticks.acquire()
+            n = 1
+            while self._ticks.acquire(blocking=False):
+                n += 1
+            return n
+
+        else:
+            t_next = self._t0 + (self._n + 1) * self.interval
+            now = time.perf_counter()
+            if now < t_next:
+                time.sleep(t_next - now)
+                now = time.perf_counter()
+            n = int((now - self._t0) / self.interval)
+            ticks, self._n = max(1, n - self._n), max(n, self._n + 1)
+            return ticks
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        if self._mmtimer is not None:
+            self._mmtimer.stop()
+            self._mmtimer = None
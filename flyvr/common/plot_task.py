@@ -1,30 +1,36 @@
 import warnings
-from collections import deque
 
 import matplotlib.pyplot as plt
 import matplotlib.cbook
 import numpy as np
 
+from flyvr.audio.daq_preview import DAQPreview
 
-def plot_task_daq(disp_queue, channel_names, chunk_size, limit, num_chunks_history=10):
+
+def plot_task_daq(channel_names, sample_rate, limit, history_seconds=5.0, num_bins=1000, display_rate=20.0):
     """
     A coroutine for plotting fast, realtime as per: https://gist.github.com/pklaus/62e649be55681961f6c4. This is used
-    for plotting streaming data recorded as input from the DAQ.
+    for plotting streaming data recorded as input from the DAQ. It plots the min/max envelope of the decimated
+    preview published (in shared memory) by the DAQ process, redrawing at most display_rate times per second, until
+    the preview is closed.
 
-    :param disp_queue: The message queue from which data is sent for plotting.
     :param channel_names: A list of str names for each channel of data.
-    :param chunk_size: How many samples will each chunk of data have.
+    :param sample_rate: The DAQ input sample rate.
     :param limit: The Y-axis limit of the plot.
-    :param num_chunks_history: The number of chunks to keep in the plot history.
+    :param history_seconds: The length of input to plot, as published in the preview.
+    :param num_bins: The number of min/max bins in the preview.
+    :param display_rate: The maximum redraw rate in Hz.
     :return: None
     """
 
     num_channels = len(channel_names)
 
-    # Setup a queue for caching the historical data received so we can plot history of samples up to
-    # some N
-    data_history = deque([np.zeros((chunk_size, num_channels)) for i in range(num_chunks_history)],
-                         maxlen=num_chunks_history)
+    preview = DAQPreview(num_channels, sample_rate, history_seconds=history_seconds, num_bins=num_bins,
+                         writer=False)
+
+    # every bin is drawn as a vertical line from its min to its max
+    x = np.repeat(preview.bin_times(), 2)
+    plot_data = np.zeros((2 * num_bins, num_channels))
 
     warnings.filterwarnings("ignore", category=matplotlib.cbook.mplDeprecation)
     plt.ion()
@@ -32,8 +38,6 @@ def plot_task_daq(disp_queue, channel_names, chunk_size, limit, num_chunks_histo
     fig = plt.figure()
     fig.canvas.set_window_title('traces: daq')
 
-    plot_data = np.zeros((num_chunks_history * chunk_size, num_channels))
-
     # We want to create a subplot for each channel
     axes = []
     backgrounds = []
@@ -42,11 +46,9 @@ def plot_task_daq(disp_queue, channel_names, chunk_size, limit, num_chunks_histo
         ax = fig.add_subplot(num_channels, 1, chn)
         ax.set_title(channel_names[chn - 1])
         backgrounds.append(fig.canvas.copy_from_bbox(ax.bbox))  # cache the background
-        # ax.axis([0, num_chunks_history * chunk_size, 1.5, 2.5])
-        ax.axis([0, num_chunks_history * chunk_size, -limit, limit])
-        # ax.axis([0, num_chunks_history * chunk_size, 0, 4])
+        ax.axis([x[0], x[-1], -limit, limit])
         axes.append(ax)
-        point_sets.append(ax.plot(np.arange(num_chunks_history * chunk_size), plot_data)[0])  # init plot content
+        point_sets.append(ax.plot(x, plot_data[:, chn - 1])[0])  # init plot content
 
     # Set the window position and size, this only works for Qt
     try:
@@ -59,39 +61,25 @@ def plot_task_daq(disp_queue, channel_names, chunk_size, limit, num_chunks_histo
     plt.draw()
     fig.canvas.start_event_loop(0.001)  # otherwise plot freezes after 3-4 iterations
 
-    RUN = True
-    while RUN:
-        if disp_queue.poll(0.1):
-            msg = disp_queue.recv()
-
-            if msg is None:
-                continue
-
-            data = msg[0]
-            time_ns = msg[1]
-
-            if data is not None:
-
-                # Append to the history
-                data_history.append(data)
+    last_count = 0
+    while not preview.closed:
+        fig.canvas.start_event_loop(1. / display_rate)
 
-                # Turned the queued chunks into a flat array
-                sample_i = 0
-                for d in data_history:
-                    plot_data[sample_i:(sample_i + chunk_size), :] = d
-                    sample_i = sample_i + chunk_size
+        count, mins, maxs = preview.read()
+        if count == last_count:
+            continue
+        last_count = count
 
-                for chn in range(num_channels):
-                    fig.canvas.restore_region(backgrounds[chn])  # restore background
-                    point_sets[chn].set_data(np.arange(num_chunks_history * chunk_size), plot_data[:, chn])
-                    axes[chn].draw_artist(point_sets[chn])  # redraw just the points
-                    # fig.canvas.blit(axes[chn].bbox)                    # fill in the axes rectangle
+        plot_data[0::2] = mins
+        plot_data[1::2] = maxs
 
-                fig.canvas.draw()
-                fig.canvas.flush_events()
+        for chn in range(num_channels):
+            fig.canvas.restore_region(backgrounds[chn])  # restore background
+            point_sets[chn].set_ydata(plot_data[:, chn])
+            axes[chn].draw_artist(point_sets[chn])  # redraw just the points
 
-            else:
-                RUN = False
+        fig.canvas.draw()
+        fig.canvas.flush_events()
 
     # clean up
     plt.close(fig)
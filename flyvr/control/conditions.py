@@ -0,0 +1,218 @@
+import re
+import time
+import operator
+
+import numpy as np
+
+from flyvr.fictrac.shmem_transfer_data import SHMEMFicTracState, FICTRAC_STATE_DTYPE
+
+# the (contiguous) float64 fields of SHMEMFicTracState, which are gathered from a numpy view of the state
+_F8 = np.dtype(np.float64)
+_F8_FIELDS = [(n, FICTRAC_STATE_DTYPE.fields[n][1]) for n in FICTRAC_STATE_DTYPE.names
+              if FICTRAC_STATE_DTYPE.fields[n][0].base == _F8]
+_F8_OFFSET = _F8_FIELDS[0][1]
+_F8_COUNT = (FICTRAC_STATE_DTYPE.fields[_F8_FIELDS[-1][0]][0].itemsize + _F8_FIELDS[-1][1] - _F8_OFFSET) // 8
+
+
+def _f8_index(param):
+    """ the index of param (e.g. 'speed' or 'del_rot_cam_vec[1]') in the float64 view of the state, or None """
+    m = re.match(r"""([\w_]+)(?:\[(\d)\])?$""", param)
+    if not m:
+        return None
+    name, idx = m.groups()
+    try:
+        dt, offset = FICTRAC_STATE_DTYPE.fields[name][:2]
+    except KeyError:
+        return None
+    if dt.base != _F8:
+        return None
+    n = 1 if not dt.shape else dt.shape[0]
+    idx = 0 if idx is None else int(idx)
+    if idx >= n:
+        return None
+    return (offset - _F8_OFFSET) // 8 + idx
+
+
+class CompiledConditions(object):
+    """
+    The state conditions (value, comparison operator and threshold) of an experiment, evaluated together.
+
+    The values of all conditions are gathered into one array: the float64 state fields in one copy from a numpy view
+    of the SHMEMFicTracState, everything else (statistics, integer fields) through their getters. Conditions with
+    the lt, le, gt and ge operators are then tested in one pass, as sign * value - sign * threshold >= bias where the
+    sign (-1 for lt and le) turns every comparison into a greater-than, and the bias (the smallest positive float
+    for the strict comparisons) a greater-than into a greater-or-equal (as x - y is only 0 if x == y). Conditions
+    with other operators (eq, is_not, ...) are evaluated one by one.
+    """
+
+    def __init__(self):
+        self._defns = []
+        self._index = {}
+        self._compiled = False
+
+        self._view_owner = None
+        self._view = None
+
+    def __len__(self):
+        return len(self._defns)
+
+    def add(self, param, getter, comparison_operator, value, absolute):
+        """
+        Add a condition (identical conditions are only added once).
+
+        :param str param: The state value (e.g. 'speed' or 'del_rot_cam_vec[1]'), or if it is a statistic, a unique
+        name for it.
+        :param getter: A callable which returns the value from the state.
+        :param comparison_operator: A function of (value, threshold), e.g. operator.gt.
+        :param value: The threshold.
+        :param bool absolute: If the absolute value is compared.
+        :return: The index of the condition.
+        """
+        key = (param, comparison_operator, value, bool(absolute))
+        try:
+            return self._index[key]
+        except KeyError:
+            pass
+
+        i = self._index[key] = len(self._defns)
+        self._defns.append((param, getter, comparison_operator, value, bool(absolute)))
+        self._compiled = False
+        return i
+
+    def compile(self):
+        signs = {operator.gt: 1., operator.ge: 1., operator.lt: -1., operator.le: -1.}
+        strict = (operator.gt, operator.lt)
+
+        vector, python = [], []
+        for i, (param, getter, op, value, absolute) in enumerate(self._defns):
+            if (op in signs) and isinstance(value, (int, float)) and not isinstance(value, bool):
+                vector.append(i)
+            else:
+                python.append(i)
+
+        # every value is taken from one array of the float64 fields followed by the getter values (the sources),
+        # then (if needed) their absolute values, and then (if needed) the negation of all that
+        self._getters = []
+        src_idx = []
+        for i in vector:
+            param, getter = self._defns[i][:2]
+            fi = _f8_index(param)
+            if fi is None:
+                fi = _F8_COUNT + len(self._getters)
+                self._getters.append(getter)
+            src_idx.append(fi)
+
+        self._num_src = n = _F8_COUNT + len(self._getters)
+        self._any_abs = any(self._defns[i][4] for i in vector)
+        self._any_neg = any(signs[self._defns[i][2]] < 0 for i in vector)
+        self._num_pos = n * (2 if self._any_abs else 1)
+        self._ext = np.empty(self._num_pos * (2 if self._any_neg else 1))
+
+        idx = []
+        for i, si in zip(vector, src_idx):
+            _, _, op, value, absolute = self._defns[i]
+            idx.append(si + (n if absolute else 0) + (self._num_pos if signs[op] < 0 else 0))
+        self._ext_idx = np.array(idx, dtype=np.intp)
+        self._thr = np.array([signs[self._defns[i][2]] * self._defns[i][3] for i in vector], dtype=np.float64)
+        self._bias = np.array([np.nextafter(0., 1.) if self._defns[i][2] in strict else 0. for i in vector])
+
+        self._vector = np.array(vector, dtype=np.intp)
+        self._python = python
+        self._compiled = True
+
+    def _f8_view(self, state):
+        # the view is kept while it is of the same state object (e.g. the shared memory)
+        if state is not self._view_owner:
+            self._view = np.frombuffer(state, dtype=np.float64, count=_F8_COUNT, offset=_F8_OFFSET)
+            self._view_owner = state
+        return self._view
+
+    def evaluate(self, state):
+        """
+        :param SHMEMFicTracState state: The state.
+        :return: The (ascending) indices of the conditions which are true.
+        :rtype: numpy.ndarray
+        """
+        if not self._compiled:
+            self.compile()
+
+        ext = self._ext
+        n = self._num_src
+        ext[:_F8_COUNT] = self._f8_view(state)
+        for j, g in enumerate(self._getters, _F8_COUNT):
+            ext[j] = g(state)
+        if self._any_abs:
+            np.abs(ext[:n], out=ext[n:2 * n])
+        if self._any_neg:
+            np.negative(ext[:self._num_pos], out=ext[self._num_pos:])
+
+        true = self._vector[(ext[self._ext_idx] - self._thr) >= self._bias]
+
+        if self._python:
+            py = []
+            for i in self._python:
+                param, getter, op, value, absolute = self._defns[i]
+                v = getter(state)
+                if op(abs(v) if absolute else v, value):
+                    py.append(i)
+            if py:
+                true = np.sort(np.concatenate((true, py)))
+
+        return true
+
+
+def benchmark_conditions(num_conditions=(1, 4, 16, 64, 256), num_frames=5000):
+    """
+    Compare the per-frame cost of checking num_conditions state conditions one by one (as _Event.check does) and
+    with CompiledConditions.
+
+    :return: A list of (number of conditions, seconds per frame one by one, seconds per frame compiled).
+    """
+    from flyvr.control.state_statistics import state_getter
+
+    rng = np.random.RandomState(0)
+    params = [n for n, _ in _F8_FIELDS]
+    params = ['%s[%d]' % (n, i) if FICTRAC_STATE_DTYPE.fields[n][0].shape else n
+              for n in params for i in range(max(1, FICTRAC_STATE_DTYPE.fields[n][0].shape[0]
+                                                 if FICTRAC_STATE_DTYPE.fields[n][0].shape else 1))]
+
+    states = []
+    for _ in range(100):
+        s = SHMEMFicTracState()
+        np.frombuffer(s, dtype=np.float64, count=_F8_COUNT, offset=_F8_OFFSET)[:] = rng.uniform(-1, 1, _F8_COUNT)
+        states.append(s)
+
+    results = []
+    for n in num_conditions:
+        defns = []
+        cc = CompiledConditions()
+        for i in range(n):
+            param = params[i % len(params)]
+            op = (operator.lt, operator.le, operator.gt, operator.ge)[i % 4]
+            value = float(rng.uniform(-1, 1)) + (i // len(params))
+            absolute = bool(i % 3 == 0)
+            getter = state_getter(param)
+            defns.append((getter, op, value, abs if absolute else (lambda _x: _x)))
+            cc.add(param, getter, op, value, absolute)
+
+        t0 = time.perf_counter()
+        for f in range(num_frames):
+            s = states[f % len(states)]
+            _ = [i for i, (c, op, value, abs_) in enumerate(defns) if op(abs_(c(s)), value)]
+        t_loop = (time.perf_counter() - t0) / num_frames
+
+        t0 = time.perf_counter()
+        for f in range(num_frames):
+            s = states[f % len(states)]
+            _ = cc.evaluate(s)
+        t_compiled = (time.perf_counter() - t0) / num_frames
+
+        results.append((n, t_loop, t_compiled))
+
+    return results
+
+
+def main_benchmark():
+    print('%12s %16s %16s' % ('conditions', 'one by one (us)', 'compiled (us)'))
+    for n, t_loop, t_compiled in benchmark_conditions():
+        print('%12d %16.2f %16.2f' % (n, 1e6 * t_loop, 1e6 * t_compiled))
@@ -1,9 +1,9 @@
-import re
 import time
 import logging
+import threading
+import collections
 import os.path
 import operator
-import collections
 import importlib.util
 
 from typing import Optional
@@ -14,38 +14,56 @@ import numpy as np
 from flyvr.common import BACKEND_VIDEO as _BACKEND_VIDEO, BACKEND_DAQ as _BACKEND_DAQ,\
     BACKEND_AUDIO as _BACKEND_AUDIO, Randomizer, SharedState
 from flyvr.common.ipc import PlaylistSender
-
-
-class _MovingAverageStateVariable(object):
-
-    def __init__(self, name_or_getter, num_frames_mean=25, name=''):
-        if isinstance(name_or_getter, str):
-            self._getter = operator.attrgetter(name)
-        else:
-            self._getter = name_or_getter
-        self._name = name or repr(self._getter)
-        self._hist = collections.deque(maxlen=num_frames_mean)
-
-    def __repr__(self):
-        return "<MovingAverageStateVariable(%s, %s)>" % (self._name, self._hist.maxlen)
-
-    def __call__(self, state):
-        self._hist.append(self._getter(state))
-        return np.mean(self._hist)
+from flyvr.control.state_statistics import StateStatistics, state_getter
+from flyvr.control.conditions import CompiledConditions
+from flyvr.control.scheduler import EventScheduler
 
 
 class _Event(object):
 
-    def __init__(self, state_getter_callable, comparison_operator, absolute_comparison, value, dt):
+    def __init__(self, state_getter_callable, comparison_operator, absolute_comparison, value, dt, condition=None,
+                 edge=False, hysteresis=None, refractory=None):
+        """
+        :param bool edge: Only perform when the condition becomes true, rather than on every frame it is true.
+        :param float hysteresis: Once true, the condition stays true until the value is back past the threshold by
+        this much (only for the lt, le, gt and ge operators).
+        :param float refractory: After performing, do not perform again for this long (seconds).
+        """
         self._c = state_getter_callable
+        # the index of this event's condition in the experiment's CompiledConditions
+        self.condition = condition
         self._op = comparison_operator
         self._value = value
         self._abs = abs if absolute_comparison else lambda x: x
         self._dt = dt
         self._switched = False
 
+        self._edge = bool(edge)
+        self._hysteresis = hysteresis
+        self._release = None
+        if hysteresis:
+            if comparison_operator in (operator.gt, operator.ge):
+                self._release = lambda v, _lo=value - hysteresis: v < _lo
+            elif comparison_operator in (operator.lt, operator.le):
+                self._release = lambda v, _hi=value + hysteresis: v > _hi
+            else:
+                raise ValueError('hysteresis requires one of the lt, le, gt or ge comparisons')
+        self._refractory = refractory
+
+        # if the (edge, hysteresis or refractory) events are checked one by one (see gate)
+        self.gated = bool(self._edge or self._release or self._refractory)
+        self._active = False
+        self._t_performed = None
+        # the number of times the condition was true but the event not performed
+        self.suppressed = 0
+
+    def _describe_gating(self):
+        return ''.join(', %s=%s' % (k, v) for k, v in (('edge', self._edge), ('hysteresis', self._hysteresis),
+                                                         ('refractory', self._refractory)) if v)
+
     def __repr__(self):
-        return "<%s(%s %s %s, dt=%s)>" % (self.__class__.__name__, self._c, self._op, self._value, self._dt)
+        return "<%s(%s %s %s, dt=%s%s)>" % (self.__class__.__name__, self._c, self._op, self._value, self._dt,
+                                            self._describe_gating())
 
     def perform(self, state, experiment):
         pass
@@ -55,13 +73,46 @@ class _Event(object):
 
     def check(self, state, experiment):
         # call this directly to save a little time
-        if self._op(self._abs(self._c(state)), self._value):
+        if self.gated:
+            self.gate(self._abs(self._c(state)), state, experiment)
+        elif self._op(self._abs(self._c(state)), self._value):
             self.perform(state, experiment)
 
+    def gate(self, v, state, experiment):
+        """ perform, unless suppressed by the edge, hysteresis or refractory options, given the (compared) value v """
+        if self._active and (self._release is not None):
+            active = not self._release(v)
+        else:
+            active = self._op(v, self._value)
+        rising = active and not self._active
+        self._active = active
+
+        if not active:
+            return
+        if self._edge and not rising:
+            self.suppressed += 1
+            return
+        if self._refractory:
+            # noinspection PyProtectedMember
+            t = experiment._time()
+            if (self._t_performed is not None) and ((t - self._t_performed) < self._refractory):
+                self.suppressed += 1
+                return
+            self._t_performed = t
+
+        self.perform(state, experiment)
+
+    def due(self, experiment):
+        """ the time (seconds after the experiment started) at which fire() should be called """
+        return self._dt
+
+    def fire(self, state, experiment):
+        self.perform(state, experiment)
+        self._switched = True
+
     def check_dt(self, dt, state, experiment):
-        if (dt > self._dt) and (not self._switched):
-            self.perform(state, experiment)
-            self._switched = True
+        if (dt > self.due(experiment)) and (not self._switched):
+            self.fire(state, experiment)
 
 
 class ExperimentStopEvent(_Event):
@@ -85,37 +136,90 @@ class PlaylistItemEvent(_Event):
         super().__init__(*args, **kwargs)
 
     def __repr__(self):
-        return "<%s(backend=%s, identifier=%s, dt=%s)>" % (self.__class__.__name__, self._playlist_backend, self._playlist_identifier, self._dt)
+        return "<%s(backend=%s, identifier=%s, dt=%s%s)>" % (self.__class__.__name__, self._playlist_backend,
+                                                             self._playlist_identifier, self._dt,
+                                                             self._describe_gating())
 
     def perform(self, state, experiment):
         experiment.play_playlist_item(self._playlist_backend, self._playlist_identifier)
 
+    def due(self, experiment):
+        # timed items are sent ahead of time, scheduled to start on every backend at exactly dt after the start
+        return self._dt - experiment.SCHEDULE_LEAD_TIME
+
+    def fire(self, state, experiment):
+        experiment.play_playlist_item(self._playlist_backend, self._playlist_identifier,
+                                      time_ns=experiment.experiment_time_ns(self._dt))
+        self._switched = True
+
 
 class Experiment(object):
 
     BACKEND_VIDEO, BACKEND_AUDIO, BACKEND_DAQ = _BACKEND_VIDEO, _BACKEND_AUDIO, _BACKEND_DAQ
 
-    def __init__(self, events=(), timed=()):
+    # how far in advance (seconds) scheduled playlist items are sent to the backends
+    SCHEDULE_LEAD_TIME = 0.1
+
+    # the state: keys which compute a statistic of the parameter before comparing it, and that statistic
+    STATE_STATISTICS = {'average': 'mean', 'variance': 'var', 'std': 'std', 'min': 'min', 'max': 'max'}
+
+    # the minimum number of state conditions for which they are evaluated together (CompiledConditions), rather than
+    # by every event (below this, numpy's per-call overhead costs more than it saves)
+    COMPILE_MIN_CONDITIONS = 16
+
+    # sends the playlist items, etc, to the backends (the simulator replaces it so no port is bound)
+    PLAYLIST_SENDER = PlaylistSender
+
+    def __init__(self, events=(), timed=(), statistics=None, conditions=None):
         self._events = events
         self._timed = timed
 
+        # running statistics of the state, updated every frame (before any events are checked)
+        self.statistics = StateStatistics() if statistics is None else statistics
+
+        # the events of every condition, if they are evaluated together
+        self._conditions = None
+        self._condition_events = None
+        if (conditions is not None) and (len(conditions) >= self.COMPILE_MIN_CONDITIONS) and \
+                all(e.condition is not None for e in events):
+            conditions.compile()
+            self._conditions = conditions
+            self._condition_events = [[] for _ in range(len(conditions))]
+            for e in events:
+                if not e.gated:
+                    self._condition_events[e.condition].append(e)
+        # (which need every value, not just if the condition is true)
+        self._gated_events = [e for e in events if e.gated]
+
         # just for yaml initialzed time experiments
         self.__t0 = None
+        self.__t0_ns = None
+        # the timed events are fired (from a heap, on its own thread) when due, independent of the FicTrac frames
+        self._scheduler = None
+        # the last state, for the timed events
+        self._state = None
+        # the clock (and scheduler) of a simulated experiment, else the wall clock
+        self._clock = None
 
         self._playlist = {}
-        self._ipc = PlaylistSender()
+        self._ipc = self.PLAYLIST_SENDER()
+        # (the scheduler thread also sends)
+        self._ipc_lock = threading.Lock()
 
         self._shared_state = None  # type: Optional[SharedState]
 
         self.log = logging.getLogger('flyvr.experiment.%s' % self.__class__.__name__)
 
     def _log_describe(self):
+        for stat in self.statistics:
+            self.log.debug('state statistic: %r' % stat)
         for evt in self._events:
             self.log.debug('state-based event: %r' % evt)
         for evt in self._timed:
             self.log.debug('time-based event: %r' % evt)
 
     def stop(self, timeout=5):
+        self._stop_scheduler()
         if self._shared_state:
             self._shared_state.signal_stop().join(timeout=timeout)
 
@@ -160,20 +264,93 @@ class Experiment(object):
         """
         return dict(self._playlist)
 
-    def play_playlist_item(self, backend, identifier):
+    def experiment_time_ns(self, dt):
+        """
+        returns the absolute time (in the TIME_NS clock of all backends) dt seconds after the experiment started,
+        or None if it has not started
+        """
+        if self.__t0_ns is None:
+            return None
+        return self.__t0_ns + int(dt * 1e9)
+
+    def play_playlist_item(self, backend, identifier, time_ns=None, counter=None):
+        """
+        play the playlist item now or, if time_ns (a time in the TIME_NS clock) or counter (a value of the
+        backend output sample or frame counter) is given, start it at exactly that sample or frame
+        """
         assert backend in (Experiment.BACKEND_VIDEO, Experiment.BACKEND_AUDIO, Experiment.BACKEND_DAQ)
-        self._ipc.process(**{'%s_item' % backend: {'identifier': identifier}})
+        msg = {'identifier': identifier}
+        if time_ns is not None:
+            msg['time_ns'] = int(time_ns)
+        if counter is not None:
+            msg['counter'] = int(counter)
+        self._send(**{'%s_item' % backend: msg})
+
+    def play_playlist_items(self, items, time_ns=None):
+        """
+        start playlist items on several backends (a dict of backend: identifier) at the same instant; time_ns,
+        or by default SCHEDULE_LEAD_TIME from now
+        """
+        if time_ns is None:
+            now_ns = time.time_ns() if self._clock is None else self._clock.time_ns()
+            time_ns = now_ns + int(self.SCHEDULE_LEAD_TIME * 1e9)
+        for backend, identifier in items.items():
+            self.play_playlist_item(backend, identifier, time_ns=time_ns)
+        return time_ns
 
     def play_backend_item(self, backend, **conf):
         assert backend in (Experiment.BACKEND_VIDEO, Experiment.BACKEND_AUDIO, Experiment.BACKEND_DAQ)
-        self._ipc.process(**{backend: conf})
+        self._send(**{backend: conf})
 
     def backend_action(self, backend, action):
         assert backend in (Experiment.BACKEND_VIDEO, Experiment.BACKEND_AUDIO, Experiment.BACKEND_DAQ)
-        self._ipc.process(**{'%s_action' % backend: action})
+        self._send(**{'%s_action' % backend: action})
 
     def item_mutate(self, backend, identifier, attribute, value):
-        self._ipc.process(**{'%s_mutate' % backend: (identifier, attribute, value)})
+        self._send(**{'%s_mutate' % backend: (identifier, attribute, value)})
+
+    def _send(self, **msg):
+        with self._ipc_lock:
+            self._ipc.process(**msg)
+
+    def _time(self):
+        # (seconds, of the simulated clock if there is one)
+        return time.perf_counter() if self._clock is None else self._clock.time()
+
+    def _start_scheduler(self):
+        t0 = self._time()
+        self._scheduler = EventScheduler(name='flyvr-experiment-timed') if self._clock is None else self._clock
+        for evt in self._timed:
+            self._scheduler.schedule(t0 + evt.due(self), self._fire_timed, evt)
+        self._scheduler.start()
+
+    def _fire_timed(self, evt):
+        evt.fire(self._state, self)
+
+    def _stop_scheduler(self):
+        if self._scheduler is not None:
+            self._scheduler.stop()
+            if len(self._timed):
+                self.log.info('timed events: %r' % self._scheduler.stats())
+            self._scheduler = None
+        if self.suppressed_triggers:
+            self.log.info('suppressed %d repeated triggers of state events' % self.suppressed_triggers)
+
+    @property
+    def suppressed_triggers(self):
+        """ the number of times state events were not performed because of their edge, hysteresis or refractory """
+        return sum(e.suppressed for e in self._events)
+
+    def _check_events(self, state):
+        if self._conditions is None:
+            for e in self._events:
+                e.check(state, self)
+        else:
+            for i in self._conditions.evaluate(state):
+                for e in self._condition_events[i]:
+                    e.perform(state, self)
+            for e in self._gated_events:
+                e.check(state, self)
 
     @classmethod
     def from_yaml(cls, stream_like):
@@ -184,6 +361,8 @@ class Experiment(object):
     def from_items(cls, state_item_defns, timed_item_defns):
         timed = []
         events = []
+        statistics = StateStatistics()
+        conditions = CompiledConditions()
 
         def _evt_factory(_evt_type, _evt_conf, **_kw):
             if _evt_type == 'print':
@@ -200,33 +379,44 @@ class Experiment(object):
             comparison, action_defn = defn.popitem()
             operator_ = getattr(operator, comparison)
 
-            avg = action_defn.pop('average', 1)
+            stat = [(k, action_defn.pop(k)) for k in (tuple(cls.STATE_STATISTICS) + ('ema', )) if k in action_defn]
             absolute = bool(action_defn.pop('absolute', False))
+            edge = bool(action_defn.pop('edge', False))
+            hysteresis = action_defn.pop('hysteresis', None)
+            # (milliseconds, like the time: keys)
+            refractory = action_defn.pop('refractory', None)
+            if refractory is not None:
+                refractory = float(refractory) / 1000.
             value = action_defn.pop('value')
             event_definitions = action_defn.pop('do')
 
-            full_param = param
-            m = re.match(r"""([\w_]+)\[(\d)\]""", param)
-            if m:
-                param, idx, = m.groups()
-                _getter = lambda _s, _idx=operator.itemgetter(int(idx)), _attr=operator.attrgetter(param): _idx(_attr(_s))
-            else:
-                _getter = operator.attrgetter(param)
+            if len(stat) > 1:
+                raise ValueError('%s: only one of %s may be given' % (param, ', '.join(k for k, _ in stat)))
 
-            if avg == 1:
-                state_getter = _getter
+            if not stat or (stat[0] == ('average', 1)):
+                _getter = state_getter(param)
+                condition = conditions.add(param, _getter, operator_, value, absolute)
             else:
-                state_getter = _MovingAverageStateVariable(_getter, int(avg), name=full_param)
+                if stat[0][0] == 'ema':
+                    _getter = statistics.ema(param, float(stat[0][1])).getter()
+                else:
+                    _getter = statistics.window(param, int(stat[0][1])).getter(cls.STATE_STATISTICS[stat[0][0]])
+                # (named so it is not taken from the state)
+                condition = conditions.add(repr(_getter), _getter, operator_, value, absolute)
 
             for evt in event_definitions:
                 type_, evt_conf = evt.popitem()
 
                 evt = _evt_factory(type_, evt_conf,
-                                   state_getter_callable=state_getter,
+                                   state_getter_callable=_getter,
                                    comparison_operator=operator_,
                                    absolute_comparison=absolute,
                                    value=value,
-                                   dt=None)
+                                   dt=None,
+                                   condition=condition,
+                                   edge=edge,
+                                   hysteresis=hysteresis,
+                                   refractory=refractory)
                 events.append(evt)
 
         for _t, defn in timed_item_defns.items():
@@ -244,7 +434,7 @@ class Experiment(object):
                                    dt=t)
                 timed.append(evt)
 
-        return cls(events, timed)
+        return cls(events, timed, statistics=statistics, conditions=conditions)
 
     @classmethod
     def new_from_python_file(cls, path):
@@ -274,33 +464,152 @@ class Experiment(object):
         if self._shared_state is None:
             return
 
+        self._state = state
+
         if self.__t0 is None:
             if self._shared_state.is_started():
-                self.__t0 = time.time()
+                self.__t0 = time.time() if self._clock is None else self._clock.time()
+                self.__t0_ns = self._shared_state.TIME_NS
+                if self._timed:
+                    self._start_scheduler()
             else:
                 return
 
-        for e in self._events:
-            e.check(state, self)
+        self.statistics.update(state)
+        self._check_events(state)
+
+
+class _FrameLatencyLog(object):
+    """
+    Records, for every frame the experiment processed, the frame number, the latency from the frame being published
+    by the FicTrac driver to the experiment having processed it (seconds) and the number of frames skipped before it.
+    Keeps statistics, and logs (in batches) to the h5 logger if there is one.
+    """
+
+    DATASET = '/experiment/frame_latency'
+
+    def __init__(self, logger, batch_size=100, history=4096):
+        self._logger = logger
+        self._batch = np.empty((batch_size, 3))
+        self._n_batch = 0
+
+        self.frames = 0
+        self.skipped = 0
+        self._latencies = collections.deque(maxlen=history)
+        self._latency_sum = 0.
+        self._latency_max = 0.
+
+        if logger is not None:
+            logger.create(self.DATASET, shape=[2048, 3], maxshape=[None, 3], dtype=np.float64, chunks=(2048, 3))
+
+    def record(self, frame_cnt, latency, skipped):
+        self.frames += 1
+        self.skipped += skipped
+        self._latencies.append(latency)
+        self._latency_sum += latency
+        self._latency_max = max(self._latency_max, latency)
+
+        if self._logger is not None:
+            self._batch[self._n_batch] = (frame_cnt, latency, skipped)
+            self._n_batch += 1
+            if self._n_batch == len(self._batch):
+                self.flush()
+
+    def flush(self):
+        if self._n_batch:
+            self._logger.log(self.DATASET, self._batch[:self._n_batch].copy())
+            self._n_batch = 0
+
+    def stats(self):
+        return {'frames': self.frames,
+                'skipped': self.skipped,
+                'latency_mean': self._latency_sum / self.frames if self.frames else None,
+                'latency_p99': float(np.percentile(self._latencies, 99)) if self.frames else None,
+                'latency_max': self._latency_max if self.frames else None}
+
+
+def do_loop(exp, delay, force=False, flyvr_state=None):
+    """
+    Run the experiment (in this process) on every FicTrac frame published by the FicTrac driver or replay. It is
+    woken by every new frame rather than polling, frames which arrive while it is busy are skipped (and counted), and
+    the latency from each frame being published to the experiment having processed it is recorded.
+
+    :param float delay: The frame interval when force is given.
+    :param bool force: Process the (fictrac shared memory) state every delay seconds, even if nothing publishes
+    frames (for testing).
+    :param SharedState flyvr_state: The shared state (with the h5 logger, if any) of the experiment process.
+    """
+    from flyvr.fictrac.frame_channel import FrameSubscriber
+
+    log = logging.getLogger('flyvr.experiment.do_loop')
+
+    if flyvr_state is None:
+        flyvr_state = SharedState(None, None)
+    subscriber = FrameSubscriber()
+    latency = _FrameLatencyLog(flyvr_state.logger)
+
+    while flyvr_state.is_running_well() and not flyvr_state.is_stopped():
+        if force:
+            time.sleep(delay)
+            exp.process_state(flyvr_state._fictrac_shmem_state)
+            continue
+
+        skipped = subscriber.wait()
+        if skipped is None:
+            continue
+        if skipped and not latency.skipped:
+            log.warning('experiment falling behind fictrac, skipped %d frames' % skipped)
 
-        dt = time.time() - self.__t0
-        for t in self._timed:
-            t.check_dt(dt, state, self)
+        state = subscriber.state
+        exp.process_state(state)
+        # (lets a lockstep replay advance)
+        flyvr_state.EXPERIMENT_FICTRAC_FRAME_NUM = state.frame_cnt
 
+        latency.record(state.frame_cnt, (time.perf_counter_ns() - subscriber.publish_ns) * 1e-9, skipped)
 
-def do_loop(exp, delay, force=False):
-    from flyvr.common import SharedState
+    if flyvr_state.logger is not None:
+        latency.flush()
+    subscriber.close()
 
-    flyvr_state = SharedState(None, None)
-    data = flyvr_state._fictrac_shmem_state
-    old_frame_count = data.frame_cnt
+    st = latency.stats()
+    if st['frames']:
+        log.info("processed %d fictrac frames (%d skipped), frame to decision latency mean %.2f ms, 99th percentile "
+                 "%.2f ms, max %.2f ms" % (st['frames'], st['skipped'], 1e3 * st['latency_mean'],
+                                           1e3 * st['latency_p99'], 1e3 * st['latency_max']))
 
-    while flyvr_state.is_running_well():
-        new_frame_count = data.frame_cnt
-        if (old_frame_count != new_frame_count) or force:
-            exp.process_state(data)
-            old_frame_count = new_frame_count
-            time.sleep(delay)
+    # noinspection PyProtectedMember
+    exp._stop_scheduler()
+
+
+def run_experiment(options):
+    """
+    Run the experiment in its own process (the experiment_process option), rather than in the FicTrac driver, so that
+    tracking and logging are not delayed by the experiment.
+    """
+    from flyvr.common.build_arg_parser import setup_experiment, setup_logging
+    from flyvr.common.logger import DatasetLogServerThreaded
+
+    setup_logging(options)
+    log = logging.getLogger('flyvr.experiment.run_experiment')
+
+    setup_experiment(options)
+    if not options.experiment:
+        log.info('no experiment')
+        return
+
+    with DatasetLogServerThreaded() as log_server:
+        logger = log_server.start_logging_server(options.record_file.replace('.h5', '.experiment.h5'))
+        state = SharedState(options=options, logger=logger, where='experiment')
+
+        # noinspection PyProtectedMember
+        options.experiment._set_shared_state(state)
+        # noinspection PyProtectedMember
+        options.experiment._log_describe()
+
+        log.info('running experiment %r in its own process' % options.experiment)
+        do_loop(options.experiment, 1 / 200., flyvr_state=state)
+
+    log.info('finished')
 
 
 def main_experiment():
@@ -317,9 +626,10 @@ def main_experiment():
     if not options.experiment:
         parser.error("No experiment specified")
 
+    state = SharedState(options=options, logger=None)
     # noinspection PyProtectedMember
-    options.experiment._set_shared_state(SharedState(options=options, logger=None))
+    options.experiment._set_shared_state(state)
 
     # noinspection PyProtectedMember
     options.experiment._log_describe()
-    do_loop(options.experiment, 1/200., options.force)
+    do_loop(options.experiment, 1/200., options.force, flyvr_state=state)
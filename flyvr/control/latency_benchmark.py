@@ -0,0 +1,271 @@
+import time
+import logging
+import operator
+import threading
+import collections
+
+import numpy as np
+
+from flyvr.common import BACKEND_AUDIO, BACKEND_DAQ, BACKEND_VIDEO
+from flyvr.control.experiment import Experiment, PlaylistItemEvent
+from flyvr.control.state_statistics import state_getter
+
+# the hops from a fictrac frame crossing the threshold to the stimulus leaving the hardware
+HOPS = ('tracking_experiment', 'experiment_ipc', 'ipc_backend', 'backend_hardware', 'total')
+
+
+class _TriggerExperiment(Experiment):
+    """
+    Plays a playlist item on every backend whenever the speed rises above the threshold (alternately the first and
+    second item, so every trigger starts a new item), recording when each trigger was decided.
+    """
+
+    def __init__(self, playlist, backends, threshold):
+        """
+        :param dict playlist: The playlist, which must have at least two items for every backend.
+        :param backends: The backends to play items on.
+        :param float threshold: The speed threshold.
+        """
+        super().__init__()
+        self._set_playlist(playlist)
+
+        # backend: (identifier, identifier)
+        self.items = {}
+        for backend in backends:
+            ids = self.configured_playlist_items.get(backend, [])
+            if len(ids) < 2:
+                raise ValueError('the %s playlist must have at least two items' % backend)
+            self.items[backend] = tuple(ids[:2])
+
+        self._triggers = [[PlaylistItemEvent(state_getter('speed'), operator.gt, False, threshold, None,
+                                             backend=backend, identifier=ids[i])
+                           for backend, ids in self.items.items()]
+                          for i in (0, 1)]
+        self._threshold = threshold
+        self._above = True
+        # (trigger number, frame number, time_ns)
+        self.decisions = []
+
+    def process_state(self, state):
+        if (self._shared_state is None) or (not self._shared_state.is_started()):
+            return
+
+        above = state.speed > self._threshold
+        if above and not self._above:
+            n = len(self.decisions)
+            self.decisions.append((n, state.frame_cnt, self._shared_state.TIME_NS))
+            for evt in self._triggers[n % 2]:
+                evt.check(state, self)
+        self._above = above
+
+
+def match_latencies(items, triggers, decisions, sends, tocs):
+    """
+    Follow every trigger through every hop.
+
+    :param dict items: backend: (identifier, identifier), the items alternately played by the triggers.
+    :param triggers: A list of (trigger number, frame number, time_ns) of the frames which crossed the threshold.
+    :param decisions: A list of (trigger number, frame number, time_ns) of the experiment deciding to play the items.
+    :param sends: A list of (time_ns, backend, identifier) of the playlist item messages seen on the IPC bus.
+    :param tocs: A list of (time_ns, backend, identifier, output_latency_ns or None) of the playlist item (TOC)
+    messages from the backends.
+    :return: A dict, for every backend, of a dict of every hop (see HOPS) to an array of latencies (seconds).
+    Triggers which did not make it through every hop (e.g. because the experiment missed a frame) are left out.
+    """
+    decided = {n: t for n, _, t in decisions}
+
+    out = {}
+    for backend, ids in items.items():
+        _sends = [(t, i) for t, b, i in sends if b == backend]
+        _tocs = [(t, i, lat) for t, b, i, lat in tocs if b == backend]
+
+        hops = collections.defaultdict(list)
+        for n, _, t_frame in triggers:
+            t_decision = decided.get(n)
+            if t_decision is None:
+                continue
+            identifier = ids[n % 2]
+
+            t_send = next((t for t, i in _sends if (i == identifier) and (t >= t_decision)), None)
+            if t_send is None:
+                continue
+            toc = next(((t, lat) for t, i, lat in _tocs if (i == identifier) and (t >= t_send)), None)
+            if toc is None:
+                continue
+            t_backend, hw = toc
+
+            hops['tracking_experiment'].append(t_decision - t_frame)
+            hops['experiment_ipc'].append(t_send - t_decision)
+            hops['ipc_backend'].append(t_backend - t_send)
+            if hw is not None:
+                hops['backend_hardware'].append(hw)
+            hops['total'].append(t_backend + (hw or 0) - t_frame)
+
+        out[backend] = {h: np.array(hops[h], dtype=np.float64) * 1e-9 for h in HOPS}
+
+    return out
+
+
+def summarize(latencies):
+    """
+    :return: A dict, for every backend and hop, of the number of triggers and the mean, median, 99th percentile and
+    max latency (seconds).
+    """
+    summary = {}
+    for backend, hops in latencies.items():
+        for hop, v in hops.items():
+            if len(v):
+                summary[(backend, hop)] = {'n': len(v), 'mean': float(v.mean()), 'p50': float(np.median(v)),
+                                           'p99': float(np.percentile(v, 99)), 'max': float(v.max())}
+            else:
+                summary[(backend, hop)] = {'n': 0}
+    return summary
+
+
+def _collect_sends(sends, stop):
+    from flyvr.common.ipc import PlaylistReciever
+
+    rx = PlaylistReciever()
+    while not stop.is_set():
+        msg = rx.get_next_element()
+        t = time.time_ns()
+        for k, v in msg.items():
+            if k.endswith('_item') and isinstance(v, dict):
+                sends.append((t, k[:-len('_item')], v.get('identifier')))
+
+
+def _collect_tocs(tocs, stop):
+    from flyvr.common.ipc import Reciever, RELAY_HOST, RELAY_RECIEVE_PORT, CommonMessages
+
+    rx = Reciever(host=RELAY_HOST, port=RELAY_RECIEVE_PORT, channel=b'')
+    while not stop.is_set():
+        msg = rx.get_next_element()
+        if CommonMessages.EXPERIMENT_PLAYLIST_ITEM in msg:
+            tocs.append((msg['time_ns'], msg['backend'], msg[CommonMessages.EXPERIMENT_PLAYLIST_ITEM],
+                         msg.get('output_latency_ns')))
+
+
+def run_benchmark(options, backends, num_triggers=50, fps=100., period=0.5, threshold=0.5):
+    """
+    Measure the closed loop latency, from a fictrac frame crossing a threshold to the stimulus being output, through
+    the real experiment, IPC and backend processes. Synthetic fictrac frames, whose speed alternates between 0 and 1
+    every period seconds, are written to the fictrac shared memory (and published, see FramePublisher) at fps.
+    Every time the speed rises above the threshold the experiment plays the first (or alternately second) playlist
+    item of every backend.
+
+    :param options: The flyvr options (with the playlist, which must have at least two items for every backend).
+    :param backends: The backends to start and measure (audio, daq and/or video).
+    :return: See match_latencies.
+    """
+    from flyvr.audio.io_task import run_io
+    from flyvr.audio.sound_server import run_sound_server
+    from flyvr.common import SharedState
+    from flyvr.common.concurrent_task import ConcurrentTask
+    from flyvr.common.ipc import run_main_relay
+    from flyvr.common.periodic_timer import PeriodicTimer
+    from flyvr.control.experiment import do_loop
+    from flyvr.fictrac.frame_channel import FramePublisher
+    from flyvr.fictrac.shmem_transfer_data import new_mmap_shmem_buffer
+
+    log = logging.getLogger('flyvr.latency_benchmark')
+
+    runners = {BACKEND_DAQ: run_io, BACKEND_AUDIO: run_sound_server}
+    if BACKEND_VIDEO in backends:
+        from flyvr.video.video_server import run_video_server
+        runners[BACKEND_VIDEO] = run_video_server
+
+    experiment = _TriggerExperiment(options.playlist, backends, threshold)
+
+    relay = ConcurrentTask(task=run_main_relay, comms=None, taskinitargs=[])
+    relay.start()
+
+    tasks = []
+    for backend in backends:
+        t = ConcurrentTask(task=runners[backend], comms=None, taskinitargs=[options])
+        t.start()
+        tasks.append(t)
+
+    state = SharedState(options=options, logger=None, where='latency_benchmark')
+
+    stop = threading.Event()
+    sends, tocs = [], []
+    for target, dest in ((_collect_sends, sends), (_collect_tocs, tocs)):
+        threading.Thread(target=target, args=(dest, stop), daemon=True).start()
+
+    triggers = []
+    try:
+        if not state.wait_for_backends(*backends, timeout=60):
+            raise RuntimeError('not all backends (%s) became ready' % ', '.join(backends))
+
+        # noinspection PyProtectedMember
+        experiment._set_shared_state(state)
+        state.signal_start()
+        state.wait_for_start(timeout=10)
+
+        exp_thread = threading.Thread(target=do_loop, args=(experiment, None), kwargs={'flyvr_state': state},
+                                      daemon=True)
+        exp_thread.start()
+
+        fictrac = new_mmap_shmem_buffer()
+        publisher = FramePublisher()
+        timer = PeriodicTimer(1. / fps)
+        frames_per_period = max(1, int(round(period * fps)))
+
+        log.info('measuring %d triggers of %s' % (num_triggers, ', '.join(backends)))
+        fn = fictrac.frame_cnt
+        i = 0
+        while len(triggers) < num_triggers:
+            timer.wait()
+            fn += 1
+            i += 1
+            fictrac.speed = float((i // frames_per_period) % 2)
+            fictrac.frame_cnt = fn
+            t = time.time_ns()
+            publisher.publish(fictrac)
+            if (i % (2 * frames_per_period)) == frames_per_period:
+                triggers.append((len(triggers), fn, t))
+
+        # let the last trigger through
+        time.sleep(1.)
+        timer.close()
+        publisher.close()
+
+    finally:
+        state.signal_stop().join(timeout=5)
+        stop.set()
+        for t in tasks + [relay]:
+            t.close()
+
+    return match_latencies(experiment.items, triggers, experiment.decisions, sends, tocs)
+
+
+def main_latency_benchmark():
+    from flyvr.common.build_arg_parser import build_argparser, parse_options, setup_logging
+
+    parser = build_argparser()
+    parser.add_argument('--backends', default='daq,audio',
+                        help='comma separated backends to measure (daq, audio and/or video). The DAQ is always '
+                             'simulated, use --audio_device null to run without audio hardware')
+    parser.add_argument('--triggers', type=int, default=50, help='number of threshold crossings to measure')
+    parser.add_argument('--fps', type=float, default=100., help='synthetic fictrac frame rate')
+
+    options = parse_options(parser.parse_args(), parser)
+    setup_logging(options)
+
+    if options.experiment:
+        parser.error('the latency benchmark runs its own experiment, remove the experiment from the config')
+
+    options.simulate_daq = True
+    options.wait = True
+
+    backends = [b.strip() for b in options.backends.split(',') if b.strip()]
+    summary = summarize(run_benchmark(options, backends, num_triggers=options.triggers, fps=options.fps))
+
+    print('%8s %20s %5s %10s %10s %10s %10s' % ('backend', 'hop', 'n', 'mean (ms)', 'p50 (ms)', 'p99 (ms)',
+                                                'max (ms)'))
+    for (backend, hop), s in summary.items():
+        if s['n']:
+            print('%8s %20s %5d %10.2f %10.2f %10.2f %10.2f' % (backend, hop, s['n'], 1e3 * s['mean'],
+                                                                1e3 * s['p50'], 1e3 * s['p99'], 1e3 * s['max']))
+        else:
+            print('%8s %20s %5d' % (backend, hop, 0))
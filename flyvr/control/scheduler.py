@@ -0,0 +1,115 @@
+import time
+import heapq
+import logging
+import itertools
+import threading
+import collections
+
+import numpy as np
+
+
+class EventScheduler(object):
+    """
+    Calls functions at their due times (in the time.perf_counter clock) from its own thread. The pending calls are
+    kept in a heap, so only the calls which are due cost anything. The thread sleeps until spin_margin before the
+    next call is due and then spins the rest of the way, so calls are made within microseconds of their due time
+    rather than at the resolution of the OS sleep (or of the FicTrac frames).
+    """
+
+    def __init__(self, spin_margin=0.002, history=4096, name='scheduler'):
+        """
+        :param float spin_margin: How long (seconds) before a due time to stop sleeping and spin.
+        :param int history: How many of the last calls to keep the lateness of (see stats).
+        """
+        self.spin_margin = float(spin_margin)
+        self.name = name
+
+        self._heap = []
+        # (ties are called in the order they were scheduled)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = None
+
+        self._lateness = collections.deque(maxlen=int(history))
+
+        self.log = logging.getLogger('flyvr.control.scheduler')
+
+    def __len__(self):
+        return len(self._heap)
+
+    def schedule(self, due, func, *args):
+        """
+        :param float due: When to call func, a time.perf_counter() value (if it has already passed, func is called
+        as soon as possible).
+        :param func: Called as func(*args) on the scheduler thread.
+        """
+        with self._cond:
+            heapq.heappush(self._heap, (float(due), next(self._seq), func, args))
+            self._cond.notify()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=1.):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        # (a scheduled call may stop the scheduler)
+        if (self._thread is not None) and (self._thread is not threading.current_thread()):
+            self._thread.join(timeout=timeout)
+
+    def _next_due(self):
+        # wait (sleeping) until the next call is almost due, returns its due time or None if stopped
+        with self._cond:
+            while not self._stopped:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                due = self._heap[0][0]
+                remaining = due - time.perf_counter()
+                if remaining > self.spin_margin:
+                    # (woken early if an earlier call is scheduled)
+                    self._cond.wait(remaining - self.spin_margin)
+                    continue
+                return due
+            return None
+
+    def _run(self):
+        while True:
+            due = self._next_due()
+            if due is None:
+                return
+
+            while time.perf_counter() < due:
+                # (releases the GIL)
+                time.sleep(0)
+
+            now = time.perf_counter()
+            calls = []
+            with self._cond:
+                while self._heap and (self._heap[0][0] <= now):
+                    calls.append(heapq.heappop(self._heap))
+
+            for due, _, func, args in calls:
+                self._lateness.append(time.perf_counter() - due)
+                try:
+                    func(*args)
+                except Exception:
+                    self.log.exception('error calling scheduled %r' % func)
+
+    def stats(self):
+        """
+        :return: A dict of the number of calls (of the recent history) and their lateness (seconds) mean, p99
+        and max.
+        """
+        lateness = np.array(self._lateness)
+        if not len(lateness):
+            return {'n': 0}
+        return {'n': len(lateness),
+                'lateness_mean': float(lateness.mean()),
+                'lateness_p99': float(np.percentile(lateness, 99)),
+                'lateness_max': float(lateness.max())}
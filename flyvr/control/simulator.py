@@ -0,0 +1,289 @@
+import copy
+import heapq
+import os.path
+import itertools
+import contextlib
+import concurrent.futures
+
+import h5py
+import yaml
+import numpy as np
+from numpy.lib.recfunctions import unstructured_to_structured
+
+from flyvr.control.experiment import Experiment
+from flyvr.fictrac.shmem_transfer_data import SHMEMFicTracState, FICTRAC_STATE_DTYPE
+
+
+class VirtualClock(object):
+    """
+    The clock of a simulated experiment, which only moves when advanced. It quacks like EventScheduler, so an
+    experiment schedules its timed events on it, and they are called as the clock is advanced past their due time.
+    """
+
+    def __init__(self, t0=0.):
+        self._t = float(t0)
+        self._heap = []
+        self._seq = itertools.count()
+        self._n = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def time(self):
+        return self._t
+
+    def time_ns(self):
+        return int(self._t * 1e9)
+
+    def schedule(self, due, func, *args):
+        heapq.heappush(self._heap, (float(due), next(self._seq), func, args))
+
+    def start(self):
+        return self
+
+    def stop(self, timeout=None):
+        pass
+
+    def stats(self):
+        # (always on time)
+        return {'n': self._n, 'lateness_mean': 0., 'lateness_p99': 0., 'lateness_max': 0.}
+
+    def advance(self, t):
+        """ move the clock to t, calling everything due by then (at its due time) """
+        while self._heap and (self._heap[0][0] <= t):
+            due, _, func, args = heapq.heappop(self._heap)
+            self._t = max(self._t, due)
+            self._n += 1
+            func(*args)
+        self._t = max(self._t, float(t))
+
+
+class PlaylistTimeline(object):
+    """ quacks like PlaylistSender, but records everything sent (with the time and frame) rather than sending it """
+
+    def __init__(self, clock=None):
+        self.clock = clock
+        self.frame = None
+        self.timeline = []
+
+    def process(self, **data):
+        t = None if self.clock is None else self.clock.time()
+        for what, value in data.items():
+            self.timeline.append({'time': t, 'frame': self.frame, 'what': what, 'value': value})
+
+    def close(self, block=True):
+        pass
+
+
+class _SimulatedSharedState(object):
+    """ quacks like the SharedState of a started experiment, on a VirtualClock """
+
+    def __init__(self, clock):
+        self._clock = clock
+        self._stopped = False
+        self.EXPERIMENT_FICTRAC_FRAME_NUM = 0
+
+    @property
+    def TIME_NS(self):
+        return self._clock.time_ns()
+
+    def is_started(self):
+        return True
+
+    def is_stopped(self):
+        return self._stopped
+
+    def is_running_well(self):
+        return not self._stopped
+
+    def is_backend_ready(self, backend):
+        return True
+
+    def signal_stop(self):
+        self._stopped = True
+
+        class _Signalled(object):
+            def join(self, timeout=None):
+                pass
+
+        return _Signalled()
+
+
+@contextlib.contextmanager
+def _recording_playlist_sender():
+    # experiments constructed in here record, rather than send, to the backends (and do not bind the port)
+    old = Experiment.PLAYLIST_SENDER
+    Experiment.PLAYLIST_SENDER = PlaylistTimeline
+    try:
+        yield
+    finally:
+        Experiment.PLAYLIST_SENDER = old
+
+
+def load_experiment(spec):
+    """
+    :param spec: The path of a .yml or .py experiment, or an experiment definition (a dict with state and/or time
+    keys, as in the yaml).
+    :rtype: Experiment
+    """
+    with _recording_playlist_sender():
+        if isinstance(spec, dict):
+            # (from_items consumes the definition)
+            spec = copy.deepcopy(spec)
+            return Experiment.from_items(spec.get('state', {}), spec.get('time', {}))
+        elif os.path.splitext(spec)[1] == '.py':
+            return Experiment.new_from_python_file(spec)
+        else:
+            with open(spec) as f:
+                return Experiment.from_yaml(f)
+
+
+def iter_fictrac_blocks(h5_path, block_rows=65536):
+    """
+    Read the fictrac output of a session in blocks.
+
+    :return: An iterator of (block, states), where block is a FICTRAC_STATE_DTYPE structured array and states a
+    ctypes array of SHMEMFicTracState over the same memory.
+    """
+    with h5py.File(h5_path, mode='r') as f:
+        try:
+            ds = f['fictrac']['output']
+        except KeyError:
+            raise ValueError('%s does not contain fictrac output' % h5_path)
+
+        for lo in range(0, len(ds), block_rows):
+            block = unstructured_to_structured(np.asarray(ds[lo:lo + block_rows], dtype=np.float64),
+                                               dtype=FICTRAC_STATE_DTYPE)
+            yield block, (SHMEMFicTracState * len(block)).from_buffer(block)
+
+
+def simulate_session(experiment, h5_path, fps=None, block_rows=65536):
+    """
+    Feed the fictrac output of a recorded session through an experiment (as fast as possible, on a virtual clock
+    which follows the recorded frames) and return what it would have sent to the backends.
+
+    :param experiment: An experiment (see load_experiment), or anything load_experiment accepts.
+    :param str h5_path: A flyvr session h5 file.
+    :param float fps: The frame rate, else the clock follows the recorded frame timestamps.
+    :return: The timeline, a list of dicts of the time (seconds since the first frame), frame number, message type
+    (e.g. 'audio_item') and value (e.g. {'identifier': 'sin800hz'}) of everything sent.
+    """
+    if not isinstance(experiment, Experiment):
+        experiment = load_experiment(experiment)
+
+    clock = VirtualClock()
+    timeline = PlaylistTimeline(clock)
+
+    if not isinstance(experiment._ipc, PlaylistTimeline):
+        experiment._ipc.close(block=False)
+    experiment._ipc = timeline
+    experiment._clock = clock
+    shared_state = _SimulatedSharedState(clock)
+    # noinspection PyProtectedMember
+    experiment._set_shared_state(shared_state)
+
+    n = 0
+    t0 = None
+    for block, states in iter_fictrac_blocks(h5_path, block_rows=block_rows):
+        if fps:
+            ts = (np.arange(len(block)) + n) / float(fps)
+        else:
+            ts = block['timestamp']
+            if t0 is None:
+                t0 = ts[0]
+            ts = ts - t0
+        n += len(block)
+
+        for t, fn, state in zip(ts.tolist(), block['frame_cnt'].tolist(), states):
+            timeline.frame = fn
+            clock.advance(t)
+            # (stopped by the experiment)
+            if shared_state.is_stopped():
+                break
+            experiment.process_state(state)
+            shared_state.EXPERIMENT_FICTRAC_FRAME_NUM = fn
+
+        if shared_state.is_stopped():
+            break
+
+    # noinspection PyProtectedMember
+    experiment._stop_scheduler()
+
+    return timeline.timeline
+
+
+def sweep(specs, h5_paths, fps=None, workers=1):
+    """
+    Simulate every experiment over every session, optionally in a process pool.
+
+    :param specs: A list of experiments (anything load_experiment accepts), e.g. from sweep_definitions.
+    :param h5_paths: A list of flyvr session h5 files.
+    :param int workers: The number of worker processes, 1 simulates everything serially in this process.
+    :return: A list of (index of the experiment in specs, h5 path, timeline).
+    """
+    jobs = [(i, spec, p) for i, spec in enumerate(specs) for p in h5_paths]
+
+    if (workers <= 1) or (len(jobs) <= 1):
+        return [(i, p, simulate_session(spec, p, fps=fps)) for i, spec, p in jobs]
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(simulate_session, spec, p, fps=fps) for _, spec, p in jobs]
+        return [(i, p, f.result()) for (i, _, p), f in zip(jobs, futures)]
+
+
+def sweep_definitions(defn, key, values):
+    """
+    :param dict defn: An experiment definition (see load_experiment).
+    :param str key: The dotted path of the value to vary, e.g. 'state.speed.gt.value'.
+    :param values: The values to give it.
+    :return: A copy of defn for every value.
+    """
+    path = key.split('.')
+
+    defns = []
+    for v in values:
+        d = copy.deepcopy(defn)
+        node = d
+        for k in path[:-1]:
+            # (the yaml keys of timed events are numbers)
+            node = node[k] if k in node else node[int(k)]
+        node[path[-1]] = v
+        defns.append(d)
+    return defns
+
+
+def main_simulate():
+    import argparse
+    from flyvr.common.build_arg_parser import setup_logging
+
+    parser = argparse.ArgumentParser(description='Simulate experiments over recorded sessions, printing what they '
+                                                 'would have sent to the backends')
+    parser.add_argument('-e', '--experiment', required=True, help='the experiment (.yml or .py)')
+    parser.add_argument('--sweep', metavar='KEY=V1,V2,...',
+                        help='(.yml experiments) simulate once for every value of KEY, '
+                             'e.g. state.speed.gt.value=0.1,0.2,0.4')
+    parser.add_argument('--fps', type=float, default=0, help='the frame rate (0 = use the recorded timestamps)')
+    parser.add_argument('--workers', type=int, default=1, help='simulate in a pool of this many processes')
+    parser.add_argument('-v', help='Verbose output', default=False, dest='verbose', action='store_true')
+    parser.add_argument('h5files', nargs='+', metavar='PATH', help='paths to h5 files of previous flyvr sessions')
+
+    args = parser.parse_args()
+    setup_logging(args)
+
+    if args.sweep:
+        if os.path.splitext(args.experiment)[1] == '.py':
+            parser.error('--sweep requires a .yml experiment')
+        key, values = args.sweep.split('=', 1)
+        with open(args.experiment) as f:
+            defn = yaml.load(f, Loader=yaml.SafeLoader)
+        values = [yaml.safe_load(v) for v in values.split(',')]
+        specs = sweep_definitions(defn, key, values)
+        names = ['%s=%s' % (key, v) for v in values]
+    else:
+        specs = [args.experiment]
+        names = [args.experiment]
+
+    for i, path, timeline in sweep(specs, args.h5files, fps=args.fps or None, workers=args.workers):
+        print('# %s %s' % (names[i], path))
+        for item in timeline:
+            print('%10.4f %8s  %s: %r' % (item['time'], item['frame'], item['what'], item['value']))
@@ -0,0 +1,208 @@
+import re
+import math
+import operator
+import collections
+
+
+def state_getter(param):
+    """
+    :param str param: The name of a FicTrac state field, optionally indexed (e.g. 'speed' or 'del_rot_cam_vec[1]').
+    :return: A callable which returns that value from a state.
+    """
+    m = re.match(r"""([\w_]+)\[(\d)\]""", param)
+    if m:
+        param, idx, = m.groups()
+        return lambda _s, _idx=operator.itemgetter(int(idx)), _attr=operator.attrgetter(param): _idx(_attr(_s))
+    return operator.attrgetter(param)
+
+
+class _StatisticGetter(object):
+    """ a state getter which returns the current value of a statistic (which is updated elsewhere) """
+
+    def __init__(self, statistic, what):
+        self._statistic = statistic
+        self._what = what
+        self._get = operator.attrgetter(what)
+
+    def __repr__(self):
+        return "<%s of %r>" % (self._what, self._statistic)
+
+    def __call__(self, state):
+        return self._get(self._statistic)
+
+
+class RunningWindow(object):
+    """
+    The mean, variance, min and max of the last n values, each updated in O(1) (amortized, for min and max) per
+    value. The mean and variance are updated incrementally (Welford) and recomputed from the window every n values
+    to bound the accumulated rounding error.
+    """
+
+    def __init__(self, n, name=''):
+        if n < 1:
+            raise ValueError('window must be at least one value')
+        self.n = int(n)
+        self.name = name
+
+        self._values = collections.deque(maxlen=self.n)
+        self._mean = 0.
+        self._m2 = 0.
+        self._since_recompute = 0
+
+        # monotonic (index, value) queues whose fronts are the window min and max
+        self._i = 0
+        self._min = collections.deque()
+        self._max = collections.deque()
+
+    def __repr__(self):
+        return "<RunningWindow(%s, %s)>" % (self.name, self.n)
+
+    def __len__(self):
+        return len(self._values)
+
+    def add(self, x):
+        values = self._values
+        k = len(values)
+
+        if k < self.n:
+            values.append(x)
+            d = x - self._mean
+            self._mean += d / (k + 1)
+            self._m2 += d * (x - self._mean)
+        else:
+            old = values[0]
+            values.append(x)
+            old_mean = self._mean
+            self._mean += (x - old) / k
+            self._m2 += (x - old) * (x - self._mean + old - old_mean)
+
+            self._since_recompute += 1
+            if self._since_recompute >= self.n:
+                self._since_recompute = 0
+                self._mean = math.fsum(values) / k
+                self._m2 = math.fsum((v - self._mean) ** 2 for v in values)
+
+        i = self._i
+        self._i += 1
+        lo = i - self.n
+        while self._min and self._min[-1][1] >= x:
+            self._min.pop()
+        self._min.append((i, x))
+        if self._min[0][0] <= lo:
+            self._min.popleft()
+        while self._max and self._max[-1][1] <= x:
+            self._max.pop()
+        self._max.append((i, x))
+        if self._max[0][0] <= lo:
+            self._max.popleft()
+
+    @property
+    def mean(self):
+        return self._mean
+
+    @property
+    def var(self):
+        """ the (population) variance """
+        k = len(self._values)
+        return max(0., self._m2 / k) if k else 0.
+
+    @property
+    def std(self):
+        return math.sqrt(self.var)
+
+    @property
+    def min(self):
+        return self._min[0][1] if self._min else None
+
+    @property
+    def max(self):
+        return self._max[0][1] if self._max else None
+
+    def getter(self, what='mean'):
+        """
+        :param str what: mean, var, std, min or max.
+        :return: A state getter (for an event) which returns the current value of that statistic.
+        """
+        return _StatisticGetter(self, what)
+
+
+class ExponentialMovingAverage(object):
+    """ value = value + alpha * (x - value), starting from the first value """
+
+    def __init__(self, alpha, name=''):
+        if not (0. < alpha <= 1.):
+            raise ValueError('alpha must be in (0, 1]')
+        self.alpha = float(alpha)
+        self.name = name
+        self.value = None
+
+    def __repr__(self):
+        return "<ExponentialMovingAverage(%s, %s)>" % (self.name, self.alpha)
+
+    def add(self, x):
+        if self.value is None:
+            self.value = x
+        else:
+            self.value += self.alpha * (x - self.value)
+
+    def getter(self, what='value'):
+        return _StatisticGetter(self, what)
+
+
+class StateStatistics(object):
+    """
+    Running statistics of FicTrac state values, shared by all the users (e.g. events) of an experiment. Identical
+    statistics (the same parameter and window, or alpha) are created only once, and each parameter is read from
+    the state only once per update.
+    """
+
+    def __init__(self):
+        self._stats = {}
+        # param -> (getter, [statistics])
+        self._params = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._stats)
+
+    def __iter__(self):
+        return iter(self._stats.values())
+
+    def _get(self, key, param, getter, factory):
+        try:
+            return self._stats[key]
+        except KeyError:
+            pass
+
+        s = self._stats[key] = factory()
+        if param not in self._params:
+            self._params[param] = (getter or state_getter(param), [])
+        self._params[param][1].append(s)
+        return s
+
+    def window(self, param, n, getter=None):
+        """
+        :param str param: The state value (see state_getter), or a name for it if getter is given.
+        :param int n: The window length, in frames (updates).
+        :param getter: Optionally, a callable which returns the value from the state.
+        :rtype: RunningWindow
+        """
+        return self._get((param, 'window', int(n)), param, getter, lambda: RunningWindow(n, name=param))
+
+    def ema(self, param, alpha, getter=None):
+        """
+        :param str param: The state value (see state_getter), or a name for it if getter is given.
+        :param float alpha: The weight of every new value.
+        :param getter: Optionally, a callable which returns the value from the state.
+        :rtype: ExponentialMovingAverage
+        """
+        return self._get((param, 'ema', float(alpha)), param, getter,
+                         lambda: ExponentialMovingAverage(alpha, name=param))
+
+    def update(self, state):
+        """
+        Add the values of this state (frame) to every statistic.
+        """
+        for getter, stats in self._params.values():
+            x = getter(state)
+            for s in stats:
+                s.add(x)
@@ -13,7 +13,9 @@ from flyvr.common.build_arg_parser import setup_logging, setup_experiment
 from flyvr.common.logger import DatasetLogServer
 from flyvr.common.tools import which
 from flyvr.fictrac.shmem_transfer_data import new_mmap_shmem_buffer, new_mmap_signals_buffer, \
-    SHMEMFicTracState, fictrac_state_to_vec, NUM_FICTRAC_FIELDS
+    SHMEMFicTracState, FicTracStateBatch, NUM_FICTRAC_FIELDS
+from flyvr.fictrac.frame_waiter import FrameWaiter
+from flyvr.fictrac.frame_channel import FramePublisher
 
 
 H5_DATA_VERSION = 1
@@ -25,7 +27,9 @@ class FicTracV2Driver(object):
     calls a control function once for each time the tracking state of the insect is updated.
     """
 
-    def __init__(self, config_file, console_ouput_file, pgr_enable=False):
+    SEMAPHORE_OPEN_TIMEOUT = 10.
+
+    def __init__(self, config_file, console_ouput_file, pgr_enable=False, wait_strategy='adaptive'):
         """
         Create the FicTrac driver object. This function will perform a check to see if the FicTrac program is present
         on the path. If it is not, it will throw an exception.
@@ -34,12 +38,15 @@ class FicTracV2Driver(object):
         :param str console_ouput_file: The path to the file where console output should be stored.
         :param bool pgr_enable: Is Point Grey camera support needed. This just decides which executable to call, either
         'FicTrac' or 'FicTrac-PGR'.
+        :param str wait_strategy: How to wait for updates in shared memory, one of FrameWaiter.STRATEGIES (overridden
+        by the fictrac_wait option, if given).
         """
         self._log = logging.getLogger('flyvr.fictrac.FicTracDriver')
 
         self.config_file = config_file
         self.console_output_file = console_ouput_file
         self.pgr_enable = pgr_enable
+        self.wait_strategy = wait_strategy
         self.experiment = None
 
         self.fictrac_bin = 'FicTrac'
@@ -64,28 +71,25 @@ class FicTracV2Driver(object):
     def _open_fictrac_semaphore(self):
         """Open a named semaphore that FicTrac sets up, this lets us synchronize access to the shared memory region"""
 
-        # Keep trying to acquire the semaphore until its available
         semaphore = Semaphore("FicTracStateSHMEM_SEMPH")
 
-        # Keep trying to open the semaphore, quit after a bunch of tries since that means FicTrac probably died or
-        # something.
-        num_semph_tries = 0
-        MAX_TRIES = 100000
-        while num_semph_tries < MAX_TRIES:
+        # Keep trying to open the semaphore (with an increasing delay between tries), give up after a while or if
+        # FicTrac has exited, since that means FicTrac probably died or something.
+        delay = 0.001
+        t_end = time.perf_counter() + self.SEMAPHORE_OPEN_TIMEOUT
+        while True:
             try:
-                num_semph_tries = num_semph_tries + 1
                 semaphore.open()
                 self._log.info("opened fictrac named semaphore")
                 break
             except FileNotFoundError:
-
-                # Lets sleep for a bit every 10000 tries
-                if num_semph_tries % 10000 == 0:
-                    time.sleep(0.1)
-
-                if num_semph_tries >= MAX_TRIES:
+                if (time.perf_counter() > t_end) or (self.fictrac_process.poll() is not None):
                     semaphore = None
                     self._log.error("Couldn't open fictrac named semaphore!")
+                    break
+
+                time.sleep(delay)
+                delay = min(0.1, delay * 2)
 
         return semaphore
 
@@ -106,10 +110,14 @@ class FicTracV2Driver(object):
         if options is not None:
             setup_logging(options)
 
-            setup_experiment(options)
-            if options.experiment:
-                self._log.info('initialized experiment %r' % options.experiment)
-            self.experiment = options.experiment
+            if getattr(options, 'experiment_process', False):
+                # the experiment runs in its own process, following the published frames
+                self.experiment = None
+            else:
+                setup_experiment(options)
+                if options.experiment:
+                    self._log.info('initialized experiment %r' % options.experiment)
+                self.experiment = options.experiment
 
             # fixme: this should be threaded and context manager to close
             log_server = DatasetLogServer()
@@ -128,10 +136,14 @@ class FicTracV2Driver(object):
             flyvr_shared_state.logger.log("/fictrac/output",
                                           H5_DATA_VERSION,
                                           attribute_name='__version')
+            output_batch = FicTracStateBatch(flyvr_shared_state.logger, '/fictrac/output')
         else:
             flyvr_shared_state = None
+            output_batch = None
 
         self.fictrac_signals = new_mmap_signals_buffer()
+        # every frame is published (e.g. to an experiment in another process)
+        publisher = FramePublisher()
 
         # Start FicTrac
         with open(self.console_output_file, "wb") as out:
@@ -149,9 +161,15 @@ class FicTracV2Driver(object):
 
             semaphore = self._open_fictrac_semaphore()
 
+            strategy = getattr(options, 'fictrac_wait', None) or self.wait_strategy
+            waiter = FrameWaiter(strategy)
+            self._log.info("waiting for fictrac updates using %s strategy" % waiter.strategy)
+
             # Process FicTrac updates in shared memory
             while (self.fictrac_process.poll() is None) and running and semaphore:
 
+                waiter.wait()
+
                 # Acquire the semaphore copy the current fictrac state.
                 try:
                     semaphore.acquire(timeout_ms=1000)
@@ -168,6 +186,8 @@ class FicTracV2Driver(object):
                 new_frame_count = data_copy.frame_cnt
 
                 if old_frame_count != new_frame_count:
+                    waiter.frame()
+
                     # If this is our first frame incremented, then send a signal to the
                     # that we have started processing frames
                     if old_frame_count == first_frame_count:
@@ -181,9 +201,11 @@ class FicTracV2Driver(object):
 
                     old_frame_count = new_frame_count
 
+                    publisher.publish(data_copy)
+
                     # Log the FicTrac data to our master log file.
-                    if flyvr_shared_state:
-                        flyvr_shared_state.logger.log('/fictrac/output', fictrac_state_to_vec(data_copy))
+                    if output_batch is not None:
+                        output_batch.append(data_copy)
 
                     if self.experiment is not None:
                         self.experiment.process_state(data_copy)
@@ -192,6 +214,18 @@ class FicTracV2Driver(object):
                 if flyvr_shared_state and flyvr_shared_state.is_stopped():
                     running = False
 
+            if output_batch is not None:
+                output_batch.flush()
+
+            waiter.close()
+            publisher.close()
+            st = waiter.stats()
+            if st['period'] is not None:
+                self._log.info("followed %d fictrac frames (%.1f ms period) using %s strategy: %.1f%% cpu, detection "
+                               "latency (upper bound) mean %.2f ms, 99th percentile %.2f ms, max %.2f ms" % (
+                                   st['frames'], 1e3 * st['period'], st['strategy'], 100. * st['cpu_fraction'],
+                                   1e3 * st['latency_mean'], 1e3 * st['latency_p99'], 1e3 * st['latency_max']))
+
             # Try to close up the semaphore
             try:
                 if semaphore:
@@ -0,0 +1,190 @@
+import os
+import sys
+import time
+import ctypes
+import platform
+
+from flyvr.fictrac.shmem_transfer_data import SHMEMFicTracState, new_named_mmap
+from flyvr.fictrac.frame_waiter import NamedEvent
+
+SHMEM_NAME = 'FlyVRFicTracFrameSHMEM'
+EVENT_NAME = 'FlyVRFicTracFrameSHMEM_EVENT'
+
+# linux futex(2), on the sequence number of the shared frame
+_SYS_FUTEX = {'x86_64': 202, 'aarch64': 98, 'i686': 240, 'i386': 240, 'armv7l': 240}
+_FUTEX_WAIT = 0
+_FUTEX_WAKE = 1
+_INT_MAX = 2 ** 31 - 1
+
+
+class SHMEMFicTracFrame(ctypes.Structure):
+    _fields_ = [
+        # incremented before and after every write (so odd while the state is being written)
+        ('seq', ctypes.c_uint32),
+        ('_pad', ctypes.c_uint32),
+        # when the frame was published, time.perf_counter_ns() (which is the same clock in every process)
+        ('publish_ns', ctypes.c_int64),
+        ('state', SHMEMFicTracState),
+    ]
+
+
+class _timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long),
+                ('tv_nsec', ctypes.c_long)]
+
+
+class _Futex(object):
+
+    def __init__(self, addr):
+        self._addr = addr
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        self._nr = _SYS_FUTEX[platform.machine()]
+
+    @classmethod
+    def new(cls, frame):
+        """ :return: a futex on the sequence number of the frame, or None where futexes are not available """
+        if not sys.platform.startswith('linux'):
+            return None
+        try:
+            return cls(ctypes.addressof(frame) + SHMEMFicTracFrame.seq.offset)
+        except (KeyError, OSError):
+            return None
+
+    def wait(self, expected, timeout):
+        # returns immediately if the word is no longer expected
+        sec, nsec = divmod(int(timeout * 1e9), 1000000000)
+        ts = _timespec(sec, nsec)
+        self._libc.syscall(self._nr, ctypes.c_void_p(self._addr), _FUTEX_WAIT, ctypes.c_uint32(expected),
+                           ctypes.byref(ts), None, 0)
+
+    def wake(self):
+        self._libc.syscall(self._nr, ctypes.c_void_p(self._addr), _FUTEX_WAKE, _INT_MAX, None, None, 0)
+
+
+def _new_shmem_frame():
+    buf = new_named_mmap(ctypes.sizeof(SHMEMFicTracFrame), SHMEM_NAME)
+    # noinspection PyTypeChecker
+    return SHMEMFicTracFrame.from_buffer(buf)
+
+
+class FramePublisher(object):
+    """
+    Publishes every FicTrac frame, as read (and copied) by the FicTrac driver or replay, to followers in other
+    processes (e.g. the experiment). The frame is written into shared memory under a sequence lock, so it is never
+    read half written, and the followers are woken (a futex on linux, a named event on windows) rather than having
+    to poll.
+    """
+
+    def __init__(self):
+        self._frame = _new_shmem_frame()
+        self._state_addr = ctypes.addressof(self._frame.state)
+        self._futex = _Futex.new(self._frame)
+        self._event = NamedEvent.create(EVENT_NAME) if self._futex is None else None
+
+    def publish(self, state):
+        """
+        :param SHMEMFicTracState state: The new frame.
+        """
+        f = self._frame
+        seq = f.seq
+        f.seq = (seq + 1) & 0xffffffff
+        ctypes.memmove(self._state_addr, ctypes.addressof(state), ctypes.sizeof(SHMEMFicTracState))
+        f.publish_ns = time.perf_counter_ns()
+        f.seq = (seq + 2) & 0xffffffff
+
+        if self._futex is not None:
+            self._futex.wake()
+        elif self._event is not None:
+            self._event.set()
+
+    def close(self):
+        if self._event is not None:
+            self._event.close()
+            self._event = None
+
+
+class FrameSubscriber(object):
+    """
+    Follows the frames published by a FramePublisher (in any process). wait() blocks until there is a new frame and
+    returns a consistent copy of it. Frames published while the follower was busy are skipped (only the newest is
+    returned), which is counted.
+    """
+
+    def __init__(self, poll_interval=0.001):
+        """
+        :param float poll_interval: Where neither a futex nor a named event is available (or the named event has not
+        been created yet), how often to check for a new frame, in seconds.
+        """
+        self.poll_interval = float(poll_interval)
+
+        self._frame = _new_shmem_frame()
+        self._futex = _Futex.new(self._frame)
+        self._event = None
+
+        self.state = SHMEMFicTracState()
+        self.publish_ns = None
+        # (start from whatever is published now)
+        self._seq = self._frame.seq & ~1
+        self._frame_cnt = None
+
+        self.frames = 0
+        self.skipped = 0
+
+    def _block(self, seq, timeout):
+        if self._futex is not None:
+            self._futex.wait(seq, timeout)
+            return
+
+        if (self._event is None) and (os.name == 'nt'):
+            self._event = NamedEvent.open(EVENT_NAME)
+        if self._event is not None:
+            self._event.wait(timeout)
+        else:
+            time.sleep(min(timeout, self.poll_interval))
+
+    def _read(self):
+        f = self._frame
+        while True:
+            seq = f.seq
+            if seq & 1:
+                # (being written)
+                time.sleep(0)
+                continue
+            ctypes.pointer(self.state)[0] = f.state
+            publish_ns = f.publish_ns
+            if f.seq == seq:
+                return seq, publish_ns
+
+    def wait(self, timeout=0.1):
+        """
+        :param float timeout: The maximum time to block, in seconds.
+        :return: The number of frames skipped (according to the frame counter) since the last one returned, or None
+        if there was no new frame. The frame is then in state (a SHMEMFicTracState), and when it was published in
+        publish_ns.
+        """
+        t_end = time.perf_counter() + timeout
+        while True:
+            seq = self._frame.seq
+            if (seq != self._seq) and not (seq & 1):
+                break
+            remaining = t_end - time.perf_counter()
+            if remaining <= 0:
+                return None
+            self._block(seq, remaining)
+
+        self._seq, self.publish_ns = self._read()
+
+        fn = self.state.frame_cnt
+        skipped = 0
+        if (self._frame_cnt is not None) and (fn - self._frame_cnt > 1):
+            skipped = fn - self._frame_cnt - 1
+        self._frame_cnt = fn
+
+        self.frames += 1
+        self.skipped += skipped
+        return skipped
+
+    def close(self):
+        if self._event is not None:
+            self._event.close()
+            self._event = None
@@ -0,0 +1,303 @@
+import os
+import time
+import ctypes
+import logging
+import collections
+import multiprocessing
+
+import numpy as np
+
+EVENT_NAME = 'FicTracStateSHMEM_EVENT'
+
+_SYNCHRONIZE = 0x00100000
+_EVENT_MODIFY_STATE = 0x0002
+_WAIT_OBJECT_0 = 0
+
+
+class NamedEvent(object):
+    """
+    A (Windows only) named auto-reset event, which the FicTrac state writer sets after every frame so that a follower
+    can block until the next frame instead of polling the shared memory.
+    """
+
+    def __init__(self, handle):
+        self._handle = handle
+
+    @classmethod
+    def open(cls, name=EVENT_NAME):
+        """
+        :return: The event if the writer has created it, otherwise None.
+        """
+        if os.name != 'nt':
+            return None
+        # noinspection PyUnresolvedReferences
+        h = ctypes.windll.kernel32.OpenEventW(_SYNCHRONIZE | _EVENT_MODIFY_STATE, False, name)
+        return cls(h) if h else None
+
+    @classmethod
+    def create(cls, name=EVENT_NAME):
+        """
+        :return: The (created or already existing) event, or None on platforms without named events.
+        """
+        if os.name != 'nt':
+            return None
+        # noinspection PyUnresolvedReferences
+        h = ctypes.windll.kernel32.CreateEventW(None, False, False, name)
+        return cls(h) if h else None
+
+    def set(self):
+        # noinspection PyUnresolvedReferences
+        ctypes.windll.kernel32.SetEvent(self._handle)
+
+    def wait(self, timeout):
+        """
+        :param float timeout: The maximum time to block, in seconds.
+        :return: True if the event was set, False on timeout.
+        """
+        # noinspection PyUnresolvedReferences
+        return ctypes.windll.kernel32.WaitForSingleObject(self._handle, int(timeout * 1000)) == _WAIT_OBJECT_0
+
+    def close(self):
+        if self._handle:
+            # noinspection PyUnresolvedReferences
+            ctypes.windll.kernel32.CloseHandle(self._handle)
+            self._handle = None
+
+
+class FrameWaiter(object):
+    """
+    Paces a loop which follows the FicTrac state in shared memory, so that it does not burn a whole core polling the
+    frame counter. Call wait() before every poll and frame() whenever the poll found a new frame.
+
+    The strategies are
+      * spin: never wait (poll as fast as possible)
+      * sleep: sleep a fixed poll_interval between polls
+      * adaptive: predict the next frame from the measured inter-frame period, sleep until shortly (spin_margin plus
+        the measured sleep overshoot) before it and then poll without sleeping. Frames later than predicted (or before
+        the period is known) are polled for every poll_interval.
+      * event: block on the named event set by the writer after every frame. Falls back to adaptive if the writer
+        did not create the event (it never exists outside Windows).
+
+    The CPU use (of the calling thread) and, for every frame, an upper bound of the frame detection latency (the time
+    since the previous poll) are measured; see stats().
+    """
+
+    STRATEGIES = ('spin', 'sleep', 'adaptive', 'event')
+
+    def __init__(self, strategy='adaptive', poll_interval=0.001, spin_margin=0.001, period_alpha=0.1,
+                 event_name=EVENT_NAME, history=4096):
+        """
+        :param str strategy: One of STRATEGIES.
+        :param float poll_interval: The sleep between polls (in seconds) for the sleep strategy, and for the adaptive
+        strategy while no frame is expected.
+        :param float spin_margin: How long (in seconds) before the predicted frame the adaptive strategy stops
+        sleeping.
+        :param float period_alpha: The weight of each new inter-frame interval in the running period estimate.
+        :param str event_name: The name of the event for the event strategy.
+        :param int history: The number of latencies kept for the percentile in stats().
+        """
+        if strategy not in FrameWaiter.STRATEGIES:
+            raise ValueError('unknown wait strategy: %r (must be one of %s)' % (strategy,
+                                                                                ', '.join(FrameWaiter.STRATEGIES)))
+
+        self._log = logging.getLogger('flyvr.fictrac.FrameWaiter')
+
+        self.poll_interval = float(poll_interval)
+        self.spin_margin = float(spin_margin)
+        self.period_alpha = float(period_alpha)
+
+        self._event = None
+        if strategy == 'event':
+            self._event = NamedEvent.open(event_name)
+            if self._event is None:
+                self._log.info('named event %s not available, using adaptive waiting' % event_name)
+                strategy = 'adaptive'
+        self.strategy = strategy
+
+        self.period = None
+        self._oversleep = 0.
+        self._t_frame = None
+        self._t_poll = self._t_poll_prev = None
+
+        self._t0 = self._cpu0 = None
+        self._n = 0
+        self._latency_sum = 0.
+        self._latency_max = 0.
+        self._latencies = collections.deque(maxlen=history)
+
+    def _sleep(self, dt):
+        t = time.perf_counter()
+        time.sleep(dt)
+        over = time.perf_counter() - t - dt
+        self._oversleep += self.period_alpha * (max(0., over) - self._oversleep)
+
+    def wait(self):
+        """
+        Wait until the next poll (as decided by the strategy).
+        """
+        now = time.perf_counter()
+        if self._t0 is None:
+            self._t0, self._cpu0 = now, time.thread_time()
+
+        if self.strategy == 'sleep':
+            self._sleep(self.poll_interval)
+        elif self.strategy == 'event':
+            self._event.wait(self.poll_interval if self.period is None else min(0.1, 2 * self.period))
+        elif self.strategy == 'adaptive':
+            if self.period is None:
+                self._sleep(self.poll_interval)
+            else:
+                due = self._t_frame + self.period
+                early = due - (self.spin_margin + self._oversleep) - now
+                if early > 0:
+                    self._sleep(early)
+                elif now > due + self.spin_margin:
+                    # later than predicted, don't spin until it arrives
+                    self._sleep(self.poll_interval)
+
+        self._t_poll_prev = self._t_poll
+        self._t_poll = time.perf_counter()
+
+    def frame(self):
+        """
+        Record that the last poll found a new frame.
+        """
+        now = time.perf_counter()
+
+        if self._t_frame is not None:
+            dt = now - self._t_frame
+            if self.period is None:
+                self.period = dt
+            elif dt < 3 * self.period:
+                # (longer intervals are dropped frames or pauses)
+                self.period += self.period_alpha * (dt - self.period)
+        self._t_frame = now
+
+        if self._t_poll_prev is not None:
+            latency = self._t_poll - self._t_poll_prev
+            self._n += 1
+            self._latency_sum += latency
+            self._latency_max = max(self._latency_max, latency)
+            self._latencies.append(latency)
+
+    def stats(self):
+        """
+        :return: A dict of the strategy, the number of frames, the fraction of one core used by the calling thread
+        while following, the measured frame period and the mean, 99th percentile and max of the frame detection latency
+        bound (all times in seconds).
+        """
+        wall = 0. if self._t0 is None else time.perf_counter() - self._t0
+        cpu = 0. if self._t0 is None else time.thread_time() - self._cpu0
+        return {'strategy': self.strategy,
+                'frames': self._n,
+                'cpu_fraction': cpu / wall if wall > 0 else 0.,
+                'period': self.period,
+                'latency_mean': self._latency_sum / self._n if self._n else None,
+                'latency_p99': float(np.percentile(self._latencies, 99)) if self._n else None,
+                'latency_max': self._latency_max if self._n else None}
+
+    def close(self):
+        if self._event is not None:
+            self._event.close()
+
+
+def _benchmark_writer(state, fps, duration, event_name):
+    event = NamedEvent.create(event_name)
+
+    dt = 1. / fps
+    t0 = time.perf_counter()
+    for i in range(1, int(duration * fps) + 1):
+        # (no spinning, so the writer does not compete with the follower for the cpu)
+        early = t0 + i * dt - time.perf_counter()
+        if early > 0:
+            time.sleep(early)
+
+        state[1] = time.perf_counter()
+        state[0] = i
+        if event is not None:
+            event.set()
+
+    state[0] = -1
+    if event is not None:
+        event.set()
+        event.close()
+
+
+def benchmark_strategies(strategies=FrameWaiter.STRATEGIES, fps=200., duration=5.0, **kwargs):
+    """
+    Measure each wait strategy following a counter written at fps by another process (standing in for FicTrac).
+
+    :param strategies: The strategies to measure.
+    :param float fps: The frame rate of the writer.
+    :param float duration: The duration of each measurement, in seconds.
+    :param kwargs: Passed to FrameWaiter.
+    :return: A list of FrameWaiter.stats() dicts, plus the number of missed frames and the true (measured from the
+    frame write time) detection latency mean, 99th percentile and max.
+    """
+    results = []
+    for strategy in strategies:
+        event_name = '%s_BENCHMARK_%d' % (EVENT_NAME, os.getpid())
+
+        state = multiprocessing.RawArray('d', 2)
+        writer = multiprocessing.Process(target=_benchmark_writer, args=(state, fps, duration, event_name),
+                                         daemon=True)
+        if strategy == 'event':
+            # the writer must create the event first
+            held = NamedEvent.create(event_name)
+        else:
+            held = None
+        writer.start()
+
+        waiter = FrameWaiter(strategy, event_name=event_name, **kwargs)
+        latencies = []
+        missed = 0
+        old = 0
+        while True:
+            waiter.wait()
+            new = int(state[0])
+            if new == old:
+                continue
+            if new < 0:
+                break
+            t_written = state[1]
+            t = time.perf_counter()
+            waiter.frame()
+
+            missed += new - old - 1
+            latencies.append(t - t_written)
+            old = new
+
+        writer.join()
+        waiter.close()
+        if held is not None:
+            held.close()
+
+        s = waiter.stats()
+        s['missed'] = missed
+        s['true_latency_mean'] = float(np.mean(latencies)) if latencies else None
+        s['true_latency_p99'] = float(np.percentile(latencies, 99)) if latencies else None
+        s['true_latency_max'] = float(np.max(latencies)) if latencies else None
+        results.append(s)
+
+    return results
+
+
+def main_benchmark():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Measure the CPU use and frame detection latency of the FicTrac '
+                                                 'shared memory wait strategies')
+    parser.add_argument('--fps', type=float, default=200., help='simulated FicTrac frame rate')
+    parser.add_argument('--duration', type=float, default=5., help='duration of each measurement (seconds)')
+    parser.add_argument('--strategy', action='append', choices=FrameWaiter.STRATEGIES,
+                        help='strategy to measure (may be given multiple times, default all)')
+    args = parser.parse_args()
+
+    print('%-10s %8s %8s %8s %12s %12s %12s' % ('strategy', 'frames', 'missed', 'cpu %',
+                                                 'lat mean ms', 'lat p99 ms', 'lat max ms'))
+    for s in benchmark_strategies(args.strategy or FrameWaiter.STRATEGIES, fps=args.fps, duration=args.duration):
+        print('%-10s %8d %8d %8.1f %12.3f %12.3f %12.3f' % (s['strategy'], s['frames'], s['missed'],
+                                                             100. * s['cpu_fraction'],
+                                                             1e3 * s['true_latency_mean'],
+                                                             1e3 * s['true_latency_p99'],
+                                                             1e3 * s['true_latency_max']))
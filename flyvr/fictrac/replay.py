@@ -1,19 +1,37 @@
-import queue
+import time
+import ctypes
 import os.path
 import logging
 
 import h5py
 import numpy as np
+from numpy.lib.recfunctions import unstructured_to_structured
 
 from flyvr.common import SharedState, BACKEND_FICTRAC
 from flyvr.common.build_arg_parser import setup_logging, setup_experiment
-from flyvr.common.mmtimer import MMTimer
-from flyvr.fictrac.shmem_transfer_data import new_mmap_shmem_buffer, new_mmap_signals_buffer
+from flyvr.common.periodic_timer import PeriodicTimer
+from flyvr.fictrac.shmem_transfer_data import new_mmap_shmem_buffer, new_mmap_signals_buffer, \
+    SHMEMFicTracState, FICTRAC_STATE_DTYPE
+from flyvr.fictrac.frame_waiter import NamedEvent
+from flyvr.fictrac.frame_channel import FramePublisher
+
+_STATE_SIZE = ctypes.sizeof(SHMEMFicTracState)
+# everything after the frame counter
+_PAYLOAD_OFFSET = SHMEMFicTracState.del_rot_cam_vec.offset
 
 
 class ReplayFictrac(object):
 
-    def __init__(self, h5_path):
+    REPLAY_MODES = ('realtime', 'fast', 'lockstep')
+
+    # rows of the fictrac output loaded (and converted) at once
+    BLOCK_ROWS = 65536
+    # seconds to wait for an experiment to process each frame in lockstep mode
+    LOCKSTEP_TIMEOUT = 10.
+
+    def __init__(self, h5_path, flyvr_shared_state=None):
+        self._flyvr_shared_state = flyvr_shared_state
+
         self._f = h5py.File(h5_path, mode='r')
         try:
             self._ds = self._f['fictrac']['output']
@@ -24,13 +42,47 @@ class ReplayFictrac(object):
         self._log = logging.getLogger('flyvr.fictrac.replay')
         self._log.info('loaded %s' % h5_path)
 
+        # if the dataset is stored contiguously and uncompressed, map it rather than reading it through h5py
+        self._rows = self._memmap_dataset(h5_path, self._ds)
+        if self._rows is not None:
+            self._log.debug('memory mapped fictrac output')
+
+        # the currently loaded block of rows, converted to SHMEMFicTracState records
+        self._block = None
+        self._block_lo = self._block_hi = 0
+        self._block_fn = self._block_ts = None
+
         self._fictrac_state = new_mmap_shmem_buffer()
+        self._fictrac_state_addr = ctypes.addressof(self._fictrac_state)
         self._fictrac_signals = new_mmap_signals_buffer()
+        # for followers which wait for updates using the event strategy
+        self._fictrac_event = NamedEvent.create()
+        # and for those which follow the published frames (e.g. an experiment in another process)
+        self._publisher = FramePublisher()
 
         # -1 as a sentinel for derived classes
         self._send_row(-1)
         self._send_row(0)
 
+    @staticmethod
+    def _memmap_dataset(h5_path, ds):
+        if (ds.chunks is not None) or (ds.compression is not None):
+            return None
+        offset = ds.id.get_offset()
+        if offset is None:
+            return None
+        return np.memmap(h5_path, mode='r', dtype=ds.dtype, offset=offset, shape=ds.shape)
+
+    def _load_block(self, idx):
+        lo = idx - (idx % self.BLOCK_ROWS)
+        hi = min(len(self._ds), lo + self.BLOCK_ROWS)
+
+        rows = self._rows[lo:hi] if self._rows is not None else self._ds[lo:hi]
+        self._block = unstructured_to_structured(np.asarray(rows, dtype=np.float64), dtype=FICTRAC_STATE_DTYPE)
+        self._block_lo, self._block_hi = lo, hi
+        self._block_fn = self._block['frame_cnt'].tolist()
+        self._block_ts = self._block['timestamp'].tolist()
+
     def _send_row(self, idx):
         """
         returns: fn, ts
@@ -38,63 +90,93 @@ class ReplayFictrac(object):
         if idx < 0:
             return
 
-        r = self._ds[idx].tolist()  # to python std types (all floats)
-
-        self._fictrac_state.del_rot_cam_vec = tuple(r[1:4])
-        self._fictrac_state.del_rot_error = r[4]
-        self._fictrac_state.del_rot_lab_vec = tuple(r[5:8])
-        self._fictrac_state.abs_ori_cam_vec = tuple(r[8:11])
-        self._fictrac_state.abs_ori_lab_vec = tuple(r[11:13])
-        self._fictrac_state.posx = r[14]
-        self._fictrac_state.posy = r[15]
-        self._fictrac_state.heading = r[16]
-        self._fictrac_state.direction = r[17]
-        self._fictrac_state.speed = r[18]
-        self._fictrac_state.intx = r[19]
-        self._fictrac_state.inty = r[20]
-        self._fictrac_state.timestamp = r[21]
-        self._fictrac_state.seq_num = int(r[22])
-
-        # write the frame counter last as the other processes
-        self._fictrac_state.frame_cnt = int(r[0])
-
-        return r[0], r[21]
-
-    def replay(self, fps='auto'):
-        if fps == 'auto':
-            ts = self._ds[:, 21]
-            dt = abs(np.median(np.diff(ts)))
-        else:
-            dt = 1. / fps
-
-        ms = dt * 1000.
+        if not (self._block_lo <= idx < self._block_hi):
+            self._load_block(idx)
+        i = idx - self._block_lo
 
-        # use a queue as a simple tick-tock threadsafe rate-limiter
-        tick = queue.Queue(maxsize=1)
+        # copy everything except the frame counter in one go, and write the frame counter last as the other
+        # processes use it to detect a new frame
+        src = self._block.ctypes.data + i * _STATE_SIZE
+        ctypes.memmove(self._fictrac_state_addr + _PAYLOAD_OFFSET, src + _PAYLOAD_OFFSET, _STATE_SIZE - _PAYLOAD_OFFSET)
+        self._fictrac_state.frame_cnt = fn = self._block_fn[i]
 
-        self._log.info('replay at %.1fhz (dt=%.2f ms%s)' % (1. / dt, ms,
-                                                            ', auto calculated from file' if fps == 'auto' else ''))
+        if self._fictrac_event is not None:
+            self._fictrac_event.set()
+        self._publisher.publish(self._fictrac_state)
 
-        def _put():
-            try:
-                tick.put(None, block=True, timeout=min(0.5, 10. * dt))
-            except queue.Full:
-                self._log.warning('replay falling behind true framerate (or shutting down)')
-                pass
+        return fn, self._block_ts[i]
 
-        t1 = MMTimer(int(ms), _put)
-        t1.start(True)
-
-        for idx in range(len(self._ds)):
-            ret = self._send_row(idx)
+    def _wait_processed(self, fn):
+        """ wait until an experiment has processed frame fn """
+        t_end = time.perf_counter() + self.LOCKSTEP_TIMEOUT
+        while self._flyvr_shared_state.EXPERIMENT_FICTRAC_FRAME_NUM != fn:
+            if self._flyvr_shared_state.is_stopped():
+                return False
+            if time.perf_counter() > t_end:
+                self._log.error('no experiment processed frame %s within %ss, stopping replay' % (
+                    fn, self.LOCKSTEP_TIMEOUT))
+                return False
+            time.sleep(0)
+        return True
+
+    def replay(self, fps='auto', mode='realtime'):
+        """
+        Replay the fictrac output (blocks until finished).
 
-            try:
-                tick.get(timeout=1.)
-            except queue.Empty:
-                break
+        :param fps: The replay rate in realtime mode, or 'auto' for the rate at which it was recorded.
+        :param str mode: One of REPLAY_MODES. 'realtime' replays at fps, 'fast' as fast as possible (followers may miss
+        frames) and 'lockstep' advances to the next frame only once an experiment has processed the current one (so
+        both run as fast as the experiment can).
+        """
+        if mode not in ReplayFictrac.REPLAY_MODES:
+            raise ValueError('unknown replay mode: %r (must be one of %s)' % (mode,
+                                                                              ', '.join(ReplayFictrac.REPLAY_MODES)))
+        if (mode == 'lockstep') and (self._flyvr_shared_state is None):
+            raise ValueError('lockstep replay requires the flyvr shared state')
+        if mode == 'lockstep':
+            # (the experiment has processed none of these frames, whatever is left from a previous run)
+            self._flyvr_shared_state.EXPERIMENT_FICTRAC_FRAME_NUM = 0
+
+        timer = None
+        if mode == 'realtime':
+            if fps == 'auto':
+                ts = self._ds[:, 21]
+                dt = abs(np.median(np.diff(ts)))
+            else:
+                dt = 1. / fps
+
+            timer = PeriodicTimer(dt)
+
+            self._log.info('replay at %.1fhz (dt=%.2f ms%s, %s timer)' % (
+                1. / dt, dt * 1000., ', auto calculated from file' if fps == 'auto' else '', timer.backend))
+        else:
+            self._log.info('replay in %s mode' % mode)
 
-            if ret is None:
-                break
+        n = missed = 0
+        t0 = time.perf_counter()
+        try:
+            for idx in range(len(self._ds)):
+                ret = self._send_row(idx)
+                if ret is None:
+                    break
+                n += 1
+
+                if mode == 'lockstep':
+                    if not self._wait_processed(ret[0]):
+                        break
+                elif timer is not None:
+                    ticks = timer.wait()
+                    if ticks > 1:
+                        if not missed:
+                            self._log.warning('replay falling behind true framerate')
+                        missed += ticks - 1
+        finally:
+            if timer is not None:
+                timer.close()
+
+        t = time.perf_counter() - t0
+        self._log.info('replayed %d frames in %.1fs (%.0f fps%s)' % (n, t, n / t if t > 0 else 0,
+                                                                      ', %d ticks missed' % missed if missed else ''))
 
 
 class FicTracDriverReplay(object):
@@ -103,9 +185,8 @@ class FicTracDriverReplay(object):
     class StateReplayFictrac(ReplayFictrac):
 
         def __init__(self, flyvr_shared_state, experiment, *args, **kwargs):
-            self._flyvr_shared_state = flyvr_shared_state
             self._experiment = experiment
-            super().__init__(*args, **kwargs)
+            super().__init__(*args, flyvr_shared_state=flyvr_shared_state, **kwargs)
 
         def _send_row(self, idx):
             if idx < 0:
@@ -118,6 +199,8 @@ class FicTracDriverReplay(object):
             if self._experiment is not None:
                 # noinspection PyProtectedMember
                 self._experiment.process_state(self._fictrac_state)
+                if out is not None:
+                    self._flyvr_shared_state.EXPERIMENT_FICTRAC_FRAME_NUM = out[0]
 
             return out
 
@@ -131,8 +214,17 @@ class FicTracDriverReplay(object):
 
         log = logging.getLogger('flyvr.fictrac.FicTracDriverReplay')
 
+        mode = getattr(options, 'fictrac_replay_mode', None) or 'realtime'
+
         setup_experiment(options)
-        if options.experiment:
+        if mode == 'lockstep' and not options.experiment:
+            # (nothing would ever process the frames, so the replay would stall on the first)
+            raise ValueError('lockstep replay requires an experiment, run in process or with --experiment_process')
+
+        if getattr(options, 'experiment_process', False):
+            # the experiment runs in its own process, following the published frames
+            options.experiment = None
+        elif options.experiment:
             log.info('initialized experiment %r' % options.experiment)
 
         flyvr_shared_state = SharedState(options=options,
@@ -145,7 +237,7 @@ class FicTracDriverReplay(object):
         replay = FicTracDriverReplay.StateReplayFictrac(flyvr_shared_state,
                                                         options.experiment,
                                                         self._h5_path)
-        replay.replay()  # blocks
+        replay.replay(mode=mode)  # blocks
 
         log.info('stopped')
 
@@ -157,11 +249,15 @@ def main_replay():
     parser = argparse.ArgumentParser()
     parser.add_argument('--fps', type=float, default=0, help='play back fictrac data at this fps '
                                                              '(0 = rate at which it was recorded)')
+    parser.add_argument('--mode', default='realtime', choices=ReplayFictrac.REPLAY_MODES,
+                        help='realtime (at --fps), fast (as fast as possible) or lockstep (advance only after the '
+                             'experiment, e.g. flyvr-experiment, processed each frame)')
     parser.add_argument('-v', help='Verbose output', default=False, dest='verbose', action='store_true')
     parser.add_argument('h5file', nargs=1, metavar='PATH', help='path to h5 file of previous flyvr session')
 
     args = parser.parse_args()
     setup_logging(args)
 
-    r = ReplayFictrac(args.h5file[0])
-    r.replay('auto' if args.fps <= 0 else args.fps)
+    r = ReplayFictrac(args.h5file[0],
+                      flyvr_shared_state=SharedState(None, None) if args.mode == 'lockstep' else None)
+    r.replay('auto' if args.fps <= 0 else args.fps, mode=args.mode)
@@ -1,7 +1,11 @@
+import os
 import mmap
+import time
 import ctypes
+import tempfile
 
 import numpy as np
+from numpy.lib.recfunctions import structured_to_unstructured
 
 # The number of FicTrac fields in the output file
 NUM_FICTRAC_FIELDS = 23
@@ -31,31 +35,72 @@ class SHMEMFicTracState(ctypes.Structure):
     ]
 
 
+# The fields of SHMEMFicTracState are in the same order as the columns of the output file, so a numpy structured
+# view of the state flattens to an output row
+FICTRAC_STATE_DTYPE = np.dtype(SHMEMFicTracState)
+
+
+def fictrac_state_view(s):
+    """
+    :param s: A SHMEMFicTracState, or a ctypes array of them.
+    :return: A (zero copy) numpy structured array view of the state(s).
+    """
+    return np.frombuffer(s, dtype=FICTRAC_STATE_DTYPE)
+
+
+def fictrac_states_to_array(states):
+    """
+    :param numpy.ndarray states: A structured array of FicTrac states (see fictrac_state_view).
+    :return: The (states x NUM_FICTRAC_FIELDS) float64 rows, as in the output file.
+    """
+    return structured_to_unstructured(states, dtype=np.float64)
+
+
 def fictrac_state_to_vec(s):
-    return np.array([s.frame_cnt,
-                     s.del_rot_cam_vec[0],
-                     s.del_rot_cam_vec[1],
-                     s.del_rot_cam_vec[2],
-                     s.del_rot_error,
-                     s.del_rot_lab_vec[0],
-                     s.del_rot_lab_vec[1],
-                     s.del_rot_lab_vec[2],
-                     s.abs_ori_cam_vec[0],
-                     s.abs_ori_cam_vec[1],
-                     s.abs_ori_cam_vec[2],
-                     s.abs_ori_lab_vec[0],
-                     s.abs_ori_lab_vec[1],
-                     s.abs_ori_lab_vec[2],
-                     s.posx,
-                     s.posy,
-                     s.heading,
-                     s.direction,
-                     s.speed,
-                     s.intx,
-                     s.inty,
-                     s.timestamp,
-                     s.seq_num
-                     ])
+    return fictrac_states_to_array(fictrac_state_view(s))[0]
+
+
+class FicTracStateBatch(object):
+    """
+    Accumulates FicTrac states (each with a single struct copy into a preallocated block) and logs them as rows of
+    the output dataset in batches of at most max_frames frames, or whatever arrived within max_ms milliseconds of the
+    first frame in the batch.
+    """
+
+    def __init__(self, logger, dataset_name='/fictrac/output', max_frames=64, max_ms=100.):
+        """
+        :param logger: The DatasetLogger to log to.
+        :param str dataset_name: The (NUM_FICTRAC_FIELDS column) dataset to append the rows to.
+        :param int max_frames: The maximum number of frames in a batch.
+        :param float max_ms: The maximum time, in milliseconds, a frame waits to be logged (if more frames follow).
+        """
+        self._logger = logger
+        self._dataset_name = dataset_name
+        self._max_s = max_ms / 1000.
+
+        self._block = (SHMEMFicTracState * int(max_frames))()
+        self._states = fictrac_state_view(self._block)
+        self._n = 0
+        self._t_first = 0.
+
+    def append(self, s):
+        """
+        :param SHMEMFicTracState s: The state to log.
+        """
+        self._block[self._n] = s
+        self._n += 1
+
+        now = time.perf_counter()
+        if self._n == 1:
+            self._t_first = now
+
+        if (self._n == len(self._block)) or ((now - self._t_first) >= self._max_s):
+            self.flush()
+
+    def flush(self):
+        if self._n:
+            self._logger.log(self._dataset_name, fictrac_states_to_array(self._states[:self._n]))
+            self._n = 0
 
 
 class SHMEMFicTracSignals(ctypes.Structure):
@@ -82,13 +127,36 @@ def print_fictrac_state(data):
     print(state_string)
 
 
+def new_named_mmap(size, tagname):
+    """
+    Open the named shared memory block (creating it, zero filled, if necessary). On Windows this is a named file
+    mapping, elsewhere a file of the same name in /dev/shm (or the temporary directory), which unlike on Windows
+    persists after all processes using it have exited.
+
+    :param int size: The size of the block in bytes.
+    :param str tagname: The name of the block.
+    :rtype: mmap.mmap
+    """
+    if os.name == 'nt':
+        return mmap.mmap(-1, size, tagname)
+
+    d = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    fd = os.open(os.path.join(d, tagname), os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        if os.fstat(fd).st_size < size:
+            os.ftruncate(fd, size)
+        return mmap.mmap(fd, size)
+    finally:
+        os.close(fd)
+
+
 def new_mmap_shmem_buffer():
-    buf = mmap.mmap(-1, ctypes.sizeof(SHMEMFicTracState), "FicTracStateSHMEM")
+    buf = new_named_mmap(ctypes.sizeof(SHMEMFicTracState), "FicTracStateSHMEM")
     # noinspection PyTypeChecker
     return SHMEMFicTracState.from_buffer(buf)
 
 
 def new_mmap_signals_buffer():
-    buf = mmap.mmap(-1, ctypes.sizeof(ctypes.c_int32), "FicTracStateSHMEM_SIGNALS")
+    buf = new_named_mmap(ctypes.sizeof(ctypes.c_int32), "FicTracStateSHMEM_SIGNALS")
     # noinspection PyTypeChecker
     return SHMEMFicTracSignals.from_buffer(buf)
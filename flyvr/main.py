@@ -13,7 +13,7 @@ from flyvr.audio.io_task import run_io
 from flyvr.common import SharedState, BACKEND_FICTRAC, BACKEND_DAQ, BACKEND_AUDIO, BACKEND_VIDEO,\
     BACKEND_HWIO, BACKEND_CAMERA
 from flyvr.common.inputimeout import inputimeout, TimeoutOccurred
-from flyvr.control.experiment import Experiment
+from flyvr.control.experiment import Experiment, run_experiment
 from flyvr.common.concurrent_task import ConcurrentTask
 from flyvr.fictrac.fictrac_driver import FicTracV1Driver, FicTracV2Driver
 from flyvr.fictrac.replay import FicTracDriverReplay
@@ -44,10 +44,10 @@ def _get_fictrac_driver(options, log):
 
             if options.fictrac_version == 1:
                 drv = FicTracV1Driver(options.fictrac_config, options.fictrac_console_out,
-                                      pgr_enable=not options.pgr_cam_disable)
+                                      pgr_enable=not options.pgr_cam_disable, wait_strategy=options.fictrac_wait)
             elif options.fictrac_version == 2:
                 drv = FicTracV2Driver(options.fictrac_config, options.fictrac_console_out,
-                                      pgr_enable=not options.pgr_cam_disable)
+                                      pgr_enable=not options.pgr_cam_disable, wait_strategy=options.fictrac_wait)
             else:
                 log.fatal('unknown fictrac version')
                 drv = None
@@ -89,6 +89,8 @@ def main_launcher():
     log = logging.getLogger('flyvr.main')
 
     flyvr_shared_state = SharedState(options=options, logger=None, where='main')
+    # (clear anything left from a previous run, before any backend starts)
+    flyvr_shared_state.reset()
 
     # start the IPC bus first as it is needed by many subsystems
     ipc_bus = ConcurrentTask(task=run_main_relay, comms=None, taskinitargs=[])
@@ -100,6 +102,13 @@ def main_launcher():
 
     backend_wait = [BACKEND_FICTRAC]
 
+    # the experiment, in its own process, is started first so that it sees every fictrac frame
+    if options.experiment_process:
+        experiment = ConcurrentTask(task=run_experiment, comms=None, taskinitargs=[options])
+        experiment.start()
+    else:
+        experiment = None
+
     trac_drv = _get_fictrac_driver(options, log)
     if trac_drv is not None:
         fictrac_task = ConcurrentTask(task=trac_drv.run, comms=None, taskinitargs=[options])
@@ -172,7 +181,7 @@ def main_launcher():
 
     log.info('stopped')
 
-    for task in (ipc_bus, gui, hwio, daq, video, audio):
+    for task in (ipc_bus, gui, hwio, daq, video, audio, experiment):
         if task is not None:
             log.debug('closing subprocess: %r' % task)
             task.close()
@@ -0,0 +1,113 @@
+import logging
+import collections
+
+import numpy as np
+
+
+class FrameTimingLog(object):
+    """
+    Records, for every video frame, when it was flipped (seconds, time.perf_counter()), how long its update and draw
+    took (seconds), the interval since the previous flip (seconds) and the number of refreshes it missed (the
+    interval in refresh intervals, rounded, minus one). A missed refresh means the previous frame was shown for
+    longer than it should have been, stretching the stimulus.
+
+    Frames are logged (in batches) to the h5 logger, and the missed refreshes are counted per stimulus and
+    summarized in the log every summary_interval seconds in which any were missed.
+    """
+
+    DATASET = '/video/frame_timing'
+    FIELDS = ('video_output_num_frames', 'flip_time', 'update_draw_duration', 'flip_interval', 'missed_refreshes')
+
+    def __init__(self, logger, refresh_interval, batch_size=100, summary_interval=10.):
+        """
+        :param float refresh_interval: The expected refresh interval of the display (seconds).
+        """
+        self._log = logging.getLogger('flyvr.video.FrameTimingLog')
+
+        self._logger = logger
+        self.refresh_interval = float(refresh_interval)
+        self.summary_interval = float(summary_interval)
+
+        self._batch = np.empty((batch_size, len(self.FIELDS)))
+        self._n_batch = 0
+
+        self._last_flip = None
+        self._last_summary = None
+
+        self.frames = 0
+        self.missed = 0
+        # stimulus identifier: [frames, missed refreshes], in total and since the last summary
+        self._per_stim = collections.defaultdict(lambda: [0, 0])
+        self._recent = collections.defaultdict(lambda: [0, 0])
+
+        if logger is not None:
+            n = len(self.FIELDS)
+            logger.create(self.DATASET, shape=[2048, n], maxshape=[None, n], dtype=np.float64, chunks=(2048, n))
+            for cn, cname in enumerate(self.FIELDS):
+                logger.log(self.DATASET, str(cname), attribute_name='column_%d' % cn)
+            logger.log(self.DATASET, self.refresh_interval, attribute_name='refresh_interval')
+
+    def record(self, frame_num, flip_time, update_draw_duration, identifier=None):
+        """
+        :param int frame_num: The frame number (of the video backend).
+        :param float flip_time: When the frame was flipped (seconds, time.perf_counter()).
+        :param float update_draw_duration: How long the frame took to update and draw (seconds).
+        :param identifier: The stimulus shown in the frame.
+        :return: The number of refreshes missed before this frame.
+        """
+        if self._last_flip is None:
+            interval = np.nan
+            missed = 0
+            self._last_summary = flip_time
+        else:
+            interval = flip_time - self._last_flip
+            missed = max(0, int(interval / self.refresh_interval + 0.5) - 1)
+        self._last_flip = flip_time
+
+        self.frames += 1
+        self.missed += missed
+        for counts in (self._per_stim[identifier], self._recent[identifier]):
+            counts[0] += 1
+            counts[1] += missed
+
+        if self._logger is not None:
+            self._batch[self._n_batch] = (frame_num, flip_time, update_draw_duration, interval, missed)
+            self._n_batch += 1
+            if self._n_batch == len(self._batch):
+                self.flush()
+
+        if (flip_time - self._last_summary) >= self.summary_interval:
+            self._summarize(flip_time)
+
+        return missed
+
+    @staticmethod
+    def _describe(per_stim):
+        return ', '.join('%s: %d/%d' % (k, v[1], v[0]) for k, v in sorted(per_stim.items(), key=lambda kv: str(kv[0]))
+                         if v[1])
+
+    def _summarize(self, now):
+        recent = sum(v[1] for v in self._recent.values())
+        if recent:
+            self._log.warning('missed %d refreshes in the last %.0fs (missed/frames per stimulus: %s)' % (
+                recent, now - self._last_summary, self._describe(self._recent)))
+        self._recent.clear()
+        self._last_summary = now
+
+    def flush(self):
+        if self._n_batch:
+            self._logger.log(self.DATASET, self._batch[:self._n_batch].copy())
+            self._n_batch = 0
+
+    def stats(self):
+        """ :return: the number of frames and missed refreshes, in total and per stimulus identifier """
+        return {'frames': self.frames,
+                'missed': self.missed,
+                'per_stimulus': {k: {'frames': v[0], 'missed': v[1]} for k, v in self._per_stim.items()}}
+
+    def close(self):
+        if self._logger is not None:
+            self.flush()
+        self._log.info('%d video frames, missed %d refreshes%s' % (
+            self.frames, self.missed, (' (missed/frames per stimulus: %s)' % self._describe(self._per_stim))
+            if self.missed else ''))
@@ -0,0 +1,237 @@
+import os
+import queue
+import ctypes
+import logging
+import threading
+
+import numpy as np
+
+# a path with one of these extensions is written as a single video file (through ffmpeg), anything else is a
+# directory of one jpeg per frame
+VIDEO_EXTENSIONS = ('.mp4', '.mkv', '.avi', '.mov')
+
+POLICY_DROP, POLICY_BLOCK = 'drop', 'block'
+
+
+class FrameWriter(object):
+    """
+    Writes frames (numpy HxWx3 uint8 rgb arrays) in the background, so the render loop only pays for handing them
+    over. Frames go through a bounded queue, and when it is full (the disk or encoder can not keep up) they are
+    either dropped (and counted) or the caller blocks until there is room, according to the policy.
+
+    Frames are either encoded into one video file by an ffmpeg pipe (one worker, to keep them in order) or saved as
+    a jpeg each (by several workers).
+    """
+
+    def __init__(self, path, size, fps=60., policy=POLICY_DROP, maxsize=16, workers=2):
+        """
+        :param str path: A video file (see VIDEO_EXTENSIONS) or a directory for the jpegs.
+        :param size: The frame (width, height).
+        :param float fps: The frame rate of the video file.
+        :param str policy: POLICY_DROP or POLICY_BLOCK.
+        :param int maxsize: The number of frames which may be waiting to be written.
+        :param int workers: The number of jpeg writing threads.
+        """
+        if policy not in (POLICY_DROP, POLICY_BLOCK):
+            raise ValueError('unknown frame writer policy: %r' % policy)
+
+        self._log = logging.getLogger('flyvr.video.FrameWriter')
+
+        self.path = path
+        self.size = tuple(int(s) for s in size)
+        self.policy = policy
+
+        self.written = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+        self._q = queue.Queue(maxsize=maxsize)
+
+        if os.path.splitext(path)[1].lower() in VIDEO_EXTENSIONS:
+            from imageio_ffmpeg import write_frames
+
+            self._video = write_frames(path, self.size, fps=fps, macro_block_size=1)
+            self._video.send(None)
+            workers = 1
+        else:
+            os.makedirs(path, exist_ok=True)
+            self._video = None
+
+        self._threads = [threading.Thread(target=self._work, daemon=True, name='FrameWriter%d' % i)
+                         for i in range(max(1, workers))]
+        for t in self._threads:
+            t.start()
+
+        self._log.info('writing frames to %s (%s when %d frames behind)' % (path, policy, maxsize))
+
+    def put(self, frame, name):
+        """
+        :param frame: The frame, which must not be modified afterwards.
+        :param str name: The name of its jpeg (without extension), if writing jpegs.
+        :return: True if the frame will be written, False if it was dropped.
+        """
+        if self.policy == POLICY_BLOCK:
+            self._q.put((frame, name))
+            return True
+
+        try:
+            self._q.put_nowait((frame, name))
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+
+    def _write(self, frame, name):
+        if self._video is not None:
+            self._video.send(np.ascontiguousarray(frame))
+        else:
+            from PIL import Image
+            Image.fromarray(frame).save(os.path.join(self.path, '%s.jpg' % name))
+
+    def _work(self):
+        while True:
+            item = self._q.get()
+            if item is None:
+                break
+            # noinspection PyBroadException
+            try:
+                self._write(*item)
+                with self._lock:
+                    self.written += 1
+            except Exception:
+                self._log.error('could not write frame %s' % item[1], exc_info=True)
+
+    def close(self):
+        """ write all queued frames and stop """
+        for _ in self._threads:
+            self._q.put(None)
+        for t in self._threads:
+            t.join()
+
+        if self._video is not None:
+            self._video.close()
+            self._video = None
+
+        self._log.info('wrote %d frames (dropped %d) to %s' % (self.written, self.dropped, self.path))
+
+
+class _SyncReadback(object):
+    """ reads the frame back (glReadPixels into client memory) immediately, blocking until it has been rendered """
+
+    def __init__(self, width, height):
+        self.width, self.height = int(width), int(height)
+
+    def read(self, tag):
+        from pyglet import gl
+
+        buf = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        gl.glPixelStorei(gl.GL_PACK_ALIGNMENT, 1)
+        gl.glReadPixels(0, 0, self.width, self.height, gl.GL_RGB, gl.GL_UNSIGNED_BYTE,
+                        buf.ctypes.data_as(ctypes.c_void_p))
+        # (opengl rows are bottom up)
+        return [(tag, buf[::-1])]
+
+    def flush(self):
+        return []
+
+    def close(self):
+        pass
+
+
+class PBOReadback(object):
+    """
+    Reads frames back asynchronously through a ring of pixel buffer objects: glReadPixels into a PBO returns
+    immediately (the copy happens on the GPU once the frame is rendered), and the PBO is mapped n frames later, by
+    when the copy has long finished, so the render loop never stalls waiting for the GPU.
+    """
+
+    def __init__(self, width, height, n=2):
+        from pyglet import gl
+
+        self.width, self.height = int(width), int(height)
+        self._n = int(n)
+        self._nbytes = self.width * self.height * 3
+
+        self._ids = (gl.GLuint * self._n)()
+        gl.glGenBuffers(self._n, self._ids)
+        for i in range(self._n):
+            gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, self._ids[i])
+            gl.glBufferData(gl.GL_PIXEL_PACK_BUFFER, self._nbytes, None, gl.GL_STREAM_READ)
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, 0)
+
+        self._tags = [None] * self._n
+        self._i = 0
+
+    @staticmethod
+    def new(width, height):
+        """ :return: a PBOReadback if pixel buffer objects are supported (opengl 2.1), else a synchronous one """
+        # noinspection PyBroadException
+        try:
+            from pyglet.gl import gl_info
+            if gl_info.have_version(2, 1):
+                return PBOReadback(width, height)
+        except Exception:
+            logging.getLogger('flyvr.video.PBOReadback').warning('pixel buffer objects not available',
+                                                                  exc_info=True)
+        return _SyncReadback(width, height)
+
+    def _map(self, i):
+        from pyglet import gl
+
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, self._ids[i])
+        ptr = gl.glMapBuffer(gl.GL_PIXEL_PACK_BUFFER, gl.GL_READ_ONLY)
+        out = None
+        if ptr:
+            buf = np.empty((self.height, self.width, 3), dtype=np.uint8)
+            ctypes.memmove(buf.ctypes.data, ptr, self._nbytes)
+            out = (self._tags[i], buf[::-1])
+        gl.glUnmapBuffer(gl.GL_PIXEL_PACK_BUFFER)
+        self._tags[i] = None
+        return out
+
+    def read(self, tag):
+        """
+        Start reading back the current frame.
+
+        :param tag: Identifies the frame (returned with it).
+        :return: A list of (tag, frame) of the frames (from earlier calls) which have been read back.
+        """
+        from pyglet import gl
+
+        i = self._i
+        self._i = (i + 1) % self._n
+
+        done = []
+        if self._tags[i] is not None:
+            frame = self._map(i)
+            if frame is not None:
+                done.append(frame)
+
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, self._ids[i])
+        gl.glPixelStorei(gl.GL_PACK_ALIGNMENT, 1)
+        # (into the bound buffer, at offset 0)
+        gl.glReadPixels(0, 0, self.width, self.height, gl.GL_RGB, gl.GL_UNSIGNED_BYTE, None)
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, 0)
+        self._tags[i] = tag
+
+        return done
+
+    def flush(self):
+        """ :return: a list of (tag, frame) of the frames still being read back, oldest first """
+        from pyglet import gl
+
+        done = []
+        for j in range(self._n):
+            i = (self._i + j) % self._n
+            if self._tags[i] is not None:
+                frame = self._map(i)
+                if frame is not None:
+                    done.append(frame)
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, 0)
+        return done
+
+    def close(self):
+        from pyglet import gl
+
+        gl.glDeleteBuffers(self._n, self._ids)
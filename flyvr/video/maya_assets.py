@@ -0,0 +1,155 @@
+import os
+import logging
+import weakref
+import functools
+
+import numpy as np
+import pkg_resources
+
+# the rendered model fly, one image per degree of its heading (from -179 to 180)
+IMAGE_ANGLES = tuple(range(-179, 181))
+
+# bump when the format of the preprocessed image stack changes
+_STACK_VERSION = 1
+
+log = logging.getLogger('flyvr.video.maya_assets')
+
+
+def _data_filename(filename_relative_to_datadir):
+    return pkg_resources.resource_filename('flyvr', os.path.join('data', 'mayamodel', filename_relative_to_datadir))
+
+
+def _cache_dir():
+    d = os.path.join(os.path.expanduser('~'), '.cache', 'flyvr')
+    os.makedirs(d, exist_ok=True)
+    return d
+
+
+def build_image_stack(path):
+    """
+    Preprocess the model fly images into a single (number of angles, height, width) uint8 (luminance) array, saved
+    as a .npy file so it can be memory mapped.
+
+    :param str path: The .npy file to write.
+    """
+    from PIL import Image
+
+    names = [_data_filename('femalefly360deg/fly%d.png' % a) for a in IMAGE_ANGLES]
+    first = np.asarray(Image.open(names[0]).convert('L'))
+
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    stack = np.lib.format.open_memmap(tmp, mode='w+', dtype=np.uint8, shape=(len(names), ) + first.shape)
+    stack[0] = first
+    for i, name in enumerate(names[1:], 1):
+        stack[i] = np.asarray(Image.open(name).convert('L'))
+    stack.flush()
+    del stack
+    os.replace(tmp, path)
+
+
+@functools.lru_cache(maxsize=None)
+def image_stack():
+    """
+    :return: The model fly images (see build_image_stack), memory mapped read-only, so they are only read from disk
+    as they are used and are shared by every stimulus (and process). The first call after installation builds them
+    from the pngs.
+    """
+    path = os.path.join(_cache_dir(), 'mayamodel_femalefly360deg_v%d.npy' % _STACK_VERSION)
+    if not os.path.isfile(path):
+        log.info('building %s' % path)
+        build_image_stack(path)
+    return np.load(path, mmap_mode='r')
+
+
+def _readonly(*arrays):
+    for a in arrays:
+        a.setflags(write=False)
+    return arrays
+
+
+def _trajectory(subdir, suffix):
+    angles = np.load(_data_filename(os.path.join(subdir, 'angles_%s.npy' % suffix)))
+    top_y, bottom_y, left_x, right_x = (np.load(_data_filename(os.path.join(subdir, '%s_%s.npy' % (n, suffix))))
+                                        for n in ('tops', 'bottoms', 'lefts', 'rights'))
+    pos = np.stack(((left_x + right_x) / 2, (top_y + bottom_y) / 2))
+    size = np.stack((right_x - left_x, top_y - bottom_y))
+    return angles, pos, size
+
+
+@functools.lru_cache(maxsize=None)
+def maya_trajectory():
+    """
+    :return: The (read-only) angles (image index), positions (2, n) and sizes (2, n) of the model fly, every frame.
+    """
+    return _readonly(*_trajectory('', 'fly19'))
+
+
+@functools.lru_cache(maxsize=None)
+def opt_trajectory(block=300, num_blocks=11):
+    """
+    :return: As maya_trajectory, alternating every block frames between the forward velocity and the pulse song
+    trajectories.
+    """
+    velocity = _trajectory('forwardvelocity', 'optstim')
+    pulse = _trajectory('pulse', 'optstim')
+
+    n = block * num_blocks
+    out = []
+    for v, p in zip(velocity, pulse):
+        # (..., block number, velocity or pulse, frame in block)
+        lead = v.shape[:-1]
+        both = np.stack((v[..., :n].reshape(lead + (num_blocks, block)),
+                         p[..., :n].reshape(lead + (num_blocks, block))), axis=-2)
+        out.append(both.reshape(lead + (2 * n, )))
+    return _readonly(*out)
+
+
+class _WindowImages(object):
+    """
+    the model fly images as ImageStims, created (and their textures uploaded) by preload, before the stimulus is
+    drawn, so that doing so never delays a frame
+    """
+
+    def __init__(self, win):
+        self._win = win
+        self._stims = {}
+
+    def _new(self, i):
+        from PIL import Image
+        from psychopy import visual
+
+        return visual.ImageStim(win=self._win, image=Image.fromarray(image_stack()[i]))
+
+    def preload(self, indices):
+        """
+        :param indices: The image indices to create, e.g. every angle of a trajectory. Those already created (by
+        another stimulus drawing into the window) are reused.
+        """
+        for i in indices:
+            i = int(i)
+            if i not in self._stims:
+                self._stims[i] = self._new(i)
+
+    def __getitem__(self, i):
+        i = int(i)
+        try:
+            return self._stims[i]
+        except KeyError:
+            log.warning('model fly image %d was not preloaded' % i)
+            stim = self._stims[i] = self._new(i)
+            return stim
+
+
+_WINDOW_IMAGES = weakref.WeakKeyDictionary()
+
+
+def window_images(win):
+    """
+    :return: The model fly images of the window, indexable by image index (see maya_trajectory), shared by every
+    stimulus drawing into it.
+    """
+    try:
+        return _WINDOW_IMAGES[win]
+    except KeyError:
+        images = _WINDOW_IMAGES[win] = _WindowImages(win)
+        return images
@@ -1,3 +1,4 @@
+import time
 import uuid
 import queue
 import os.path
@@ -6,14 +7,19 @@ import threading
 import collections
 import pkg_resources
 
+from typing import Optional
+
 import h5py
 import numpy as np
 
-from flyvr.common import Randomizer, BACKEND_VIDEO
+from flyvr.common import Randomizer, ScheduledPlay, BACKEND_VIDEO
 from flyvr.common.dottable import Dottable
 from flyvr.common.build_arg_parser import setup_logging
 from flyvr.projector.dlplc_tcp import LightCrafterTCP
 from flyvr.common.ipc import PlaylistReciever
+from flyvr.video.frame_writer import FrameWriter, PBOReadback, POLICY_DROP
+from flyvr.video.maya_assets import maya_trajectory, opt_trajectory, window_images
+from flyvr.video.frame_timing import FrameTimingLog
 
 from PIL import Image
 from psychopy import visual, core, event
@@ -784,25 +790,19 @@ class MayaModel(VideoStim):
                          offset=[float(offset[0]), float(offset[1])], **kwargs)
 
         self._imgs = self.screen = None
-        self._image_names = [package_data_filename('mayamodel/femalefly360deg/fly' + str(img_num) + '.png')
-                             for img_num in range(-179, 181)]
-
-        angles = np.load(package_data_filename('mayamodel/angles_fly19.npy'))
-        top_y = np.load(package_data_filename('mayamodel/tops_fly19.npy'))
-        bottom_y = np.load(package_data_filename('mayamodel/bottoms_fly19.npy'))
-        left_x = np.load(package_data_filename('mayamodel/lefts_fly19.npy'))
-        right_x = np.load(package_data_filename('mayamodel/rights_fly19.npy'))
 
+        # (shared by every instance)
+        angles, pos, size = maya_trajectory()
         self._angles = angles[frame_start:]
-        self._img_pos = [(left_x[frame_start:] + right_x[frame_start:]) / 2,
-                         (top_y[frame_start:] + bottom_y[frame_start:]) / 2]
-        self._img_size = [right_x[frame_start:] - left_x[frame_start:],
-                          top_y[frame_start:] - bottom_y[frame_start:]]
+        self._img_pos = pos[:, frame_start:]
+        self._img_size = size[:, frame_start:]
 
     def initialize(self, win, fps, flyvr_shared_state):
         super().initialize(win, fps, flyvr_shared_state)
-        self._imgs = [visual.ImageStim(win=win, image=Image.open(i).convert('L')) for i in self._image_names]
-        self.screen = self._imgs[0]
+        self._imgs = window_images(win)
+        # (upload every image the trajectory uses now, rather than while drawing)
+        self._imgs.preload(np.unique(self._angles))
+        self.screen = self._imgs[self._angles[0]]
 
     def update(self, win, logger, frame_num):
         # noinspection DuplicatedCode
@@ -845,54 +845,15 @@ class OptModel(VideoStim):
 
         self._imgs = self.screen = None
 
-        self._image_names = [package_data_filename('mayamodel/femalefly360deg/fly' + str(i) + '.png')
-                             for i in range(-179, 181)]
-
-        angles_v = np.load(package_data_filename('mayamodel/forwardvelocity/angles_optstim.npy'))
-
-        ty_v = np.load(package_data_filename('mayamodel/forwardvelocity/tops_optstim.npy'))
-        by_v = np.load(package_data_filename('mayamodel/forwardvelocity/bottoms_optstim.npy'))
-        lx_v = np.load(package_data_filename('mayamodel/forwardvelocity/lefts_optstim.npy'))
-        rx_v = np.load(package_data_filename('mayamodel/forwardvelocity/rights_optstim.npy'))
-
-        angles_p = np.load(package_data_filename('mayamodel/pulse/angles_optstim.npy'))
-
-        ty_p = np.load(package_data_filename('mayamodel/pulse/tops_optstim.npy'))
-        by_p = np.load(package_data_filename('mayamodel/pulse/bottoms_optstim.npy'))
-        lx_p = np.load(package_data_filename('mayamodel/pulse/lefts_optstim.npy'))
-        rx_p = np.load(package_data_filename('mayamodel/pulse/rights_optstim.npy'))
-
-        self._angles = angles_v[:300]
-        self._angles = np.append(self._angles, angles_p[:300])
-        self._img_pos = np.array([(lx_v[:300] + rx_v[:300]) / 2, (ty_v[:300] + by_v[:300]) / 2])
-        self._img_pos = np.append(self._img_pos,
-                                  np.array([(lx_p[:300] + rx_p[:300]) / 2, (ty_p[:300] + by_p[:300]) / 2]),
-                                  axis=1)
-
-        self._img_size = [rx_v[:300] - lx_v[:300], ty_v[:300] - by_v[:300]]
-        self._img_size = np.append(self._img_size, np.array([rx_p[:300] - lx_p[:300], ty_p[:300] - by_p[:300]]),
-                                   axis=1)
-
-        for ii in range(300, 3300, 300):
-            self._angles = np.append(self._angles, angles_v[ii:ii + 300])
-            self._angles = np.append(self._angles, angles_p[ii:ii + 300])
-
-            self._img_pos = np.append(self._img_pos, np.array(
-                [(lx_v[ii:ii + 300] + rx_v[ii:ii + 300]) / 2, (ty_v[ii:ii + 300] + by_v[ii:ii + 300]) / 2]),
-                                     axis=1)
-            self._img_pos = np.append(self._img_pos, np.array(
-                [(lx_p[ii:ii + 300] + rx_p[ii:ii + 300]) / 2, (ty_p[ii:ii + 300] + by_p[ii:ii + 300]) / 2]),
-                                     axis=1)
-
-            self._img_size = np.append(self._img_size, np.array(
-                [rx_v[ii:ii + 300] - lx_v[ii:ii + 300], ty_v[ii:ii + 300] - by_v[ii:ii + 300]]), axis=1)
-            self._img_size = np.append(self._img_size, np.array(
-                [rx_p[ii:ii + 300] - lx_p[ii:ii + 300], ty_p[ii:ii + 300] - by_p[ii:ii + 300]]), axis=1)
+        # (shared by every instance)
+        self._angles, self._img_pos, self._img_size = opt_trajectory()
 
     def initialize(self, win, fps, flyvr_shared_state):
         super().initialize(win, fps, flyvr_shared_state)
-        self._imgs = [visual.ImageStim(win=win, image=Image.open(i).convert('L')) for i in self._image_names]
-        self.screen = self._imgs[0]
+        self._imgs = window_images(win)
+        # (upload every image the trajectory uses now, rather than while drawing)
+        self._imgs.preload(np.unique(self._angles))
+        self.screen = self._imgs[self._angles[0]]
 
     def update(self, win, logger, frame_num):
         # noinspection DuplicatedCode
@@ -930,10 +891,17 @@ def stimulus_factory(name, **params):
 
 class VideoServer(object):
 
-    def __init__(self, shared_state=None, calibration_file=None, use_lightcrafter=True):
+    def __init__(self, shared_state=None, calibration_file=None, use_lightcrafter=True, save_frames_path=None,
+                 save_frames_policy=POLICY_DROP):
+        """
+        :param str save_frames_path: Save every frame (see FrameWriter), to a video file or a directory of jpegs.
+        :param str save_frames_policy: If frames are dropped, or rendering waits, when saving falls behind.
+        """
         self._log = logging.getLogger('flyvr.video_server')
 
-        self._save_frames_path = None
+        self._save_frames_path = save_frames_path
+        self._save_frames_policy = save_frames_policy
+        self._frame_writer = self._readback = None
 
         self.stim = self.mywin = self.synchRect = self.framepacker = self.warper = None
 
@@ -964,6 +932,9 @@ class VideoServer(object):
         self._running = False
         self._q = queue.Queue()
 
+        # a playlist item to switch to at an exact frame
+        self._scheduled = None  # type: Optional[ScheduledPlay]
+
         self.logger.create("/video/synchronization_info",
                            shape=[1024, SYNCHRONIZATION_INFO_NUM_FIELDS],
                            maxshape=[None, SYNCHRONIZATION_INFO_NUM_FIELDS],
@@ -974,6 +945,8 @@ class VideoServer(object):
                             str(cname),
                             attribute_name='column_%d' % cn)
 
+        ScheduledPlay.create_h5_log(self.logger, "/video/scheduled_play_info")
+
         for stimcls in STIMS:
             stimcls.create_h5_log(self.logger)
 
@@ -995,6 +968,9 @@ class VideoServer(object):
                                            H5_SYNC_VERSION,
                                            attribute_name='__version')
 
+        # the flip time, update and draw duration and missed refreshes of every frame
+        self._frame_timing = FrameTimingLog(self.logger, 1. / self._fps)
+
     # This is how many records of calls to the callback function we store in memory.
     CALLBACK_TIMING_LOG_SIZE = 10000
 
@@ -1008,6 +984,9 @@ class VideoServer(object):
             assert self.mywin
             stim_or_cmd.initialize(self.mywin, self._fps, self.flyvr_shared_state)
             self.stim = stim_or_cmd
+        elif isinstance(stim_or_cmd, ScheduledPlay):
+            self._log.info("scheduling item: %r" % (stim_or_cmd,))
+            self._scheduled = stim_or_cmd
         elif isinstance(stim_or_cmd, str):
             self._log.info("playing item/action: %r" % (stim_or_cmd,))
             if stim_or_cmd in {'play', 'pause'}:
@@ -1023,6 +1002,19 @@ class VideoServer(object):
             else:
                 raise NotImplementedError
 
+    def _start_scheduled(self):
+        # the counter is the number of the frame about to be drawn
+        counter = self.samples_played
+        tns = self.flyvr_shared_state.TIME_NS
+
+        # the frame drawn now is shown at the next refresh
+        latency = int(round(1e9 / self._fps))
+
+        if self._scheduled.counts_until(counter, tns, self._fps, latency) <= 0:
+            sched, self._scheduled = self._scheduled, None
+            self.stim.play_item(sched.identifier)
+            sched.log_achieved(self.logger, "/video/scheduled_play_info", counter, counter, tns, self._fps, latency)
+
     # noinspection PyUnusedLocal
     def quit(self, *args, **kwargs):
         self._running = False
@@ -1066,6 +1058,11 @@ class VideoServer(object):
                                  flipHorizontal=False,
                                  flipVertical=False)
 
+        if self._save_frames_path:
+            self._readback = PBOReadback.new(*self.mywin.size)
+            self._frame_writer = FrameWriter(self._save_frames_path, self.mywin.size, fps=self._fps,
+                                             policy=self._save_frames_policy)
+
         _ = self.flyvr_shared_state.signal_ready(BACKEND_VIDEO)
 
         if not self.flyvr_shared_state.wait_for_start():
@@ -1076,7 +1073,7 @@ class VideoServer(object):
 
             try:
                 msg = self._q.get_nowait()
-                if isinstance(msg, (VideoStim, VideoStimPlaylist, str, tuple)):
+                if isinstance(msg, (VideoStim, VideoStimPlaylist, ScheduledPlay, str, tuple)):
                     self._play(msg)
                 elif msg is not None:
                     self._log.error('unsupported message: %r' % (msg,))
@@ -1084,15 +1081,19 @@ class VideoServer(object):
                 pass
 
             if self.stim is not None:
+                # switch to a scheduled item exactly at its scheduled frame
+                if self._scheduled is not None:
+                    self._start_scheduled()
+
+                t_draw = time.perf_counter()
                 active_stim = self.stim.update_and_draw(self.mywin, self.logger, frame_num=self.samples_played) \
                               or _NoVideoStim
 
-                if self._save_frames_path:
-                    self.mywin.getMovieFrame()
-                    self.mywin.saveMovieFrames(
-                        os.path.join(self._save_frames_path,
-                                     '{}_image{:0>5d}.jpg'.format(self.stim.identifier,
-                                                                  self.stim.frame_count)))
+                if self._frame_writer is not None:
+                    # (returns earlier frames, once the gpu has copied them)
+                    for name, frame in self._readback.read('{}_image{:0>5d}'.format(self.stim.identifier,
+                                                                                    self.stim.frame_count)):
+                        self._frame_writer.put(frame, name)
 
                 if self.sync_signal > 60 * 10:
                     self.synchRect.fillColor = 'black'
@@ -1101,7 +1102,11 @@ class VideoServer(object):
                     self.synchRect.fillColor = 'white'
 
                 self.synchRect.draw()
+                t_flip = time.perf_counter()
                 self.mywin.flip()
+                # (flip blocks until the vertical blank, so a frame late by more than a refresh shows here)
+                self._frame_timing.record(self.samples_played, time.perf_counter(), t_flip - t_draw,
+                                          getattr(active_stim, 'identifier', None))
 
                 self.samples_played += 1
                 self.sync_signal += 1
@@ -1123,6 +1128,14 @@ class VideoServer(object):
             if self.flyvr_shared_state.is_stopped():
                 self._running = False
 
+        if self._frame_writer is not None:
+            for name, frame in self._readback.flush():
+                self._frame_writer.put(frame, name)
+            self._readback.close()
+            self._frame_writer.close()
+
+        self._frame_timing.close()
+
         self._log.info('stopped')
 
 
@@ -1142,7 +1155,7 @@ def _ipc_main(q):
                     stim = stimulus_factory(defn['name'], **defn.get('configuration', {}))
                     q.put(stim)
                 elif 'video_item' in elem:
-                    q.put(elem['video_item']['identifier'])
+                    q.put(ScheduledPlay.from_message(elem['video_item']) or elem['video_item']['identifier'])
                 elif 'video_action' in elem:
                     q.put(elem['video_action'])
                 elif 'video_mutate' in elem:
@@ -1200,7 +1213,9 @@ def run_video_server(options):
 
         video_server = VideoServer(calibration_file=options.screen_calibration,
                                    shared_state=state,
-                                   use_lightcrafter=not getattr(options, 'projector_disable', False))
+                                   use_lightcrafter=not getattr(options, 'projector_disable', False),
+                                   save_frames_path=getattr(options, 'save_frames', None),
+                                   save_frames_policy=getattr(options, 'save_frames_policy', POLICY_DROP))
 
         if playlist_stim is not None:
             video_server.queue.put(playlist_stim)
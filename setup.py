@@ -30,6 +30,7 @@ setup(
             'flyvr = flyvr.main:main_launcher',
             'flyvr-fictrac-replay = flyvr.fictrac.replay:main_replay',
             'flyvr-fictrac-plot = flyvr.fictrac.plot_task:main_plot_fictrac',
+            'flyvr-fictrac-wait-benchmark = flyvr.fictrac.frame_waiter:main_benchmark',
             'flyvr-fictrac = flyvr.main:main_fictrac',
             'flyvr-daq = flyvr.audio.io_task:main_io',
             'flyvr-print-state = flyvr.common:main_print_state',
@@ -37,6 +38,9 @@ setup(
             'flyvr-video = flyvr.video.video_server:main_video_server',
             'flyvr-camera = flyvr.video.camera_server:main_camera_server',
             'flyvr-experiment = flyvr.control.experiment:main_experiment',
+            'flyvr-experiment-benchmark = flyvr.control.conditions:main_benchmark',
+            'flyvr-experiment-simulate = flyvr.control.simulator:main_simulate',
+            'flyvr-latency-benchmark = flyvr.control.latency_benchmark:main_latency_benchmark',
             'flyvr-ipc-send = flyvr.common.ipc:main_ipc_send',
             'flyvr-ipc-relay = flyvr.common.ipc:main_relay',
             'flyvr-hwio = flyvr.hwio.phidget:main_phidget',
@@ -57,4 +57,45 @@ def test_mat_file_stim_attenuation():
 
     stim.attenuator = att
 
-    assert(stim.data[10] == 4*oldVal)
\ No newline at end of file
+    assert(stim.data[10] == 4*oldVal)
+
+
+def test_attenuate_inplace_and_cache():
+    att = Attenuator(attenuation_factors={250: 0.2132, 0: 3.9273, 200: 0.1851, 100: 0.0701, 150: 0.1178})
+
+    # the table is sorted regardless of the input order
+    assert att.frequencies == [0, 100, 150, 200, 250]
+
+    data = np.linspace(1, 10, 10)
+    expected = data * 0.19634
+
+    out = att.attenuate_inplace(data, 220)
+    assert out is data
+    assert np.array_equal(data, expected)
+    assert att.get_factor(220) == 0.19634
+
+    with pytest.raises(ValueError):
+        att.attenuate(data, 300)
+
+
+def test_get_factors():
+    att = Attenuator(attenuation_factors=dict(list(zip([0, 100, 150, 200, 250], [3.9273, 0.0701, 0.1178, 0.1851, 0.2132]))))
+
+    assert np.array_equal(att.get_factors([200, 220, None, 220]), [0.1851, 0.19634, 1.0, 0.19634])
+
+
+def test_playlist_attenuation():
+    from flyvr.audio.stimuli import AudioStimPlaylist
+
+    att = Attenuator(attenuation_factors=dict(list(zip([0, 100, 150, 200, 250], [0, 1, 2, 3, 4]))))
+
+    items = [{'s200': {'name': 'sin', 'frequency': 200, 'amplitude': 1.0, 'duration': 100}},
+             {'s225': {'name': 'sin', 'frequency': 225, 'amplitude': 1.0, 'duration': 100}},
+             {'c': {'name': 'constant', 'amplitude': 1.0, 'duration': 100}}]
+    pl = AudioStimPlaylist.fromitems(items, attenuator=att)
+
+    s200, s225, c = list(pl)
+    assert s200.attenuator is att
+    assert s225.attenuator is att
+    assert c.attenuator is None
+    assert np.allclose(s225.data, 3.5 * SinStim(225, 1.0, 0.0, 44100, 100).data)
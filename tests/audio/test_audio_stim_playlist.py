@@ -4,7 +4,7 @@ import yaml
 import numpy as np
 
 from flyvr.common import Randomizer
-from flyvr.audio.signal_producer import chunker
+from flyvr.audio.signal_producer import chunker, SignalProducer
 from flyvr.audio.stimuli import SinStim, AudioStimPlaylist
 from flyvr.audio.stimuli import legacy_factory
 
@@ -212,4 +212,39 @@ def test_all_stim_library(stimlibraryplaylist):
 
 def test_all_stim_library_types(stimlibraryplaylist):
     for stim in stimlibraryplaylist:
-        assert stim.dtype == np.float64, stim
\ No newline at end of file
+        assert stim.dtype == np.float64, stim
+
+
+def test_concurrent_load():
+    import copy
+
+    items = [{'sin%d' % f: {'name': 'sin', 'frequency': f, 'amplitude': 1.0, 'duration': 200}}
+             for f in range(100, 900, 100)]
+    items.insert(3, {'mix': {'name': 'mixed',
+                             'stimuli': [{'name': 'sin', 'frequency': 50, 'amplitude': 1.0, 'duration': 200},
+                                         {'name': 'constant', 'amplitude': 1.0, 'duration': 200}]}})
+
+    def _instance_ns(pl):
+        return [n for s in pl for n in [s.producer_instance_n] + [c.producer_instance_n
+                                                                  for c in getattr(s, '_stims', [])]]
+
+    n0 = SignalProducer.instances_created
+    serial = AudioStimPlaylist.fromitems(copy.deepcopy(items))
+    # 8 sin items, the mixed item and its two children, and the playlist
+    assert SignalProducer.instances_created == n0 + 12
+    # numbered as built, so the children of the mixed item before it
+    mix = list(serial)[3]
+    assert [c.producer_instance_n for c in mix._stims] == [n0 + 3, n0 + 4]
+    assert mix.producer_instance_n == n0 + 5
+
+    n0 = SignalProducer.instances_created
+    concurrent = AudioStimPlaylist.fromitems(copy.deepcopy(items), workers=4)
+
+    assert [s.identifier for s in concurrent] == [s.identifier for s in serial]
+    assert list(concurrent.load_times) == [s.identifier for s in serial]
+
+    # unique, though not necessarily in playlist order
+    assert sorted(_instance_ns(concurrent) + [concurrent.producer_instance_n]) == list(range(n0, n0 + 12))
+
+    for a, b in zip(serial, concurrent):
+        assert np.array_equal(next(a.data_generator()).data, next(b.data_generator()).data)
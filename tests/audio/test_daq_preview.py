@@ -0,0 +1,58 @@
+import numpy as np
+
+from flyvr.audio.daq_preview import DAQPreview
+
+
+def _preview(**kwargs):
+    return DAQPreview(2, 1000, history_seconds=1.0, num_bins=10, name='FlyVRDAQPreviewSHMEM_test', **kwargs)
+
+
+def test_preview_min_max():
+    writer = _preview()
+    reader = _preview(writer=False)
+    assert writer.samples_per_bin == 100
+
+    data = np.column_stack((np.arange(1000.), -np.arange(1000.)))
+
+    # publish in blocks that do not align with the bins
+    for lo, hi in ((0, 150), (150, 170), (170, 1000)):
+        writer.publish(data[lo:hi])
+
+    count, mins, maxs = reader.read()
+    assert count == 10
+    np.testing.assert_equal(mins[:, 0], np.arange(0, 1000, 100))
+    np.testing.assert_equal(maxs[:, 0], np.arange(99, 1000, 100))
+    np.testing.assert_equal(mins[:, 1], -np.arange(99, 1000, 100))
+
+    # the ring wraps, oldest bin first
+    writer.publish(data[:250] + 1000)
+    count, mins, maxs = reader.read()
+    assert count == 12
+    np.testing.assert_equal(mins[:, 0], np.arange(200, 1200, 100))
+
+    assert reader.bin_times()[-1] == 0
+    assert reader.bin_times()[0] == -0.9
+
+    assert not reader.closed
+    writer.close()
+    assert reader.closed
+
+    # a new writer resets the preview
+    _preview()
+    assert reader.read()[0] == 0
+    assert not reader.closed
+
+
+def test_preview_raw_scaled():
+    coeffs = np.array([[0., 10. / 32768, 0., 0.], [1., 1., 0., 0.]])
+    writer = _preview(scaling_coefficients=coeffs)
+
+    data = np.zeros((100, 2), dtype=np.int16)
+    data[:, 0] = 3277
+    data[:, 1] = np.arange(100)
+    writer.publish(data)
+
+    count, mins, maxs = _preview(writer=False).read()
+    assert count == 1
+    np.testing.assert_allclose(mins[-1], [1.0, 1.], atol=1e-3)
+    np.testing.assert_allclose(maxs[-1], [1.0, 100.], atol=1e-3)
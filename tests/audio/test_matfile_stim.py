@@ -1,8 +1,10 @@
+import itertools
 import unittest.mock
 
+import pytest
 import numpy as np
 
-from flyvr.audio.stimuli import MATFileStim
+from flyvr.audio.stimuli import MATFileStim, MATFileStreamStim
 
 
 def test__generate_data():
@@ -30,3 +32,70 @@ def test_callbacks():
     next(data_gen)
 
     my_callback_mock.assert_called()
+
+
+def _write_v73_matfile(path, data, **kwargs):
+    import h5py
+
+    # a minimal v7.3 MAT file is an HDF5 file with a 512 byte userblock containing the MATLAB header
+    with h5py.File(path, 'w', userblock_size=512) as f:
+        f.create_dataset('stim', data=data, **kwargs)
+    with open(path, 'r+b') as f:
+        f.write(b'MATLAB 7.3 MAT-file'.ljust(116) + b'\x00' * 8 + b'\x00\x02' + b'IM')
+
+
+@pytest.mark.parametrize('h5_kwargs', [{}, {'chunks': (1000, 1), 'compression': 'gzip'}])
+def test_stream_matches_matfile(tmpdir, h5_kwargs):
+    from flyvr.audio.attenuation import Attenuator
+
+    path = tmpdir.join('long_stim.mat').strpath
+    _write_v73_matfile(path, np.sin(np.linspace(0, 100, 10001)).reshape(-1, 1), **h5_kwargs)
+
+    att = Attenuator(attenuation_factors={100: 0.5, 300: 1.5})
+    kw = dict(frequency=250, sample_rate=10000, intensity=2.0, pre_silence=15, post_silence=20, attenuator=att)
+
+    stim = MATFileStim(path, **kw)
+    stream = MATFileStreamStim(path, block_size=1024, **kw)
+
+    assert stream.num_samples == len(stim.data)
+    assert stream.chunks_per_play == 1 + 10 + 1
+
+    gen = stream.data_generator()
+    blocks = [next(gen).data for _ in range(stream.chunks_per_play)]
+    assert max(len(b) for b in blocks) <= 1024
+    np.testing.assert_allclose(np.concatenate(blocks), stim.data)
+
+    # the generator loops back to the start
+    np.testing.assert_allclose(next(gen).data, stim.data[:len(blocks[0])])
+
+
+def test_stream_limits(tmpdir):
+    path = tmpdir.join('loud_stim.mat').strpath
+    _write_v73_matfile(path, np.linspace(-1, 1, 5000))
+
+    stream = MATFileStreamStim(path, frequency=None, sample_rate=10000, intensity=5.0, block_size=512)
+    with pytest.raises(ValueError):
+        stream.intensity = 20.0
+
+
+def test_stream_requires_hdf5():
+    with pytest.raises(ValueError):
+        MATFileStreamStim('tests/audio/pulseTrain_16IPI.mat', frequency=250, sample_rate=10000)
+
+
+def test_stream_in_playlist(tmpdir):
+    from flyvr.common import Randomizer
+    from flyvr.audio.stimuli import AudioStimPlaylist, SinStim
+
+    path = tmpdir.join('long_stim.mat').strpath
+    _write_v73_matfile(path, np.linspace(-1, 1, 5000))
+
+    stream = MATFileStreamStim(path, frequency=None, sample_rate=10000, block_size=512, identifier='stream')
+    sin = SinStim(frequency=100, amplitude=1.0, phase=0.0, sample_rate=10000, duration=100, identifier='sin')
+
+    pl = AudioStimPlaylist([stream, sin], random=Randomizer('stream', 'sin', repeat=1))
+    chunks = list(itertools.takewhile(lambda c: c is not None, pl.data_generator()))
+
+    assert [c.producer_identifier for c in chunks] == (['stream'] * stream.chunks_per_play) + ['sin']
+    assert [c.producer_playlist_n for c in chunks] == ([0] * stream.chunks_per_play) + [1]
+    np.testing.assert_allclose(pl._to_array(), np.concatenate([stream.data, sin.data]))
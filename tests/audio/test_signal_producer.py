@@ -1,8 +1,10 @@
 import numpy as np
 import math
 
-from flyvr.audio.stimuli import SinStim, ConstantStim
-from flyvr.audio.signal_producer import SampleChunk, SignalProducer, MixedSignal, chunker
+import pytest
+
+from flyvr.audio.stimuli import SinStim, ConstantStim, AudioStimPlaylist, stimulus_factory
+from flyvr.audio.signal_producer import SampleChunk, SignalProducer, MixedSignal, chunker, splice_chunks, pad_channels
 
 
 def check_chunker(test_gen, chunk_size):
@@ -112,3 +114,205 @@ def test_mix_different_sizes():
         chunk = next(gen).data
         assert (np.array_equal(chunk[:, 0], stim1.data))
         assert (np.array_equal(chunk[:, 1], np.ones(shape=stim1.data.shape) * 5))
+
+
+@pytest.mark.parametrize('conf', [
+    {'name': 'sin', 'frequency': 230, 'amplitude': 2.0, 'duration': 200, 'pre_silence': 10, 'post_silence': 10},
+    {'name': 'square', 'frequency': 230, 'amplitude': 2.0, 'duration': 200, 'pre_silence': 10},
+    {'name': 'constant', 'amplitude': 5.0, 'duration': 200, 'post_silence': 10},
+    {'name': 'pulse', 'amplitude_a': 1.0, 'amplitude_b': -1.0, 'duration_a': 10, 'duration_b': 20},
+])
+def test_float32_precision(conf):
+    stim64 = stimulus_factory(**dict(conf))
+    stim32 = stimulus_factory(**dict(conf), dtype='float32')
+
+    assert stim64.dtype == np.float64
+    assert stim32.dtype == np.float32
+    assert stim32.data.dtype == np.float32
+
+    # the waveform is identical to within float32 rounding (and so to well below the DAC resolution)
+    assert stim32.data.shape == stim64.data.shape
+    np.testing.assert_allclose(stim32.data, stim64.data, rtol=0, atol=np.abs(stim64.data).max() * 1e-7)
+
+    # and remains float32 through chunking and mixing
+    chunk = next(chunker(stim32.data_generator(), chunk_size=128))
+    assert chunk.data.dtype == np.float32
+    mixed = MixedSignal([stim32, stimulus_factory(**dict(conf), dtype=np.float32)])
+    assert mixed.dtype == np.float32
+    assert next(mixed.data_generator()).data.dtype == np.float32
+
+
+def test_float32_playlist():
+    items = [{'sin': {'name': 'sin', 'frequency': 230, 'amplitude': 2.0, 'duration': 200}},
+             {'constant': {'name': 'constant', 'amplitude': 1.0, 'duration': 100}}]
+
+    pl = AudioStimPlaylist.fromitems(items, dtype='float32')
+    assert pl.dtype == np.float32
+    for stim in pl:
+        assert stim.dtype == np.float32
+
+    with pytest.raises(ValueError):
+        AudioStimPlaylist([SinStim(frequency=230, amplitude=2.0, phase=0.0, sample_rate=40000, duration=200),
+                           ConstantStim(amplitude=5.0, duration=200, sample_rate=40000, dtype=np.float32)])
+
+
+def test_unsupported_dtype():
+    with pytest.raises(ValueError):
+        ConstantStim(amplitude=5.0, duration=200, sample_rate=40000, dtype=np.int16)
+
+
+def test_mix_layout_from_metadata():
+    stim1 = SinStim(frequency=230, amplitude=2.0, phase=0.0, sample_rate=40000, duration=200)
+    stim2 = ConstantStim(amplitude=5.0, duration=100, sample_rate=40000)
+
+    mixed = MixedSignal([stim1, MixedSignal([stim2, stim2, stim2])])
+
+    # no generator was run to find the layout
+    assert stim1.num_samples_generated == 0
+    assert stim2.num_samples_generated == 0
+
+    assert mixed.num_channels == 4
+    assert mixed.num_samples == stim1.num_samples
+    assert next(mixed.data_generator()).data.shape == (stim1.num_samples, 4)
+
+
+
+def test_mix_playlist_layout_from_metadata():
+    from flyvr.common import Randomizer
+
+    stims = [SinStim(frequency=f, amplitude=1.0, phase=0.0, sample_rate=40000, duration=d, identifier='s%d' % f)
+             for f, d in ((200, 100), (400, 300))]
+    random = Randomizer('s200', 's400', mode=Randomizer.MODE_SHUFFLE, random_seed=1)
+    pl = AudioStimPlaylist(stims, random=random, paused=True)
+    before = repr(random)
+
+    def _no_generator():
+        raise AssertionError('the playlist generator was run')
+    pl.data_generator = _no_generator
+
+    mixed = MixedSignal([pl, ConstantStim(amplitude=1.0, duration=100, sample_rate=40000)])
+    assert pl.num_channels == 1
+    assert mixed.num_channels == 2
+    assert mixed.num_samples == pl.num_samples == stims[1].num_samples
+    assert repr(random) == before
+
+
+
+def test_mixed_width_playlist():
+    mixed = MixedSignal([SinStim(frequency=200, amplitude=1.0, phase=0.0, sample_rate=10000, duration=10),
+                         ConstantStim(amplitude=2.0, duration=10, sample_rate=10000)], identifier='both')
+    one = ConstantStim(amplitude=3.0, duration=10, sample_rate=10000, identifier='one')
+    pl = AudioStimPlaylist([mixed, one], random=None, paused=False)
+
+    # the widest item, the narrower one is padded with a silent channel (as the DAQ does)
+    assert pl.num_channels == 2
+    gen = chunker(pad_channels(pl.data_generator(), pl.num_channels), chunk_size=100)
+    chunks = [next(gen) for _ in range(2)]
+    assert [c.data.shape for c in chunks] == [(100, 2), (100, 2)]
+    np.testing.assert_equal(chunks[1].data[:, 0], 3.0)
+    np.testing.assert_equal(chunks[1].data[:, 1], 0.0)
+
+    assert AudioStimPlaylist([], random=None).num_channels == 1
+
+
+def test_mix_ring_buffers():
+    stims = [ConstantStim(amplitude=i * 0.5, duration=1, sample_rate=40000) for i in range(16)]
+    mixed = MixedSignal([SinStim(frequency=230, amplitude=2.0, phase=0.0, sample_rate=40000, duration=1)] + stims,
+                        chunk_size=7, ring_size=3)
+
+    gen = mixed.data_generator()
+    chunks = [next(gen) for _ in range(mixed.ring_size)]
+    copies = [c.data.copy() for c in chunks]
+
+    # blocks are interleaved (samples x channels) and not modified until the ring wraps around
+    assert chunks[0].data.shape == (7, 17)
+    assert chunks[0].data.flags.c_contiguous
+    np.testing.assert_equal(chunks[0].data[:, 1:], np.tile(np.arange(16) * 0.5, (7, 1)))
+    for c, cc in zip(chunks, copies):
+        np.testing.assert_equal(c.data, cc)
+    assert len(set(id(c.data) for c in chunks)) == mixed.ring_size
+
+    # chunker re-chunks the sin channel across blocks
+    sin = np.concatenate([cc[:, 0] for cc in copies])
+    np.testing.assert_equal(sin, mixed._stims[0].data[:len(sin)])
+
+
+@pytest.mark.parametrize('offset', [0, 1, 37, 63])
+def test_splice_chunks(offset):
+    stim1 = ConstantStim(amplitude=1.0, duration=100, sample_rate=1000)
+    stim2 = SinStim(frequency=10, amplitude=2.0, phase=0.0, sample_rate=1000, duration=150)
+
+    old = chunker(stim1.data_generator(), chunk_size=64)
+    assert next(old).data.shape == (64, )
+
+    spliced = splice_chunks(old, stim2.data_generator(), offset, chunk_size=64)
+    chunks = [next(spliced) for _ in range(4)]
+    data = np.concatenate([c.data for c in chunks])
+
+    # the new signal starts at exactly offset, part way through the chunk
+    np.testing.assert_equal(data[:offset], 1.0)
+    np.testing.assert_equal(data[offset:offset + 150], stim2.data)
+
+    assert chunks[0].producer_identifier == stim2.identifier
+    assert chunks[0].mixed_producer == (offset > 0)
+    assert chunks[0].mixed_start_offset == offset
+
+
+def test_splice_chunks_from_silence():
+    stim = ConstantStim(amplitude=1.0, duration=100, sample_rate=1000)
+
+    chunk = next(splice_chunks(None, stim.data_generator(), 10, chunk_size=64))
+    np.testing.assert_equal(chunk.data[:10], 0.0)
+    np.testing.assert_equal(chunk.data[10:], 1.0)
+    assert chunk.mixed_start_offset == 10
+
+
+def test_pad_channels():
+    sin = SinStim(frequency=100, amplitude=1.0, phase=0.0, sample_rate=1000, duration=100)
+    mixed = MixedSignal([sin, ConstantStim(amplitude=1.0, sample_rate=1000, duration=100)])
+
+    chunk = next(pad_channels(sin.data_generator(), 3))
+    assert chunk.data.shape == (100, 3)
+    np.testing.assert_equal(chunk.data[:, 0], sin.data)
+    np.testing.assert_equal(chunk.data[:, 1:], 0)
+
+    chunk = next(pad_channels(mixed.data_generator(), 3))
+    np.testing.assert_equal(chunk.data[:, 1], 1.0)
+    np.testing.assert_equal(chunk.data[:, 2], 0)
+
+    # already the right width, not copied
+    gen = mixed.data_generator()
+    chunk = next(pad_channels(gen, 2))
+    assert np.shares_memory(chunk.data, mixed._ring)
+
+    with pytest.raises(ValueError):
+        next(pad_channels(mixed.data_generator(), 1))
+
+
+def test_mixed_stimulus_factory():
+    mixed = stimulus_factory(name='mixed', identifier='opto_and_copy',
+                             stimuli=[{'name': 'sin', 'frequency': 100, 'amplitude': 1.0, 'sample_rate': 1000,
+                                       'duration': 300},
+                                      {'name': 'constant', 'amplitude': 2.0, 'sample_rate': 1000, 'duration': 100}])
+    assert isinstance(mixed, MixedSignal)
+    assert mixed.identifier == 'opto_and_copy'
+    assert mixed.num_channels == 2
+    assert mixed.sample_rate == 1000
+
+    # one play is as long as the longest stimulus
+    pl = AudioStimPlaylist([mixed], random=None)
+    data = pl._to_array(fix_repeat_forver=True)
+    assert data.shape == (300, 2)
+    np.testing.assert_equal(data[:, 1], 2.0)
+
+
+def test_instances_created_concurrently():
+    import concurrent.futures
+
+    n0 = SignalProducer.instances_created
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        stims = list(executor.map(lambda f: SinStim(frequency=f, amplitude=1.0, phase=0.0, sample_rate=44100,
+                                                    duration=10), range(100, 900)))
+
+    assert sorted(s.producer_instance_n for s in stims) == list(range(n0, n0 + len(stims)))
+    assert SignalProducer.instances_created == n0 + len(stims)
@@ -2,6 +2,8 @@ import pytest
 from unittest import mock
 import math
 
+import numpy as np
+
 from flyvr.audio.stimuli import AudioStim, SinStim
 
 
@@ -54,6 +56,40 @@ def test_intensity(stim):
     assert stim.data[29] == oldVal * 2.0
 
 
+@pytest.mark.parametrize('sample_rate,periodic', [(10000, False), (10000.1, True)])
+def test_long_stim_rendered_lazily(sample_rate, periodic):
+    stim = SinStim(frequency=100, amplitude=2.0, phase=0.3, sample_rate=sample_rate, duration=10000,
+                   intensity=0.5, pre_silence=10, post_silence=10)
+
+    n = int(sample_rate * 10)
+    pre = int(np.ceil(0.01 * sample_rate))
+    expected = 0.5 * 2.0 * np.sin(2 * np.pi * 100 * np.linspace(0.0, 10.0, n) + 0.3)
+
+    # the signal is rendered (or a period tiled) block by block, phase continuous
+    assert (stim._PeriodicAudioStim__period is not None) == periodic
+    assert stim.chunks_per_play == int(np.ceil(stim.num_samples / float(SinStim.BLOCK_SIZE)))
+    assert stim.num_samples == pre + n + pre
+
+    gen = stim.data_generator()
+    data = np.concatenate([next(gen).data for _ in range(stim.chunks_per_play)])
+    assert data.shape == (stim.num_samples, )
+    assert not data[:pre].any()
+    assert not data[-pre:].any()
+    np.testing.assert_allclose(data[pre:pre + n], expected, rtol=0, atol=1e-9)
+
+    # and loops back to the start
+    np.testing.assert_equal(next(gen).data, data[:SinStim.BLOCK_SIZE])
+
+    assert stim.describe() == {'name': 'sin', 'sample_rate': sample_rate, 'duration': 10000, 'intensity': 0.5,
+                               'pre_silence': 10, 'post_silence': 10, 'attenuator': None, 'frequency': 100,
+                               'max_value': 10.0, 'min_value': -10.0, 'amplitude': 2.0, 'phase': 0.3}
+
+
+def test_long_stim_limits():
+    with pytest.raises(ValueError):
+        SinStim(frequency=100, amplitude=20.0, phase=0.0, sample_rate=10000, duration=10000)
+
+
 @pytest.mark.xfail(reason='tbd if callbacks/events required or not for DAQ -> h5 outputs')
 def test_callbacks(stim):
     my_callback_mock = mock.Mock()
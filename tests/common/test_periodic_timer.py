@@ -0,0 +1,23 @@
+import time
+
+import pytest
+
+from flyvr.common.periodic_timer import PeriodicTimer
+
+
+@pytest.mark.parametrize('backend', ('timerfd', 'sleep'))
+def test_periodic_timer(backend):
+    if (backend == 'timerfd') and (PeriodicTimer(1).backend != 'timerfd'):
+        pytest.skip('timerfd is linux only')
+
+    t = PeriodicTimer(0.005, backend=backend)
+    try:
+        t0 = time.perf_counter()
+        ticks = sum(t.wait() for _ in range(40))
+        assert time.perf_counter() - t0 == pytest.approx(ticks * 0.005, abs=0.02)
+
+        # the clock does not wait for a slow caller, which is told how many ticks it missed
+        time.sleep(0.05)
+        assert t.wait() >= 9
+    finally:
+        t.close()
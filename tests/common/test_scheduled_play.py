@@ -0,0 +1,46 @@
+from unittest import mock
+
+import pytest
+import numpy as np
+
+from flyvr.common import ScheduledPlay
+
+
+def test_scheduled_play_from_message():
+    assert ScheduledPlay.from_message({'identifier': 'foo'}) is None
+
+    sched = ScheduledPlay.from_message({'identifier': 'foo', 'counter': 100})
+    assert (sched.identifier, sched.counter, sched.time_ns) == ('foo', 100, None)
+
+    with pytest.raises(ValueError):
+        ScheduledPlay('foo', time_ns=1, counter=1)
+
+
+def test_scheduled_play_time_to_counter():
+    sched = ScheduledPlay('foo', time_ns=2 * 10 ** 9)
+
+    # resolved to a counter (10000 samples at 10kHz after the counter at 1s) once
+    assert sched.counts_until(500, 10 ** 9, 10000) == 10000
+    assert sched.counter == 10500
+    assert sched.counts_until(10250, 10 ** 9 + 5, 10000) == 250
+
+    logger = mock.Mock()
+    row = sched.log_achieved(logger, '/audio/scheduled_play_info', 10500, 10250, 10 ** 9, 10000)
+    assert row == [2 * 10 ** 9, 10500, 10500, 10 ** 9 + 25 * 10 ** 6, 0, 0]
+
+    (dset, arr), _ = logger.log.call_args
+    assert dset == '/audio/scheduled_play_info'
+    np.testing.assert_equal(arr, row)
+
+
+def test_scheduled_play_output_latency():
+    sched = ScheduledPlay('foo', time_ns=2 * 10 ** 9)
+
+    # the sample generated now is output 100ms later, so 1000 samples fewer until the scheduled start
+    assert sched.counts_until(500, 10 ** 9, 10000, 100 * 10 ** 6) == 9000
+    assert sched.counter == 9500
+
+    # started 10 samples late, at the hardware output time
+    row = sched.log_achieved(mock.Mock(), '/audio/scheduled_play_info', 9510, 9500, 19 * 10 ** 8, 10000,
+                             100 * 10 ** 6)
+    assert row == [2 * 10 ** 9, 9500, 9510, 2 * 10 ** 9 + 10 ** 6, 10, 100 * 10 ** 6]
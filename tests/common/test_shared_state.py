@@ -0,0 +1,18 @@
+from flyvr.common import SharedState
+
+
+def test_shared_state_reset():
+    state = SharedState(None, None, _start_rx_thread=False)
+    # (as left by a previous run)
+    state.SOUND_OUTPUT_NUM_SAMPLES_WRITTEN = 100
+    state.EXPERIMENT_FICTRAC_FRAME_NUM = 7
+    state._fictrac_shmem_state.frame_cnt = 7
+
+    # the memory is shared, so other instances see it
+    other = SharedState(None, None, _start_rx_thread=False)
+    assert other.EXPERIMENT_FICTRAC_FRAME_NUM == 7
+
+    other.reset()
+    assert state.SOUND_OUTPUT_NUM_SAMPLES_WRITTEN == 0
+    assert state.EXPERIMENT_FICTRAC_FRAME_NUM == 0
+    assert state.FICTRAC_FRAME_NUM == 0
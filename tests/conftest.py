@@ -2,7 +2,11 @@ import pytest
 
 
 def _has_soundcard():
-    from flyvr.audio.sound_server import SoundServer
+    try:
+        from flyvr.audio.sound_server import SoundServer
+    except OSError:
+        # PortAudio library not found
+        return False
 
     # noinspection PyProtectedMember
     for _ in SoundServer._iter_compatible_output_devices(show_all=False):
@@ -11,7 +15,11 @@ def _has_soundcard():
 
 def _has_daq(name=''):
     import ctypes
-    import PyDAQmx as daq
+    try:
+        import PyDAQmx as daq
+    except (ImportError, NotImplementedError):
+        # no NI-DAQmx library
+        return False
 
     buff = ctypes.create_string_buffer(1024)
     # noinspection PyUnresolvedReferences
@@ -0,0 +1,74 @@
+import operator
+
+import numpy as np
+
+from flyvr.control.conditions import CompiledConditions
+from flyvr.control.experiment import Experiment
+from flyvr.control.state_statistics import state_getter
+from flyvr.fictrac.shmem_transfer_data import SHMEMFicTracState
+
+PARAMS = ('speed', 'heading', 'del_rot_cam_vec[2]', 'abs_ori_lab_vec[0]', 'frame_cnt')
+OPERATORS = (operator.lt, operator.le, operator.gt, operator.ge, operator.eq, operator.ne)
+
+
+def _state(rng):
+    s = SHMEMFicTracState()
+    # (few distinct values, so some are exactly equal to the thresholds)
+    s.speed, s.heading = rng.choice([-1., 0., 0.5, 1.], 2)
+    s.del_rot_cam_vec = tuple(rng.choice([-1., 0., 0.5, 1.], 3))
+    s.abs_ori_lab_vec = tuple(rng.choice([-1., 0., 0.5, 1.], 3))
+    s.frame_cnt = int(rng.randint(-2, 2))
+    return s
+
+
+def test_compiled_conditions():
+    rng = np.random.RandomState(1)
+
+    cc = CompiledConditions()
+    defns = []
+    for i in range(60):
+        param = PARAMS[i % len(PARAMS)]
+        op = OPERATORS[rng.randint(len(OPERATORS))]
+        value = (-1., 0., 0.5, 1., 1)[rng.randint(5)]
+        absolute = bool(rng.randint(2))
+        getter = state_getter(param)
+        # (identical conditions are only added once)
+        defns.append((cc.add(param, getter, op, value, absolute), getter, op, value, absolute))
+    assert len(cc) < 60
+
+    # a condition which is not vectorized
+    defns.append((cc.add('heading', state_getter('heading'), operator.is_not, None, False),
+                  state_getter('heading'), operator.is_not, None, False))
+
+    for _ in range(200):
+        s = _state(rng)
+        expected = sorted(set(i for i, g, op, value, absolute in defns if op(abs(g(s)) if absolute else g(s), value)))
+        assert cc.evaluate(s).tolist() == expected
+
+
+def test_experiment_conditions(capsys):
+    class _Compiled(Experiment):
+        COMPILE_MIN_CONDITIONS = 1
+
+    exp = _Compiled.from_items({'speed': {'gt': {'value': 0.5, 'do': [{'print': {}}, {'print': {}}]}},
+                                'heading': {'lt': {'value': 0, 'average': 2, 'do': [{'print': {}}]}},
+                                'del_rot_error': {'is_not': {'value': None, 'do': [{'print': {}}]}}}, {})
+    try:
+        assert exp._conditions is not None
+
+        s = SHMEMFicTracState()
+        for speed, heading, err in ((1., -1., 3.), (0., 0.5, 4.), (0.6, 2., 5.)):
+            s.speed, s.heading, s.del_rot_error = speed, heading, err
+            exp.statistics.update(s)
+
+            exp._check_events(s)
+            compiled = capsys.readouterr().out
+            # every event checking its own condition
+            for e in exp._events:
+                e.check(s, exp)
+            one_by_one = capsys.readouterr().out
+
+            assert compiled == one_by_one
+            assert compiled
+    finally:
+        exp._ipc.close(block=False)
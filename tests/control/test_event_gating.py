@@ -0,0 +1,63 @@
+import operator
+
+import h5py
+import numpy as np
+import pytest
+
+from flyvr.control.experiment import _Event, PlaylistItemEvent
+from flyvr.control.simulator import simulate_session, load_experiment
+from flyvr.fictrac.shmem_transfer_data import NUM_FICTRAC_FIELDS
+
+SPEED = [0, 1, 1, 1, 0.45, 1, 1, 0.2, 1, 1, 0, 0, 0, 0, 0, 0, 0, 0, 1, 1]
+
+# (never true)
+OTHERS = ['%s[%d]' % (v, i) for v in ('del_rot_cam_vec', 'del_rot_lab_vec', 'abs_ori_cam_vec', 'abs_ori_lab_vec')
+          for i in range(3)] + ['posx', 'posy', 'intx', 'inty']
+
+
+def _session(path):
+    rows = np.zeros((len(SPEED), NUM_FICTRAC_FIELDS))
+    rows[:, 0] = np.arange(1, len(SPEED) + 1)
+    rows[:, 18] = SPEED
+    with h5py.File(path, mode='w') as f:
+        f.create_dataset('/fictrac/output', data=rows)
+    return path
+
+
+def _defn(compiled=False, **options):
+    cond = {'value': 0.5, 'do': [{'playlist_item': {'backend': 'audio', 'identifier': 'a'}}]}
+    cond.update(options)
+    state = {'speed': {'gt': cond}}
+    if compiled:
+        for p in OTHERS:
+            state[p] = {'gt': {'value': 1e9, 'do': [{'print': {}}]}}
+    return {'state': state}
+
+
+@pytest.mark.parametrize('compiled', [False, True])
+@pytest.mark.parametrize('options,frames,suppressed', [
+    ({}, [2, 3, 4, 6, 7, 9, 10, 19, 20], 0),
+    ({'edge': True}, [2, 6, 9, 19], 5),
+    ({'edge': True, 'hysteresis': 0.1}, [2, 9, 19], 7),
+    ({'refractory': 55}, [2, 9, 19], 6),
+])
+def test_gating(tmpdir, compiled, options, frames, suppressed):
+    path = _session(tmpdir.join('a.h5').strpath)
+
+    exp = load_experiment(_defn(compiled, **options))
+    assert (exp._conditions is not None) == compiled
+
+    timeline = simulate_session(exp, path, fps=100.)
+    assert [t['frame'] for t in timeline] == frames
+    assert exp.suppressed_triggers == suppressed
+
+
+def test_hysteresis_operator():
+    with pytest.raises(ValueError):
+        _Event(None, operator.eq, False, 1, None, hysteresis=0.1)
+
+
+def test_gating_repr():
+    ev = PlaylistItemEvent(None, operator.gt, False, 0.5, None, edge=True, refractory=2.0,
+                           backend='audio', identifier='a')
+    assert repr(ev) == '<PlaylistItemEvent(backend=audio, identifier=a, dt=None, edge=True, refractory=2.0)>'
@@ -0,0 +1,42 @@
+import numpy as np
+
+from flyvr.control.latency_benchmark import match_latencies, summarize, HOPS
+
+MS = 1000000
+
+
+def test_match_latencies():
+    items = {'audio': ('a0', 'a1'), 'daq': ('d0', 'd1')}
+
+    triggers = [(n, 10 * n, 100 * MS * n) for n in range(4)]
+    # the experiment missed trigger 2
+    decisions = [(n, 10 * n, 100 * MS * n + 1 * MS) for n in (0, 1, 3)]
+    sends = []
+    tocs = []
+    for n in (0, 1, 3):
+        t = 100 * MS * n + 2 * MS
+        sends.append((t, 'audio', items['audio'][n % 2]))
+        sends.append((t, 'daq', items['daq'][n % 2]))
+        tocs.append((t + 5 * MS, 'audio', items['audio'][n % 2], 20 * MS))
+        # the daq never started item 1 (trigger 1 or 3)
+        if n % 2 == 0:
+            tocs.append((t + 3 * MS, 'daq', items['daq'][n % 2], None))
+    # stale messages, from before the triggers, are not matched
+    tocs.insert(0, (-MS, 'audio', 'a0', 0))
+
+    lat = match_latencies(items, triggers, decisions, sends, tocs)
+
+    assert set(lat['audio']) == set(HOPS)
+    assert np.allclose(lat['audio']['tracking_experiment'], [0.001] * 3)
+    assert np.allclose(lat['audio']['experiment_ipc'], [0.001] * 3)
+    assert np.allclose(lat['audio']['ipc_backend'], [0.005] * 3)
+    assert np.allclose(lat['audio']['backend_hardware'], [0.020] * 3)
+    assert np.allclose(lat['audio']['total'], [0.027] * 3)
+
+    assert np.allclose(lat['daq']['total'], [0.005])
+    assert len(lat['daq']['backend_hardware']) == 0
+
+    s = summarize(lat)
+    assert s[('audio', 'total')]['n'] == 3
+    assert abs(s[('audio', 'total')]['p99'] - 0.027) < 1e-9
+    assert s[('daq', 'backend_hardware')] == {'n': 0}
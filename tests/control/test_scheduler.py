@@ -0,0 +1,62 @@
+import time
+
+from flyvr.control.scheduler import EventScheduler
+from flyvr.control.experiment import Experiment, _Event
+
+
+def test_scheduler():
+    s = EventScheduler().start()
+    called = []
+
+    t0 = time.perf_counter()
+    # (scheduled out of order, and one already due)
+    for dt in (0.05, 0.01, 0.03, -1., 0.03):
+        s.schedule(t0 + dt, lambda _dt: called.append((_dt, time.perf_counter() - t0)), dt)
+    s.schedule(t0 + 0.02, lambda: 1 / 0)
+
+    time.sleep(0.1)
+    assert len(s) == 0
+    assert [dt for dt, _ in called] == [-1., 0.01, 0.03, 0.03, 0.05]
+    for dt, t in called[1:]:
+        assert dt <= t < dt + 0.01
+
+    stats = s.stats()
+    assert stats['n'] == 6
+    s.stop()
+
+
+class _SharedState(object):
+
+    TIME_NS = 0
+
+    def is_started(self):
+        return True
+
+
+class _TimedEvent(_Event):
+
+    def __init__(self, dt, fired):
+        super().__init__(None, None, None, None, dt)
+        self.fired = fired
+
+    def perform(self, state, experiment):
+        self.fired.append((self._dt, time.perf_counter(), state))
+
+
+def test_experiment_timed():
+    fired = []
+    exp = Experiment(timed=[_TimedEvent(dt, fired) for dt in (0.04, 0., 0.02)])
+    try:
+        exp._set_shared_state(_SharedState())
+
+        t0 = time.perf_counter()
+        # fired at their times after the first state, without any more states
+        exp.process_state('state')
+        time.sleep(0.1)
+
+        assert [(dt, state) for dt, _, state in fired] == [(0., 'state'), (0.02, 'state'), (0.04, 'state')]
+        for dt, t, _ in fired:
+            assert dt <= (t - t0) < dt + 0.01
+    finally:
+        exp._stop_scheduler()
+        exp._ipc.close(block=False)
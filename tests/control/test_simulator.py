@@ -0,0 +1,62 @@
+import h5py
+import numpy as np
+
+from flyvr.control.simulator import simulate_session, sweep, sweep_definitions, load_experiment
+from flyvr.fictrac.shmem_transfer_data import NUM_FICTRAC_FIELDS
+
+DEFN = {'state': {'speed': {'gt': {'value': 0.5, 'do': [{'playlist_item': {'backend': 'video',
+                                                                           'identifier': 'fast'}}]}},
+                  'heading': {'gt': {'value': 1000, 'do': [{'experiment_stop': {}}]}}},
+        'time': {100: {'do': [{'playlist_item': {'backend': 'audio', 'identifier': 'sin'}}]}}}
+
+
+def _session(path, n, fps=100.):
+    rows = np.zeros((n, NUM_FICTRAC_FIELDS))
+    rows[:, 0] = np.arange(1, n + 1)
+    # speed, heading and the timestamp
+    rows[:, 18] = np.arange(n) / float(n)
+    rows[:, 16] = np.arange(n)
+    rows[:, 21] = 1000. + np.arange(n) / fps
+    with h5py.File(path, mode='w') as f:
+        f.create_dataset('/fictrac/output', data=rows)
+    return path
+
+
+def test_simulate_session(tmpdir):
+    path = _session(tmpdir.join('a.h5').strpath, 100)
+
+    timeline = simulate_session(DEFN, path, block_rows=16)
+    audio = [t for t in timeline if t['what'] == 'audio_item']
+    video = [t for t in timeline if t['what'] == 'video_item']
+
+    # the timed item is sent (SCHEDULE_LEAD_TIME) ahead of 100ms, scheduled to start at exactly 100ms
+    assert len(audio) == 1
+    assert abs(audio[0]['time'] - 0.) < 1e-6
+    assert audio[0]['value'] == {'identifier': 'sin', 'time_ns': 100000000}
+
+    # every frame with speed > 0.5
+    assert [t['frame'] for t in video] == list(range(52, 101))
+    assert np.allclose([t['time'] for t in video], np.arange(51, 100) / 100.)
+
+    # the definition is not consumed
+    assert simulate_session(DEFN, path, block_rows=16) == timeline
+    # but the experiment is
+    exp = load_experiment(DEFN)
+    assert simulate_session(exp, path, fps=50.)[1]['time'] == 51 / 50.
+
+    # stopped by the experiment
+    timeline = simulate_session(DEFN, _session(tmpdir.join('b.h5').strpath, 2000))
+    assert timeline[-1]['frame'] == 1002
+
+
+def test_sweep(tmpdir):
+    paths = [_session(tmpdir.join('%d.h5' % i).strpath, 100 * (i + 1)) for i in range(2)]
+    defns = sweep_definitions(DEFN, 'state.speed.gt.value', [0.5, 0.9])
+    assert defns[0] == DEFN
+    assert defns[1]['state']['speed']['gt']['value'] == 0.9
+
+    serial = sweep(defns, paths)
+    assert [(i, p) for i, p, _ in serial] == [(0, paths[0]), (0, paths[1]), (1, paths[0]), (1, paths[1])]
+    assert [len(tl) for _, _, tl in serial] == [50, 100, 10, 20]
+
+    assert sweep(defns, paths, workers=2) == serial
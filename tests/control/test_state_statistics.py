@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from flyvr.control.experiment import Experiment
+from flyvr.control.state_statistics import RunningWindow, StateStatistics
+from flyvr.fictrac.shmem_transfer_data import SHMEMFicTracState
+
+
+def test_running_window():
+    x = np.random.RandomState(0).normal(1000., 3., 500)
+
+    w = RunningWindow(25)
+    assert w.min is None
+    for i, v in enumerate(x):
+        w.add(float(v))
+        win = x[max(0, i - 24):i + 1]
+        assert len(w) == len(win)
+        assert w.mean == pytest.approx(win.mean(), rel=1e-12)
+        assert w.var == pytest.approx(win.var(), rel=1e-6)
+        assert (w.min, w.max) == (win.min(), win.max())
+
+
+def test_state_statistics_shared():
+    stats = StateStatistics()
+    w = stats.window('del_rot_cam_vec[1]', 3)
+    assert stats.window('del_rot_cam_vec[1]', 3) is w
+    assert stats.window('del_rot_cam_vec[1]', 4) is not w
+    e = stats.ema('speed', 0.5)
+    assert stats.ema('speed', 0.5) is e
+    assert len(stats) == 3
+
+    s = SHMEMFicTracState()
+    for i in range(5):
+        s.del_rot_cam_vec = (0., i, 0.)
+        s.speed = i
+        stats.update(s)
+
+    assert w.mean == 3.
+    assert e.value == pytest.approx(3.0625)
+
+
+def test_experiment_statistics():
+    exp = Experiment.from_items({'speed': {'gt': {'value': 2, 'average': 3, 'do': [{'print': {}},
+                                                                                  {'print': {}}]}},
+                                 'heading': {'lt': {'value': 0, 'ema': 0.5, 'absolute': True, 'do': [{'print': {}}]}},
+                                 'posx': {'gt': {'value': 0, 'max': 2, 'do': [{'print': {}}]}}},
+                                {})
+    # both events of the average share one window
+    assert len(exp.statistics) == 3
+
+    s = SHMEMFicTracState()
+    for i in range(4):
+        s.speed, s.heading, s.posx = i, -i, 10 - i
+        exp.statistics.update(s)
+
+    speed_a, speed_b, heading, posx = exp._events
+    assert speed_a.calculate(s) == speed_b.calculate(s) == 2.
+    assert heading.calculate(s) == pytest.approx(2.125)
+    assert posx.calculate(s) == 8
+
+    with pytest.raises(ValueError):
+        Experiment.from_items({'speed': {'gt': {'value': 2, 'average': 3, 'std': 3, 'do': []}}}, {})
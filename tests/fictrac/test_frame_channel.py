@@ -0,0 +1,76 @@
+import time
+import threading
+import multiprocessing
+
+from flyvr.common import SharedState
+from flyvr.control.experiment import do_loop
+from flyvr.fictrac.frame_channel import FramePublisher, FrameSubscriber
+from flyvr.fictrac.shmem_transfer_data import SHMEMFicTracState
+
+
+def _publish(frames, delay=0.002, wait=0.2):
+    p = FramePublisher()
+    s = SHMEMFicTracState()
+    time.sleep(wait)
+    for i in frames:
+        s.frame_cnt = i
+        s.speed = s.heading = float(i)
+        p.publish(s)
+        time.sleep(delay)
+    p.close()
+
+
+def test_frame_channel():
+    sub = FrameSubscriber()
+    assert sub.wait(timeout=0.01) is None
+
+    proc = multiprocessing.Process(target=_publish, args=(list(range(1, 201)) + [205], ))
+    proc.start()
+
+    frames = []
+    while True:
+        skipped = sub.wait(timeout=1.)
+        if skipped is None:
+            break
+        # (never half written)
+        assert sub.state.speed == sub.state.heading == sub.state.frame_cnt
+        assert 0 < (time.perf_counter_ns() - sub.publish_ns) < 1e9
+        frames.append((sub.state.frame_cnt, skipped))
+
+    proc.join()
+    assert frames[-1][0] == 205
+    assert frames[-1][1] >= 4
+    # every frame was either followed or counted as skipped
+    assert sub.frames == len(frames)
+    assert sub.skipped == sum(skipped for _, skipped in frames)
+    assert sub.frames + sub.skipped == 205
+
+
+class _Experiment(object):
+
+    def __init__(self, stop_evt, n):
+        self.frames = []
+        self._stop_evt = stop_evt
+        self._n = n
+
+    def process_state(self, state):
+        self.frames.append(state.frame_cnt)
+        if state.frame_cnt == self._n:
+            self._stop_evt.set()
+
+    def _stop_scheduler(self):
+        pass
+
+
+def test_do_loop():
+    stop = threading.Event()
+    state = SharedState(None, None, _start_rx_thread=False, _quit_evt=stop)
+    exp = _Experiment(stop, 100)
+
+    t = threading.Thread(target=_publish, args=(range(1, 101), ), kwargs={'wait': 0.1}, daemon=True)
+    t.start()
+    do_loop(exp, None, flyvr_state=state)
+    t.join()
+
+    assert exp.frames == list(range(1, 101))
+    assert state.EXPERIMENT_FICTRAC_FRAME_NUM == 100
@@ -0,0 +1,27 @@
+import os
+
+import pytest
+
+from flyvr.fictrac.frame_waiter import FrameWaiter, benchmark_strategies
+
+
+def test_frame_waiter_strategies():
+    with pytest.raises(ValueError):
+        FrameWaiter('poll')
+
+    if os.name != 'nt':
+        # no named events
+        assert FrameWaiter('event', event_name='FicTracStateSHMEM_EVENT_test').strategy == 'adaptive'
+
+
+def test_frame_waiter_benchmark():
+    spin, adaptive = benchmark_strategies(('spin', 'adaptive'), fps=100., duration=1.0)
+
+    for s in (spin, adaptive):
+        assert s['frames'] > 90
+        assert s['missed'] < 5
+        assert s['period'] == pytest.approx(0.01, rel=0.2)
+
+    # the adaptive strategy sleeps for most of every frame
+    assert adaptive['cpu_fraction'] < 0.5 * spin['cpu_fraction']
+    assert adaptive['true_latency_mean'] < 0.005
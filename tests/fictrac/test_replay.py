@@ -0,0 +1,94 @@
+import time
+
+import h5py
+import numpy as np
+import pytest
+
+from flyvr.common import SharedState
+from flyvr.fictrac.replay import ReplayFictrac, FicTracDriverReplay
+from flyvr.fictrac.shmem_transfer_data import fictrac_state_to_vec, NUM_FICTRAC_FIELDS
+
+
+def _write_h5(path, rows, **kwargs):
+    with h5py.File(path, mode='w') as f:
+        f.create_dataset('/fictrac/output', data=rows, **kwargs)
+
+
+def _rows(n):
+    rows = np.random.RandomState(42).uniform(-10, 10, (n, NUM_FICTRAC_FIELDS))
+    rows[:, 0] = np.arange(1, n + 1)
+    rows[:, 22] = np.arange(n) + 100
+    return rows
+
+
+@pytest.mark.parametrize('chunked', (True, False))
+def test_replay_rows(tmpdir, chunked):
+    path = tmpdir.join('replay.h5').strpath
+    rows = _rows(25)
+    _write_h5(path, rows, **({'chunks': (4, NUM_FICTRAC_FIELDS)} if chunked else {}))
+
+    r = ReplayFictrac(path)
+    r.BLOCK_ROWS = 10
+    assert (r._rows is None) == chunked
+
+    for idx in (0, 1, 12, 24, 3):
+        fn, ts = r._send_row(idx)
+        assert (fn, ts) == (idx + 1, rows[idx, 21])
+        # every field, including all of abs_ori_lab_vec
+        np.testing.assert_array_equal(fictrac_state_to_vec(r._fictrac_state), rows[idx])
+
+
+def test_replay_rate(tmpdir):
+    path = tmpdir.join('replay.h5').strpath
+    n = 20000
+    _write_h5(path, _rows(n), chunks=(2048, NUM_FICTRAC_FIELDS))
+
+    r = ReplayFictrac(path)
+    t0 = time.perf_counter()
+    for idx in range(n):
+        r._send_row(idx)
+    rate = n / (time.perf_counter() - t0)
+
+    assert rate > 5000
+
+
+def test_replay_modes(tmpdir):
+    path = tmpdir.join('replay.h5').strpath
+    n = 2000
+    _write_h5(path, _rows(n))
+
+    r = ReplayFictrac(path)
+    with pytest.raises(ValueError):
+        r.replay(mode='lockstep')
+
+    r.replay(mode='fast')
+    assert r._fictrac_state.frame_cnt == n
+
+    class _Experiment(object):
+
+        def __init__(self):
+            self.frames = []
+
+        def process_state(self, state):
+            self.frames.append(state.frame_cnt)
+
+    state = SharedState(None, None, _start_rx_thread=False)
+    exp = _Experiment()
+    r = FicTracDriverReplay.StateReplayFictrac(state, exp, path)
+    r.replay(mode='lockstep')
+    # (and the frame sent in the constructor)
+    assert exp.frames[-n:] == list(range(1, n + 1))
+    assert state.EXPERIMENT_FICTRAC_FRAME_NUM == n
+
+    r.replay(fps=1000., mode='realtime')
+
+
+def test_lockstep_requires_experiment(tmpdir):
+    from flyvr.common.build_arg_parser import parse_arguments
+
+    path = tmpdir.join('replay.h5').strpath
+    _write_h5(path, _rows(10))
+
+    options = parse_arguments(['-f', path, '--fictrac_replay_mode', 'lockstep', '--experiment_process'])
+    with pytest.raises(ValueError, match='lockstep replay requires an experiment'):
+        FicTracDriverReplay(path).run(options)
@@ -0,0 +1,62 @@
+import numpy as np
+
+from flyvr.fictrac.shmem_transfer_data import SHMEMFicTracState, FicTracStateBatch, fictrac_state_to_vec, \
+    NUM_FICTRAC_FIELDS
+
+
+def _state(i):
+    s = SHMEMFicTracState()
+    s.frame_cnt = i
+    s.del_rot_cam_vec = (i + 0.1, i + 0.2, i + 0.3)
+    s.del_rot_error = i + 0.4
+    s.del_rot_lab_vec = (i + 0.5, i + 0.6, i + 0.7)
+    s.abs_ori_cam_vec = (i + 0.8, i + 0.9, i + 1.0)
+    s.abs_ori_lab_vec = (i + 1.1, i + 1.2, i + 1.3)
+    s.posx, s.posy, s.heading, s.direction = i + 1.4, i + 1.5, i + 1.6, i + 1.7
+    s.speed, s.intx, s.inty, s.timestamp = i + 1.8, i + 1.9, i + 2.0, i + 2.1
+    s.seq_num = i + 3
+    return s
+
+
+def _row(i):
+    return np.array([i] + [i + 0.1 * n for n in range(1, 22)] + [i + 3])
+
+
+class _Logger(object):
+
+    def __init__(self):
+        self.logged = []
+
+    def log(self, dataset_name, obj):
+        assert dataset_name == '/fictrac/output'
+        self.logged.append(obj)
+
+
+def test_fictrac_state_to_vec():
+    v = fictrac_state_to_vec(_state(5))
+    assert v.shape == (NUM_FICTRAC_FIELDS,)
+    np.testing.assert_allclose(v, _row(5))
+
+
+def test_fictrac_state_batch():
+    logger = _Logger()
+    batch = FicTracStateBatch(logger, max_frames=4, max_ms=1e6)
+
+    for i in range(10):
+        s = _state(i)
+        batch.append(s)
+        # the state is copied, not referenced
+        s.frame_cnt = -1
+
+    assert [len(b) for b in logger.logged] == [4, 4]
+    batch.flush()
+    batch.flush()
+    assert [len(b) for b in logger.logged] == [4, 4, 2]
+
+    np.testing.assert_allclose(np.concatenate(logger.logged), np.stack([_row(i) for i in range(10)]))
+
+    # a batch is also logged once its first frame is max_ms old
+    logger = _Logger()
+    batch = FicTracStateBatch(logger, max_frames=4, max_ms=0)
+    batch.append(_state(0))
+    assert len(logger.logged) == 1
@@ -31,3 +31,185 @@ def test_io_a_output(tmpdir):
 
     with h5py.File(shared_state.logger.log_filename, mode='r') as h5:
         assert h5['daq']['chunk_synchronization_info'].shape[-1] == SampleChunk.SYNCHRONIZATION_INFO_NUM_FIELDS
+
+
+def _run_simulated(tmpdir, stim=None, duration=0.6, late=None, fifo=None, ao_ids=('ao0',), ai_ids=('ai0', 'ai1')):
+    import time
+
+    from flyvr.audio.io_task import SimulatedIOTask
+    from flyvr.audio.simulated_daq import DAQmx_Val_Rising
+
+    with DatasetLogServer() as log_server:
+
+        shared_state = SharedState(None, logger=log_server.start_logging_server(tmpdir.join('test.h5').strpath))
+
+        taskAO = SimulatedIOTask(dev_name='SimDev1', cha_ids=list(ao_ids), cha_type="output",
+                                 num_samples_per_chan=DAQ_NUM_OUTPUT_SAMPLES,
+                                 num_samples_per_event=DAQ_NUM_OUTPUT_SAMPLES_PER_EVENT,
+                                 shared_state=shared_state)
+        if fifo is not None:
+            taskAO.ONBOARD_FIFO_SAMPLES = fifo
+        if late is not None:
+            taskAO.inject_late_callbacks(*late)
+
+        taskAI = SimulatedIOTask(dev_name='SimDev1', cha_ids=list(ai_ids), cha_type="input",
+                                 num_samples_per_chan=1000, num_samples_per_event=1000,
+                                 shared_state=shared_state)
+
+        if stim is not None:
+            taskAO.set_signal_producer(stim)
+        taskAO.CfgDigEdgeStartTrig("ai/StartTrigger", DAQmx_Val_Rising)
+
+        taskAO.StartTask()
+        taskAI.StartTask()
+        time.sleep(duration)
+
+        for t in (taskAI, taskAO):
+            t.StopTask()
+            t.stop()
+            t.ClearTask()
+
+    return shared_state.logger.log_filename, taskAO, taskAI
+
+
+def test_simulated_io_loopback(tmpdir):
+    import h5py
+    import numpy as np
+
+    from flyvr.audio.stimuli import SinStim
+
+    stim = SinStim(frequency=200, amplitude=2.0, phase=0.0, sample_rate=10000, duration=2000)
+
+    fn, taskAO, taskAI = _run_simulated(tmpdir, stim=stim)
+
+    with h5py.File(fn, mode='r') as h5:
+        samples = h5['daq']['input']['samples'][:]
+        sync = h5['daq']['chunk_synchronization_info'][:]
+
+    stats = taskAI.callback_stats()
+    assert stats['n'] >= 3
+    assert samples.shape == (stats['n'] * 1000, 2)
+
+    # the first (pre start) chunk is silence, the playlist follows sample accurately on ai0. nothing on ai1
+    # (the samples are stored with 8 decimal digits)
+    n = DAQ_NUM_OUTPUT_SAMPLES_PER_EVENT
+    np.testing.assert_allclose(samples[:n, 0], 0., atol=1e-7)
+    np.testing.assert_allclose(samples[n:, 0], stim.data[:len(samples) - n], atol=1e-7)
+    np.testing.assert_allclose(samples[:, 1], 0., atol=1e-7)
+
+    assert sync.shape[-1] == SampleChunk.SYNCHRONIZATION_INFO_NUM_FIELDS
+    assert len(sync) > (len(samples) // n)
+    assert taskAO.callback_stats()['underflows'] == 0
+
+
+def test_simulated_io_late_callbacks(tmpdir):
+    import h5py
+    import numpy as np
+
+    from flyvr.audio.stimuli import ConstantStim
+
+    stim = ConstantStim(amplitude=1.0, sample_rate=10000, duration=100)
+
+    # with a tiny output FIFO every 4th callback being 50ms late underflows the output
+    fn, taskAO, _ = _run_simulated(tmpdir, stim=stim, late=(0.05, 4), fifo=10)
+
+    stats = taskAO.callback_stats()
+    assert stats['underflows'] > 0
+    assert stats['lateness_max'] >= 0.05
+
+    with h5py.File(fn, mode='r') as h5:
+        samples = h5['daq']['input']['samples'][:, 0]
+
+    # the lost samples are read back as gaps in the output
+    samples = np.round(samples[DAQ_NUM_OUTPUT_SAMPLES_PER_EVENT:], 6)
+    assert set(np.unique(samples)) == {0., 1.}
+    assert 0 < np.count_nonzero(samples == 0) <= stats['samples_lost']
+
+
+def test_simulated_io_multichannel_output(tmpdir):
+    import h5py
+    import numpy as np
+
+    from flyvr.audio.stimuli import AudioStimPlaylist
+
+    # a two channel item, then a single channel item (silent on ao1)
+    pl = AudioStimPlaylist.fromitems([
+        {'both': {'name': 'mixed', 'stimuli': [
+            {'name': 'sin', 'frequency': 100, 'amplitude': 1.0, 'sample_rate': 10000, 'duration': 200},
+            {'name': 'constant', 'amplitude': 2.0, 'sample_rate': 10000, 'duration': 200}]}},
+        {'one': {'name': 'constant', 'amplitude': 3.0, 'sample_rate': 10000, 'duration': 200}},
+    ], random=None)
+    both, _ = list(pl)
+    # (the DAQ process checks this against the configured outputs)
+    assert pl.num_channels == 2
+    expected = next(both.data_generator()).data.copy()
+
+    fn, taskAO, taskAI = _run_simulated(tmpdir, stim=pl, ao_ids=('ao0', 'ao1'), ai_ids=('ai0', 'ai1', 'ai2'))
+
+    with h5py.File(fn, mode='r') as h5:
+        samples = h5['daq']['input']['samples'][:]
+        sync = h5['daq']['chunk_synchronization_info']
+        assert sync.attrs['output_channel_1'] == b'ao1'
+        nrows = len(sync)
+
+    n = DAQ_NUM_OUTPUT_SAMPLES_PER_EVENT
+    played = samples[n:n + 4000]
+    assert len(played) == 4000
+    np.testing.assert_allclose(played[:2000, :2], expected, atol=1e-7)
+    np.testing.assert_allclose(played[2000:, 0], 3.0, atol=1e-7)
+    np.testing.assert_allclose(played[2000:, 1], 0.0, atol=1e-7)
+    np.testing.assert_allclose(samples[:, 2], 0.0, atol=1e-7)
+
+    # one sync row per block, however many channels
+    assert nrows >= (len(samples) // n)
+
+
+def test_simulated_io_raw_input(tmpdir):
+    import time
+
+    import h5py
+    import numpy as np
+
+    from flyvr.analysis import _df_from_h5group
+    from flyvr.audio.io_task import SimulatedIOTask
+    from flyvr.audio.stimuli import SinStim
+
+    stim = SinStim(frequency=200, amplitude=2.0, phase=0.0, sample_rate=10000, duration=2000)
+
+    with DatasetLogServer() as log_server:
+
+        shared_state = SharedState(None, logger=log_server.start_logging_server(tmpdir.join('test.h5').strpath))
+
+        taskAO = SimulatedIOTask(dev_name='SimDev2', cha_ids=['ao0'], cha_type="output",
+                                 num_samples_per_chan=DAQ_NUM_OUTPUT_SAMPLES,
+                                 num_samples_per_event=DAQ_NUM_OUTPUT_SAMPLES_PER_EVENT,
+                                 shared_state=shared_state)
+        taskAI = SimulatedIOTask(dev_name='SimDev2', cha_ids=['ai0'], cha_names=['copy'], cha_type="input",
+                                 num_samples_per_chan=1000, num_samples_per_event=1000,
+                                 shared_state=shared_state, raw=True)
+        taskAO.set_signal_producer(stim)
+        taskAO.CfgDigEdgeStartTrig("ai/StartTrigger", 0)
+
+        taskAO.StartTask()
+        taskAI.StartTask()
+        time.sleep(0.3)
+
+        for t in (taskAI, taskAO):
+            t.StopTask()
+            t.stop()
+            t.ClearTask()
+
+    with h5py.File(shared_state.logger.log_filename, mode='r') as h5:
+        ds = h5['daq']['input']['samples']
+        assert ds.dtype == np.int16
+        assert ds.attrs['scaling_coefficients'].shape == (1, 4)
+
+        raw = _df_from_h5group(ds, scaled=False)
+        volts = _df_from_h5group(ds)
+
+    assert raw['copy'].dtype == np.int16
+    assert volts['copy'].dtype == np.float64
+
+    # to within the resolution of the ADC
+    n = DAQ_NUM_OUTPUT_SAMPLES_PER_EVENT
+    np.testing.assert_allclose(volts['copy'].values[n:], stim.data[:len(volts) - n], atol=10. / 32768)
@@ -0,0 +1,46 @@
+import numpy as np
+
+from flyvr.video.frame_timing import FrameTimingLog
+
+
+class _Logger(object):
+
+    def __init__(self):
+        self.rows = []
+        self.attrs = {}
+
+    def create(self, name, **kwargs):
+        pass
+
+    def log(self, name, obj, attribute_name=None):
+        if attribute_name is None:
+            self.rows.extend(obj.tolist())
+        else:
+            self.attrs[attribute_name] = obj
+
+
+def test_frame_timing():
+    logger = _Logger()
+    ft = FrameTimingLog(logger, 1 / 60., batch_size=4, summary_interval=0.1)
+
+    # the third frame missed one refresh, the sixth two
+    intervals = [1, 1, 2, 1, 1, 3, 1, 1, 1]
+    flips = 1. + np.cumsum([0] + intervals) / 60.
+    ids = ['a'] * 5 + ['b'] * 5
+    missed = [ft.record(i, t, 0.001 * i, s) for i, (t, s) in enumerate(zip(flips, ids))]
+    assert missed == [0, 0, 0, 1, 0, 0, 2, 0, 0, 0]
+
+    st = ft.stats()
+    assert (st['frames'], st['missed']) == (10, 3)
+    assert st['per_stimulus'] == {'a': {'frames': 5, 'missed': 1}, 'b': {'frames': 5, 'missed': 2}}
+
+    # logged in batches, the rest on close
+    assert len(logger.rows) == 8
+    ft.close()
+    rows = np.array(logger.rows)
+    assert rows.shape == (10, len(FrameTimingLog.FIELDS))
+    assert np.array_equal(rows[:, 0], np.arange(10))
+    assert np.isnan(rows[0, 3])
+    assert np.allclose(rows[1:, 3], np.array(intervals) / 60.)
+    assert np.array_equal(rows[:, 4], missed)
+    assert logger.attrs['column_4'] == 'missed_refreshes'
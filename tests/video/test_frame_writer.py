@@ -0,0 +1,63 @@
+import time
+import threading
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from flyvr.video.frame_writer import FrameWriter, POLICY_DROP, POLICY_BLOCK
+
+
+def _frame(i, size=(64, 48)):
+    return np.full((size[1], size[0], 3), i, dtype=np.uint8)
+
+
+def test_jpegs(tmpdir):
+    path = tmpdir.join('frames').strpath
+    w = FrameWriter(path, (64, 48), policy=POLICY_BLOCK, maxsize=2, workers=3)
+    for i in range(20):
+        assert w.put(_frame(10 * i), 'stim_image%05d' % i)
+    w.close()
+
+    assert (w.written, w.dropped) == (20, 0)
+    img = np.asarray(Image.open(tmpdir.join('frames', 'stim_image00007.jpg').strpath))
+    assert img.shape == (48, 64, 3)
+    assert abs(int(img.mean()) - 70) <= 2
+
+
+class _SlowWriter(FrameWriter):
+
+    def __init__(self, *args, **kwargs):
+        self.go = threading.Event()
+        self.names = []
+        super().__init__(*args, **kwargs)
+
+    def _write(self, frame, name):
+        self.go.wait()
+        self.names.append(name)
+
+
+@pytest.mark.parametrize('policy', [POLICY_DROP, POLICY_BLOCK])
+def test_policy(tmpdir, policy):
+    w = _SlowWriter(tmpdir.strpath, (64, 48), policy=policy, maxsize=4, workers=1)
+    if policy == POLICY_BLOCK:
+        threading.Timer(0.3, w.go.set).start()
+
+    # (the worker holds one, the queue the next 4)
+    queued = [w.put(_frame(0), '0')]
+    time.sleep(0.1)
+    queued += [w.put(_frame(i), str(i)) for i in range(1, 10)]
+    w.go.set()
+    w.close()
+
+    if policy == POLICY_DROP:
+        assert queued.count(False) == w.dropped == 5
+        assert w.names == [str(i) for i in range(5)]
+    else:
+        assert all(queued) and (w.dropped == 0)
+        assert w.names == [str(i) for i in range(10)]
+
+
+def test_bad_policy(tmpdir):
+    with pytest.raises(ValueError):
+        FrameWriter(tmpdir.strpath, (64, 48), policy='wait')
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from flyvr.video.maya_assets import (build_image_stack, maya_trajectory, opt_trajectory, window_images,
+                                     IMAGE_ANGLES, _data_filename, _WindowImages)
+
+
+def test_image_stack(tmpdir):
+    path = tmpdir.join('stack.npy').strpath
+    build_image_stack(path)
+
+    stack = np.load(path, mmap_mode='r')
+    assert stack.shape[0] == len(IMAGE_ANGLES) == 360
+    assert stack.dtype == np.uint8
+    for i in (0, 179, 359):
+        img = Image.open(_data_filename('femalefly360deg/fly%d.png' % IMAGE_ANGLES[i])).convert('L')
+        assert np.array_equal(stack[i], np.asarray(img))
+
+
+def _load(subdir, suffix):
+    return [np.load(_data_filename('%s%s_%s.npy' % (subdir, n, suffix)))
+            for n in ('angles', 'tops', 'bottoms', 'lefts', 'rights')]
+
+
+def test_maya_trajectory():
+    angles, ty, by, lx, rx = _load('', 'fly19')
+    a, pos, size = maya_trajectory()
+
+    assert np.array_equal(a, angles)
+    assert np.array_equal(pos, [(lx + rx) / 2, (ty + by) / 2])
+    assert np.array_equal(size, [rx - lx, ty - by])
+    with pytest.raises(ValueError):
+        pos[0, 0] = 1
+
+
+def test_opt_trajectory():
+    v = _load('forwardvelocity/', 'optstim')
+    p = _load('pulse/', 'optstim')
+
+    # alternating blocks of 300 frames
+    angles = np.concatenate([x[ii:ii + 300] for ii in range(0, 3300, 300) for x in (v[0], p[0])])
+    pos_x = np.concatenate([(x[3][ii:ii + 300] + x[4][ii:ii + 300]) / 2 for ii in range(0, 3300, 300)
+                            for x in (v, p)])
+    size_y = np.concatenate([x[1][ii:ii + 300] - x[2][ii:ii + 300] for ii in range(0, 3300, 300) for x in (v, p)])
+
+    a, pos, size = opt_trajectory()
+    assert a.shape == (6600, )
+    assert pos.shape == size.shape == (2, 6600)
+    assert np.array_equal(a, angles)
+    assert np.array_equal(pos[0], pos_x)
+    assert np.array_equal(size[1], size_y)
+
+
+def test_window_images_preload(monkeypatch):
+    created = []
+
+    def _new(self, i):
+        created.append(i)
+        return i
+
+    # (without creating ImageStims, which needs a window)
+    monkeypatch.setattr(_WindowImages, '_new', _new)
+
+    class _Window(object):
+        pass
+
+    win = _Window()
+    angles, _, _ = maya_trajectory()
+    window_images(win).preload(np.unique(angles))
+    assert sorted(created) == np.unique(angles).tolist()
+
+    # shared by every stimulus in the window, and nothing is created while drawing
+    imgs = window_images(win)
+    imgs.preload(np.unique(angles))
+    assert [imgs[a] for a in angles[:10]] == angles[:10].tolist()
+    assert len(created) == len(np.unique(angles))
+
+    assert window_images(_Window()) is not imgs